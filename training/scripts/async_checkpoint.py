@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Asynchronous Adapter Checkpoints for StoryForge Fine-Tuning
+Snapshots LoRA weights, optimizer, scheduler and RNG state, and writes them on a background thread
+"""
+
+import copy
+import dataclasses
+import json
+import os
+import random
+import re
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from peft import PeftModel, get_peft_model_state_dict
+from peft.utils import CONFIG_NAME as ADAPTER_CONFIG_NAME
+from peft.utils import SAFETENSORS_WEIGHTS_NAME as ADAPTER_WEIGHTS_NAME
+from safetensors.torch import save_file
+from transformers.trainer import OPTIMIZER_NAME, SCHEDULER_NAME, TRAINER_STATE_NAME
+from transformers.trainer_callback import ExportableState
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR, SaveStrategy
+
+TOKENIZER_REFERENCE_NAME = "tokenizer_reference.json"
+# Everything a resumed run reads; a checkpoint missing any of them is incomplete
+REQUIRED_FILES = [ADAPTER_WEIGHTS_NAME, ADAPTER_CONFIG_NAME, OPTIMIZER_NAME, SCHEDULER_NAME, TRAINER_STATE_NAME]
+_CHECKPOINT_DIR = re.compile(rf"^{PREFIX_CHECKPOINT_DIR}-(\d+)$")
+
+
+def snapshot(value: Any) -> Any:
+    """Deep copy of a (nested) state dict with every tensor copied to CPU, safe to write while training goes on"""
+    if isinstance(value, torch.Tensor):
+        return value.detach().to("cpu", copy=True)
+    if isinstance(value, dict):
+        return {key: snapshot(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(snapshot(item) for item in value)
+    return copy.deepcopy(value)
+
+
+def rng_state() -> Dict[str, Any]:
+    """This process's RNG state, in the layout the Trainer restores on resume"""
+    states = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "cpu": torch.random.get_rng_state()
+    }
+    if torch.cuda.is_available():
+        states["cuda"] = torch.cuda.random.get_rng_state_all() if dist.is_initialized() else torch.cuda.random.get_rng_state()
+    return states
+
+
+def write_checkpoint(directory: Path, state: Dict[str, Any]):
+    """Write a snapshot to directory.tmp, then rename it into place so a checkpoint is never half-written"""
+    tmp = directory.with_name(directory.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    state["peft_config"].save_pretrained(str(tmp))
+    save_file(state["adapter"], tmp / ADAPTER_WEIGHTS_NAME, metadata={"format": "pt"})
+    torch.save(state["optimizer"], tmp / OPTIMIZER_NAME)
+    torch.save(state["scheduler"], tmp / SCHEDULER_NAME)
+    for name, states in state["rng"].items():
+        torch.save(states, tmp / name)
+    with open(tmp / TRAINER_STATE_NAME, 'w', encoding='utf-8') as f:
+        f.write(state["trainer_state"])
+    with open(tmp / TOKENIZER_REFERENCE_NAME, 'w', encoding='utf-8') as f:
+        json.dump(state["tokenizer_reference"], f, indent=2)
+
+    if directory.exists():
+        shutil.rmtree(directory)
+    os.replace(tmp, directory)
+
+
+def latest_checkpoint(output_dir) -> Optional[Path]:
+    """Newest checkpoint-<step> directory under output_dir with every file a resume needs"""
+    output_dir = Path(output_dir)
+    if not output_dir.is_dir():
+        return None
+    checkpoints = []
+    for path in output_dir.iterdir():
+        match = _CHECKPOINT_DIR.match(path.name)
+        if match and path.is_dir():
+            checkpoints.append((int(match.group(1)), path))
+    for _, path in sorted(checkpoints, reverse=True):
+        if not all((path / name).is_file() for name in REQUIRED_FILES):
+            continue
+        try:
+            with open(path / TRAINER_STATE_NAME, 'r', encoding='utf-8') as f:
+                json.load(f)
+        except (OSError, ValueError):
+            continue
+        return path
+    return None
+
+
+class CheckpointWriter:
+    """Write checkpoints one at a time on a background thread
+
+    At most one checkpoint is being written while training continues; a
+    new one waits for it, so snapshots never pile up in memory. A failed
+    write is raised on the training thread at the next submit or wait.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint-writer")
+        self._pending: Optional[Future] = None
+
+    def submit(self, write: Callable[[], None]):
+        self.wait()
+        self._pending = self._executor.submit(write)
+
+    def wait(self):
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+
+class AsyncCheckpointMixin:
+    """Trainer mixin that checkpoints LoRA adapters without pausing training
+
+    A checkpoint holds the adapter weights and config, optimizer and
+    scheduler state, every process's RNG state and the trainer state, in
+    the layout Trainer.train(resume_from_checkpoint=...) reads. The
+    tokenizer is not copied; tokenizer_reference.json names the tokenizer
+    to load instead. Tensors are copied to CPU on the training thread
+    (fast: LoRA weights and their optimizer state are small) and
+    serialized on a background thread. Models without LoRA fall back to
+    the Trainer's own checkpoints.
+    """
+
+    # Where a checkpoint's tokenizer comes from, e.g. {"name_or_path": ..., "revision": ...}
+    tokenizer_reference: Dict[str, Any] = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkpoint_writer = CheckpointWriter()
+
+    def _save_checkpoint(self, model, trial):
+        peft_model = self.accelerator.unwrap_model(self.model)
+        if not isinstance(peft_model, PeftModel):
+            return super()._save_checkpoint(model, trial)
+
+        if self.hp_search_backend is None and trial is None:
+            self.store_flos()
+        step = self.state.global_step
+        run_dir = Path(self._get_output_dir(trial=trial))
+        directory = run_dir / f"{PREFIX_CHECKPOINT_DIR}-{step}"
+
+        if self.args.save_strategy in [SaveStrategy.STEPS, SaveStrategy.EPOCH] and self.state.best_global_step:
+            best_dir = run_dir / f"{PREFIX_CHECKPOINT_DIR}-{self.state.best_global_step}"
+            # The best checkpoint may be the one about to be written
+            if self.state.best_global_step == step or best_dir.exists():
+                self.state.best_model_checkpoint = str(best_dir)
+
+        # Every process contributes its RNG state; rank 0 writes all of them
+        rng = rng_state()
+        if self.args.world_size > 1:
+            states = [None] * self.args.world_size
+            dist.all_gather_object(states, rng)
+            rng_files = {f"rng_state_{rank}.pth": states[rank] for rank in range(self.args.world_size)}
+        else:
+            rng_files = {"rng_state.pth": rng}
+        if not self.args.should_save:
+            return
+
+        for callback in self.callback_handler.callbacks + [self.control]:
+            if isinstance(callback, ExportableState):
+                name = callback.__class__.__name__
+                if isinstance(self.state.stateful_callbacks[name], list):
+                    self.state.stateful_callbacks[name].append(callback.state())
+                else:
+                    self.state.stateful_callbacks[name] = callback.state()
+
+        adapter = peft_model.active_adapter
+        state = {
+            "adapter": snapshot(get_peft_model_state_dict(peft_model, adapter_name=adapter)),
+            "peft_config": copy.deepcopy(peft_model.peft_config[adapter]),
+            "optimizer": snapshot(self.optimizer.state_dict()),
+            "scheduler": snapshot(self.lr_scheduler.state_dict()),
+            "rng": rng_files,
+            "trainer_state": json.dumps(dataclasses.asdict(self.state), indent=2, sort_keys=True) + "\n",
+            "tokenizer_reference": dict(self.tokenizer_reference)
+        }
+
+        def write():
+            write_checkpoint(directory, state)
+            self._rotate_checkpoints(use_mtime=False, output_dir=str(run_dir))
+
+        self.checkpoint_writer.submit(write)
+
+    def _load_best_model(self):
+        self.checkpoint_writer.wait()
+        return super()._load_best_model()
+
+    def train(self, *args, **kwargs):
+        try:
+            return super().train(*args, **kwargs)
+        finally:
+            self.checkpoint_writer.wait()
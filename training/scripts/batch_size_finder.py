@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Micro-Batch Size Finder for StoryForge Fine-Tuning
+Probes batch sizes on the longest training batch and keeps the fastest one that fits in memory
+"""
+
+import gc
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from training_callbacks import current_rss_mb
+
+# Leave room for the optimizer state, evaluation and the rest of the host
+DEFAULT_MEMORY_FRACTION = 0.85
+DEFAULT_MAX_BATCH_SIZE = 64
+# Timed forward/backward passes per batch size, after one untimed warmup pass
+PROBE_REPEATS = 2
+RSS_SAMPLE_INTERVAL = 0.005
+
+
+@dataclass
+class BatchProbe:
+    """Outcome of training on the longest batch at one micro-batch size"""
+    batch_size: int
+    seconds: float = 0.0  # One forward and backward pass
+    samples_per_second: float = 0.0
+    tokens_per_second: float = 0.0
+    peak_memory_gb: float = 0.0
+    fits: bool = False
+    error: Optional[str] = None
+
+
+def memory_limit_gb(device: torch.device, fraction: float = DEFAULT_MEMORY_FRACTION) -> float:
+    """fraction of the memory available to training on device: GPU memory, or RAM within any cgroup limit"""
+    if device.type == "cuda":
+        return torch.cuda.get_device_properties(device).total_memory * fraction / 1024 ** 3
+    total = 0
+    try:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        pass
+    # Containers see the host's RAM in sysconf but are killed at their cgroup limit
+    for limit_file in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            limit = Path(limit_file).read_text().strip()
+        except OSError:
+            continue
+        if limit.isdigit() and (not total or int(limit) < total):
+            total = int(limit)
+    return total * fraction / 1024 ** 3
+
+
+def candidate_batch_sizes(effective_batch_size: int, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE) -> List[int]:
+    """Micro-batch sizes that divide the effective batch size exactly, smallest first"""
+    return [size for size in range(1, min(effective_batch_size, max_batch_size) + 1) if effective_batch_size % size == 0]
+
+
+def longest_batch(dataset, data_collator: Callable, batch_size: int) -> Dict[str, torch.Tensor]:
+    """The batch_size longest examples (or packed blocks) collated together: the worst case for memory"""
+    lengths = np.asarray(dataset.lengths)
+    longest = np.argsort(lengths, kind="stable")[::-1][:batch_size]
+    return data_collator([dataset[int(index)] for index in longest])
+
+
+class PeakMemory:
+    """Peak memory in GB while the block runs: CUDA allocations, or process RSS sampled on a thread"""
+
+    def __init__(self, device: torch.device):
+        self.device = device
+        self.peak_gb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_gb = max(self.peak_gb, (current_rss_mb() or 0) / 1024)
+            self._stop.wait(RSS_SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        if self.device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(self.device)
+        else:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.device.type == "cuda":
+            self.peak_gb = torch.cuda.max_memory_allocated(self.device) / 1024 ** 3
+        else:
+            self._stop.set()
+            self._thread.join()
+            self.peak_gb = max(self.peak_gb, (current_rss_mb() or 0) / 1024)
+
+
+def current_memory_gb(device: torch.device) -> float:
+    """Memory in GB in use right now, measured the way PeakMemory measures peaks"""
+    if device.type == "cuda":
+        return torch.cuda.memory_allocated(device) / 1024 ** 3
+    return (current_rss_mb() or 0) / 1024
+
+
+def predict_peak_gb(baseline_gb: float, probes: List[BatchProbe], batch_size: int) -> float:
+    """Peak memory at batch_size from a line through the baseline (batch 0) and the probed peaks
+
+    Activations and gradients of the batch grow linearly with its size on
+    top of the memory the model already holds. The prediction is never
+    below the largest peak seen so far.
+    """
+    sizes = [0] + [probe.batch_size for probe in probes]
+    peaks = [baseline_gb] + [probe.peak_memory_gb for probe in probes]
+    slope, intercept = np.polyfit(sizes, peaks, 1)
+    return float(max(slope * batch_size + intercept, max(peaks)))
+
+
+def is_out_of_memory(error: Exception) -> bool:
+    return isinstance(error, (torch.cuda.OutOfMemoryError, MemoryError)) or "out of memory" in str(error).lower()
+
+
+def probe_batch_size(model, batch: Dict[str, torch.Tensor], memory_limit: float, bf16: bool = False,
+                     repeats: int = PROBE_REPEATS) -> BatchProbe:
+    """Time forward and backward passes of one batch and record the peak memory they reach"""
+    device = model.device
+    batch = {key: value.to(device) for key, value in batch.items()}
+    probe = BatchProbe(batch_size=len(batch["input_ids"]))
+    model.train()
+    try:
+        with PeakMemory(device) as memory:
+            for repeat in range(repeats + 1):
+                if repeat == 1:
+                    start = time.perf_counter()
+                with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=bf16):
+                    loss = model(**batch).loss
+                loss.backward()
+                model.zero_grad(set_to_none=True)
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            probe.seconds = (time.perf_counter() - start) / repeats
+    except Exception as e:
+        if not is_out_of_memory(e):
+            raise
+        probe.error = "out of memory"
+    finally:
+        loss = None
+        model.zero_grad(set_to_none=True)
+        gc.collect()
+        if device.type == "cuda":
+            torch.cuda.empty_cache()
+
+    if probe.error is None:
+        probe.peak_memory_gb = memory.peak_gb
+        probe.samples_per_second = probe.batch_size / probe.seconds
+        probe.tokens_per_second = batch["input_ids"].numel() / probe.seconds
+        probe.fits = probe.peak_memory_gb <= memory_limit
+    return probe
+
+
+def find_batch_size(model, dataset, data_collator: Callable, effective_batch_size: int, memory_limit: float,
+                    bf16: bool = False, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                    log: Callable[[str], Any] = print) -> Tuple[Optional[BatchProbe], List[BatchProbe]]:
+    """Probe increasing micro-batch sizes and return the fastest that fits (None if none does) and all probes
+
+    Probing stops at the first size that runs out of memory or exceeds
+    memory_limit, since larger batches only need more. A size whose peak,
+    extrapolated from the smaller probes, would exceed memory_limit is never
+    run: on CPU the kernel kills a process that runs out of RAM before it
+    can report anything.
+    """
+    baseline_gb = current_memory_gb(model.device)
+    probes = []
+    for batch_size in candidate_batch_sizes(effective_batch_size, max_batch_size):
+        if probes:
+            predicted_gb = predict_peak_gb(baseline_gb, probes, batch_size)
+            if predicted_gb > memory_limit:
+                log(f"  batch {batch_size:>3}: skipped, {predicted_gb:.2f} GB predicted "
+                    f"(over the {memory_limit:.1f} GB limit)")
+                break
+        probe = probe_batch_size(model, longest_batch(dataset, data_collator, batch_size), memory_limit, bf16=bf16)
+        probes.append(probe)
+        if probe.error:
+            log(f"  batch {batch_size:>3}: {probe.error}")
+            break
+        log(f"  batch {batch_size:>3}: {probe.samples_per_second:8.2f} samples/sec "
+            f"{probe.tokens_per_second:10,.0f} tokens/sec {probe.peak_memory_gb:7.2f} GB peak"
+            f"{'' if probe.fits else f' (over the {memory_limit:.1f} GB limit)'}")
+        if not probe.fits:
+            break
+    fitting = [probe for probe in probes if probe.fits]
+    best = max(fitting, key=lambda probe: probe.samples_per_second) if fitting else None
+    return best, probes
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Training Throughput Benchmark for StoryForge Fine-Tuning
+Runs a fixed number of StoryForgeTrainer steps on CPU, offline, and reports comparable JSON results
+"""
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+import torch
+import transformers
+from transformers import Qwen2Config, Qwen2ForCausalLM
+
+from cpu_performance import native_bf16, physical_cores
+from fine_tune_model import ModelConfig, StoryForgeTrainer
+from preprocess_and_save import load_tokenized_dataset
+from token_store import TokenStore, TokenStoreWriter
+
+BENCHMARK_DIR = "training/logs/benchmarks"
+
+# torch's thread count at startup, restored for every default-mode run
+DEFAULT_THREADS = torch.get_num_threads()
+
+# A randomly initialised model with Qwen2.5's architecture, small enough to step quickly on any CPU
+TINY_MODEL = {
+    "vocab_size": 16384,
+    "hidden_size": 256,
+    "intermediate_size": 704,
+    "num_hidden_layers": 4,
+    "num_attention_heads": 4,
+    "num_key_value_heads": 2,
+    "max_position_embeddings": 32768,
+    "tie_word_embeddings": True
+}
+
+# Synthetic corpus mix: short prompts and stories of widely varying length
+PROMPT_FRACTION = 0.3
+PROMPT_LENGTHS = (24, 160)
+
+
+def write_synthetic_split(path: Path, num_examples: int, max_length: int, vocab_size: int,
+                          rng: np.random.Generator) -> TokenStore:
+    """A token store of random ids whose lengths resemble prompts and stories"""
+    with TokenStoreWriter(path) as writer:
+        for _ in range(num_examples):
+            if rng.random() < PROMPT_FRACTION:
+                length = rng.integers(*PROMPT_LENGTHS)
+                collection = "prompts"
+            else:
+                length = rng.lognormal(np.log(max_length / 2), 0.6)
+                collection = "stories"
+            length = int(np.clip(length, 8, max_length))
+            # The top two ids are left free for the pad and EOS tokens
+            writer.add(rng.integers(0, vocab_size - 2, size=length), collection=collection)
+    return TokenStore(path)
+
+
+class BenchmarkTrainer(StoryForgeTrainer):
+    """StoryForgeTrainer on a tiny local Qwen2 model, or on a real model already on disk
+
+    Everything after model loading (LoRA, gradient checkpointing, collators,
+    packing, bucketing, streaming) is the training code path itself.
+    """
+
+    def __init__(self, config: ModelConfig, model_path: Optional[str] = None, vocab_size: int = TINY_MODEL["vocab_size"]):
+        self.model_path = model_path
+        self.vocab_size = vocab_size
+        super().__init__(config)
+
+    def load_model_and_tokenizer(self):
+        if self.model_path:
+            self.config.model_name = self.model_path
+            super().load_model_and_tokenizer()
+            return
+
+        self.logger.info("Building a tiny randomly initialised Qwen2 model")
+        model_config = Qwen2Config(**{**TINY_MODEL, "vocab_size": self.vocab_size}, use_cache=False)
+        model_config._attn_implementation = self.config.attn_implementation
+        torch.manual_seed(42)
+        self.model = Qwen2ForCausalLM(model_config)
+        self.tokenizer = None
+        self.pad_token_id = self.vocab_size - 1
+        self.eos_token_id = self.vocab_size - 2
+        self.prepare_model()
+
+
+def benchmark_datasets(args, work_dir: Path, vocab_size: int):
+    """(train, eval) token stores: a real tokenized dataset or a synthetic one"""
+    if args.dataset_dir:
+        return load_tokenized_dataset(args.dataset_dir)
+    rng = np.random.default_rng(args.seed)
+    train = write_synthetic_split(work_dir / "train", args.examples, args.max_length, vocab_size, rng)
+    val = write_synthetic_split(work_dir / "val", max(8, args.examples // 10), args.max_length, vocab_size, rng)
+    return train, val
+
+
+def run_benchmark(args, cpu_performance: bool) -> Dict[str, Any]:
+    """One benchmark run, in CPU performance mode or with the default fp32 eager settings"""
+    torch.set_num_threads(args.threads or DEFAULT_THREADS)
+    with tempfile.TemporaryDirectory(prefix="storyforge-benchmark-") as work:
+        work_dir = Path(work)
+        config = ModelConfig(
+            max_length=args.max_length,
+            batch_size=args.batch_size,
+            gradient_accumulation_steps=args.gradient_accumulation_steps,
+            warmup_steps=0,
+            output_dir=str(work_dir / "output"),
+            packing=args.packing,
+            length_bucketing=not args.no_length_bucketing,
+            streaming=args.streaming,
+            cpu_performance=cpu_performance,
+            torch_compile=args.torch_compile and cpu_performance,
+            num_threads=args.threads,
+            dataloader_workers=args.dataloader_workers,
+            auto_batch_size=args.auto_batch_size,
+            memory_limit_gb=args.memory_limit_gb
+        )
+
+        vocab_size = TINY_MODEL["vocab_size"]
+        if args.dataset_dir and not args.model:
+            # Real token ids must fit the tiny model's embedding table
+            train, val = load_tokenized_dataset(args.dataset_dir)
+            vocab_size = int(max(train.tokens.max(initial=0), val.tokens.max(initial=0))) + 3
+
+        trainer = BenchmarkTrainer(config, model_path=args.model, vocab_size=vocab_size)
+        trainer.setup_distributed()
+        trainer.configure_cpu()
+        trainer.load_model_and_tokenizer()
+        train_dataset, eval_dataset = benchmark_datasets(args, work_dir, vocab_size)
+
+        hf_trainer = trainer.build_trainer(
+            train_dataset,
+            eval_dataset,
+            max_steps=args.warmup_steps + args.steps,
+            eval_strategy="no",
+            save_strategy="no",
+            load_best_model_at_end=False,
+            logging_steps=args.warmup_steps + args.steps,
+            report_to="none",
+            use_cpu=True,
+            seed=args.seed
+        )
+        trainer.throughput.skip_steps = args.warmup_steps
+        train_result = hf_trainer.train()
+
+        trainable = sum(p.numel() for p in trainer.model.parameters() if p.requires_grad)
+        total = sum(p.numel() for p in trainer.model.parameters())
+        name = args.name or f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        return {
+            "name": name if cpu_performance or not args.cpu_performance else f"{name}-default",
+            "created": datetime.now().isoformat(),
+            "system": {
+                "platform": platform.platform(),
+                "processor": platform.processor(),
+                "python": platform.python_version(),
+                "torch": torch.__version__,
+                "transformers": transformers.__version__,
+                "threads": torch.get_num_threads(),
+                "physical_cores": physical_cores(),
+                "native_bf16": native_bf16()
+            },
+            "config": {
+                "model": args.model or "tiny-qwen2",
+                "parameters": total,
+                "trainable_parameters": trainable,
+                "dataset": args.dataset_dir or "synthetic",
+                "train_examples": len(train_dataset),
+                "max_length": config.max_length,
+                "batch_size": config.batch_size,
+                "gradient_accumulation_steps": config.gradient_accumulation_steps,
+                "packing": config.packing,
+                "length_bucketing": config.length_bucketing,
+                "streaming": config.streaming,
+                "world_size": trainer.world_size,
+                "cpu_performance": config.cpu_performance,
+                "bf16": config.bf16,
+                "torch_compile": config.torch_compile,
+                "attn_implementation": config.attn_implementation,
+                "dataloader_workers": config.dataloader_workers or 0,
+                "steps": args.steps,
+                "warmup_steps": args.warmup_steps
+            },
+            "results": {
+                **trainer.throughput.summary(all_ranks=True),
+                "train_loss": train_result.metrics.get("train_loss")
+            }
+        }
+
+
+COMPARED_METRICS = [
+    ("tokens/sec", lambda r: r["tokens_per_second"], True),
+    ("computed tokens/sec", lambda r: r["computed_tokens_per_second"], True),
+    ("samples/sec", lambda r: r["samples_per_second"], True),
+    ("step time ms (mean)", lambda r: r["step_time_ms"]["mean"], False),
+    ("step time ms (p90)", lambda r: r["step_time_ms"]["p90"], False),
+    ("dataloader wait s", lambda r: r["dataloader_wait_seconds"], False),
+    ("peak RSS MB", lambda r: r["peak_rss_mb"], False)
+]
+
+
+def speedup(results: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """How many times faster a run is than its baseline"""
+    ratio = lambda after, before: after / before if before else None
+    return {
+        "tokens_per_second": ratio(results["tokens_per_second"], baseline["tokens_per_second"]),
+        "samples_per_second": ratio(results["samples_per_second"], baseline["samples_per_second"]),
+        "step_time": ratio(baseline["step_time_ms"]["mean"], results["step_time_ms"]["mean"])
+    }
+
+
+def print_report(result: Dict[str, Any]):
+    config, r = result["config"], result["results"]
+    print(f"\n📊 {result['name']}: {config['model']} ({config['trainable_parameters']:,} trainable parameters), "
+          f"{config['dataset']} data, {result['system']['threads']} threads")
+    print(f"  batch {config['batch_size']} x {config['gradient_accumulation_steps']} accumulation"
+          f"{' x ' + str(config['world_size']) + ' workers' if config.get('world_size', 1) > 1 else ''}, "
+          f"max_length {config['max_length']}, packing {'on' if config['packing'] else 'off'}, "
+          f"bucketing {'on' if config['length_bucketing'] else 'off'}, streaming {'on' if config['streaming'] else 'off'}")
+    if config.get("cpu_performance"):
+        print(f"  CPU performance mode: bf16 {'on' if config['bf16'] else 'off'}, {config['attn_implementation']} attention, "
+              f"torch.compile {'on' if config['torch_compile'] else 'off'}, {config['dataloader_workers']} dataloader workers")
+    if not r["steps"]:
+        print("  ⚠️ No steps were measured")
+        return
+    print(f"  {r['steps']} steps after {r['warmup_steps']} warmup in {r['seconds']:.1f}s")
+    print(f"  {r['tokens_per_second']:,.1f} tokens/sec ({r['computed_tokens_per_second']:,.1f} computed, "
+          f"{r['padding_fraction']:.1%} padding), {r['samples_per_second']:.2f} samples/sec")
+    step = r["step_time_ms"]
+    print(f"  step time {step['mean']:.0f} ms mean, {step['p50']:.0f} p50, {step['p90']:.0f} p90, {step['max']:.0f} max")
+    for phase, stats in r["phases"].items():
+        print(f"    {phase:<17} {stats['mean_ms']:>9.1f} ms {stats['fraction']:>7.1%}")
+    if r["peak_rss_mb"] is not None:
+        print(f"  peak RSS {r['peak_rss_mb']:,.0f} MB")
+
+
+def print_comparison(result: Dict[str, Any], baseline: Dict[str, Any]):
+    print(f"\n📊 {result['name']} vs {baseline['name']}")
+    print(f"  {'metric':<22} {'baseline':>12} {'this run':>12} {'change':>9}")
+    for label, metric, higher_is_better in COMPARED_METRICS:
+        try:
+            before, after = metric(baseline["results"]), metric(result["results"])
+        except (KeyError, TypeError):
+            continue
+        if before is None or after is None:
+            continue
+        change = f"{after / before:>8.2f}x" if before else "      n/a"
+        better = after > before if higher_is_better else after < before
+        print(f"  {label:<22} {before:>12,.1f} {after:>12,.1f} {change} {'✅' if better else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark StoryForge training throughput on CPU")
+    parser.add_argument("--model", default=None,
+                        help="Local model directory to benchmark (default: a tiny random Qwen2 model)")
+    parser.add_argument("--dataset-dir", default=None,
+                        help="Fingerprinted tokenized dataset to train on (default: synthetic data)")
+    parser.add_argument("--steps", type=int, default=20, help="Measured optimizer steps")
+    parser.add_argument("--warmup-steps", type=int, default=3, help="Steps run before measuring")
+    parser.add_argument("--examples", type=int, default=512, help="Synthetic training examples")
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--gradient-accumulation-steps", type=int, default=1)
+    parser.add_argument("--auto-batch-size", action="store_true",
+                        help="Tune the micro-batch size first, keeping batch size x accumulation")
+    parser.add_argument("--memory-limit-gb", type=float, default=None)
+    parser.add_argument("--packing", action="store_true")
+    parser.add_argument("--no-length-bucketing", action="store_true")
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--cpu-performance", action="store_true",
+                        help="Benchmark CPU performance mode, after a default-mode run of the same workload to measure the speedup")
+    parser.add_argument("--torch-compile", action="store_true", help="Also torch.compile the model in CPU performance mode")
+    parser.add_argument("--no-baseline", action="store_true",
+                        help="With --cpu-performance, skip the default-mode run (use --compare instead)")
+    parser.add_argument("--dataloader-workers", type=int, default=None,
+                        help="Dataloader workers (default: 0, or sized to the host in CPU performance mode)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="torch intra-op threads (default: torch's own, or physical cores in CPU performance mode)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--name", default=None, help="Name recorded in the result")
+    parser.add_argument("--output", default=None, help=f"Result JSON path (default: under {BENCHMARK_DIR})")
+    parser.add_argument("--compare", default=None, help="Earlier result JSON to compare against")
+    args = parser.parse_args()
+
+    # Under launch_training.py every worker runs the benchmark; rank 0 reports for all of them
+    report = int(os.environ.get("RANK", 0)) == 0
+    baseline = None
+    if args.cpu_performance and not args.no_baseline:
+        baseline = run_benchmark(args, cpu_performance=False)
+        if report:
+            print_report(baseline)
+    result = run_benchmark(args, cpu_performance=args.cpu_performance)
+    if not report:
+        return
+    print_report(result)
+    if baseline is not None:
+        result["baseline"] = baseline
+        result["speedup"] = speedup(result["results"], baseline["results"])
+        print_comparison(result, baseline)
+
+    output = Path(args.output) if args.output else Path(BENCHMARK_DIR) / f"{result['name']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    print(f"\n✅ Result written to {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print_comparison(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
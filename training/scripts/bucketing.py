@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Length-Bucketed Sampling for StoryForge Fine-Tuning
+Orders examples so each batch holds sequences of similar token length
+"""
+
+import random
+from typing import Iterator, List, Sequence
+
+from torch.utils.data import Sampler
+
+# Batches per bucket: larger buckets pad less but make the batch order less random
+DEFAULT_BUCKET_BATCHES = 50
+
+
+class LengthBucketSampler(Sampler):
+    """Yield dataset indices so consecutive batch_size runs have similar lengths
+
+    For training (shuffle=True) indices are shuffled, cut into buckets of
+    bucket_batches batches, sorted by length inside each bucket and split into
+    batches whose order is then shuffled again; the longest batch always comes
+    first so an out-of-memory shows up on step one. The shuffle follows the
+    epoch passed to set_epoch (the Trainer calls it every epoch, as for
+    DistributedSampler), so iterating again yields the same order. For
+    evaluation (shuffle=False) indices are simply sorted by length, longest
+    first.
+    """
+
+    def __init__(self, lengths: Sequence[int], batch_size: int, shuffle: bool = True,
+                 bucket_batches: int = DEFAULT_BUCKET_BATCHES, seed: int = 42):
+        self.lengths = list(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_batches = bucket_batches
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def order(self, epoch: int = 0) -> List[int]:
+        """The index order for one epoch"""
+        by_length = lambda i: self.lengths[i]
+        if not self.shuffle:
+            return sorted(range(len(self.lengths)), key=by_length, reverse=True)
+
+        rng = random.Random(self.seed + epoch)
+        indices = list(range(len(self.lengths)))
+        rng.shuffle(indices)
+
+        bucket_size = self.batch_size * self.bucket_batches
+        batches = []
+        for start in range(0, len(indices), bucket_size):
+            bucket = sorted(indices[start:start + bucket_size], key=by_length, reverse=True)
+            batches.extend(bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size))
+        if not batches:
+            return []
+
+        longest = max(range(len(batches)), key=lambda b: self.lengths[batches[b][0]])
+        first = batches.pop(longest)
+        rng.shuffle(batches)
+        # Keep a short final batch last, so every other batch stays full
+        batches.sort(key=lambda batch: len(batch) < self.batch_size)
+        return [index for batch in [first] + batches for index in batch]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.order(self.epoch))
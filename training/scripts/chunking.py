@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Token-Aware Chunking for StoryForge Training Data
+Splits story text into overlapping windows measured in the target model's tokens
+"""
+
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+DEFAULT_TOKENIZER = "Qwen/Qwen2.5-0.5B-Instruct"
+
+
+class TokenChunker:
+    """Split text into chunks of at most chunk_tokens target-model tokens
+
+    Consecutive chunks share overlap_tokens tokens so no sentence is only
+    ever seen cut in half. Chunks are cut on token boundaries and returned
+    as the original text spans. If the tokenizer cannot be loaded (for
+    example offline), whitespace-separated words stand in for tokens.
+    """
+
+    def __init__(self, tokenizer_name: str = DEFAULT_TOKENIZER, chunk_tokens: int = 1024, overlap_tokens: int = 128):
+        if overlap_tokens >= chunk_tokens:
+            raise ValueError("overlap_tokens must be smaller than chunk_tokens")
+        self.tokenizer_name = tokenizer_name
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.tokenizer = self._load_tokenizer(tokenizer_name)
+
+    @staticmethod
+    def _load_tokenizer(tokenizer_name: Optional[str]):
+        if not tokenizer_name:
+            return None
+        try:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, trust_remote_code=True)
+        except Exception as e:
+            print(f"⚠️ Could not load tokenizer {tokenizer_name} ({e}); chunking by words instead")
+            return None
+        if not tokenizer.is_fast:
+            print(f"⚠️ Tokenizer {tokenizer_name} has no offset mapping; chunking by words instead")
+            return None
+        return tokenizer
+
+    def token_spans(self, text: str) -> List[Tuple[int, int]]:
+        """Character (start, end) of every token in text"""
+        if self.tokenizer is None:
+            return [match.span() for match in re.finditer(r'\S+', text)]
+        encoded = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        return [span for span in encoded['offset_mapping'] if span[1] > span[0]]
+
+    def chunk_stream(self, lines: Iterable[str], buffer_chars: int = 200_000) -> Iterator[Tuple[str, int]]:
+        """Chunk a stream of lines while holding at most ~buffer_chars of text
+
+        Full windows are emitted as the buffer fills; the unfinished tail
+        (from the next window start on) carries over into the next buffer.
+        """
+        buffer, size = [], 0
+        for line in lines:
+            buffer.append(line)
+            size += len(line)
+            if size < buffer_chars:
+                continue
+            text = ''.join(buffer)
+            spans = self.token_spans(text)
+            start = 0
+            step = self.chunk_tokens - self.overlap_tokens
+            # The last token may be cut at the buffer edge, so a window must end before it
+            while start + self.chunk_tokens < len(spans):
+                end = start + self.chunk_tokens
+                yield text[spans[start][0]:spans[end - 1][1]].strip(), self.chunk_tokens
+                start += step
+            rest = text[spans[start][0]:] if start < len(spans) else ''
+            buffer, size = [rest], len(rest)
+        yield from self.chunk(''.join(buffer))
+
+    def chunk(self, text: str) -> List[Tuple[str, int]]:
+        """Return (chunk text, token count) pairs covering text"""
+        spans = self.token_spans(text)
+        if not spans:
+            return []
+        chunks = []
+        step = self.chunk_tokens - self.overlap_tokens
+        for start in range(0, len(spans), step):
+            end = min(start + self.chunk_tokens, len(spans))
+            chunks.append((text[spans[start][0]:spans[end - 1][1]].strip(), end - start))
+            if end == len(spans):
+                break
+        return chunks
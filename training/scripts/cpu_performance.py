@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+CPU Performance Settings for StoryForge Fine-Tuning
+Sizes threads and dataloader workers to the host, detects native bf16 support and
+splits cores between pinned training processes
+"""
+
+import os
+import platform
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+# Dataloader workers only pay off when there are cores to spare for them
+CORES_PER_DATALOADER_WORKER = 8
+MAX_DATALOADER_WORKERS = 4
+
+
+@dataclass
+class CPUSettings:
+    """Threading and precision for a CPU training run"""
+    intra_op_threads: int
+    inter_op_threads: int
+    dataloader_workers: int
+    bf16: bool
+
+
+def physical_core_groups() -> List[List[int]]:
+    """Logical CPUs available to this process, grouped by the physical core they run on"""
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    cpuinfo = Path("/proc/cpuinfo")
+    if not cpuinfo.exists():
+        return [[cpu] for cpu in available]
+    core_of: Dict[int, Tuple[str, str]] = {}
+    processor, physical_id = None, None
+    for line in cpuinfo.read_text().splitlines():
+        key, _, value = line.partition(":")
+        key, value = key.strip(), value.strip()
+        if key == "processor":
+            processor = int(value)
+        elif key == "physical id":
+            physical_id = value
+        elif key == "core id" and processor is not None:
+            core_of[processor] = (physical_id, value)
+    groups: Dict[Tuple[str, str], List[int]] = {}
+    for cpu in available:
+        groups.setdefault(core_of.get(cpu, ("", str(cpu))), []).append(cpu)
+    return sorted(groups.values())
+
+
+def physical_cores() -> int:
+    """Available cores with SMT siblings counted once; matmul threads gain nothing from hyperthreads"""
+    return len(physical_core_groups())
+
+
+def split_cores(num_workers: int) -> List[List[int]]:
+    """Disjoint sets of logical CPUs, whole physical cores each, for num_workers pinned processes"""
+    groups = physical_core_groups()
+    if num_workers > len(groups):
+        raise ValueError(f"{num_workers} workers need at least as many physical cores; {len(groups)} are available")
+    per_worker, extra = divmod(len(groups), num_workers)
+    sets, start = [], 0
+    for worker in range(num_workers):
+        # Neighbouring cores stay together, which keeps each worker on one socket where possible
+        count = per_worker + (1 if worker < extra else 0)
+        sets.append([cpu for group in groups[start:start + count] for cpu in group])
+        start += count
+    return sets
+
+
+def native_bf16() -> bool:
+    """Whether the CPU computes bf16 in hardware (AVX512-BF16, AMX or the Arm BF16 extension)
+
+    Without it bf16 autocast is emulated and slower than fp32.
+    """
+    for probe in ("_is_amx_tile_supported", "_is_avx512_bf16_supported"):
+        check = getattr(torch.cpu, probe, None)
+        if check is not None and check():
+            return True
+    cpuinfo = Path("/proc/cpuinfo")
+    if platform.machine().lower() in ("aarch64", "arm64") and cpuinfo.exists():
+        for line in cpuinfo.read_text().splitlines():
+            if line.startswith("Features") and "bf16" in line.split(":", 1)[1].split():
+                return True
+    return False
+
+
+def plan_cpu_settings(threads: Optional[int] = None, dataloader_workers: Optional[int] = None,
+                      bf16: Optional[bool] = None) -> CPUSettings:
+    """Settings for this host; explicit arguments win over the detected defaults"""
+    cores = physical_cores()
+    if dataloader_workers is None:
+        dataloader_workers = min(MAX_DATALOADER_WORKERS, cores // CORES_PER_DATALOADER_WORKER)
+    return CPUSettings(
+        intra_op_threads=threads or max(1, cores - dataloader_workers),
+        inter_op_threads=1 if cores <= 4 else 2,
+        dataloader_workers=dataloader_workers,
+        bf16=native_bf16() if bf16 is None else bf16
+    )
+
+
+def apply_cpu_settings(settings: CPUSettings):
+    torch.set_num_threads(settings.intra_op_threads)
+    try:
+        torch.set_num_interop_threads(settings.inter_op_threads)
+    except RuntimeError:
+        # Only settable before the first inter-op parallel work; the default is kept after that
+        pass
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Near-Duplicate Detection for StoryForge Training Data
+MinHash signatures over word shingles, bucketed with LSH banding, so overlapping
+copies of the same story are embedded and trained on only once
+"""
+
+import os
+import re
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD_RE = re.compile(r'\w+')
+
+
+class NearDuplicateIndex:
+    """MinHash + LSH index of documents already kept
+
+    A document whose estimated Jaccard similarity with a kept document
+    reaches threshold is reported as a duplicate of it. With num_perm
+    hashes split into bands, LSH surfaces candidate pairs whose similarity
+    is above roughly (1 / bands) ** (bands / num_perm).
+    """
+
+    def __init__(self, num_perm: int = 128, bands: int = 16, threshold: float = 0.8,
+                 shingle_size: int = 5, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 61, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 61, size=num_perm, dtype=np.uint64)
+
+        self.signatures: Dict[str, np.ndarray] = {}
+        self._buckets: List[Dict[bytes, List[str]]] = [{} for _ in range(bands)]
+
+    def signature(self, text: str) -> np.ndarray:
+        words = _WORD_RE.findall(text.lower())
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {' '.join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+        # Universal hashing modulo a Mersenne prime, one permutation per column
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        r = self.rows_per_band
+        return [signature[i * r:(i + 1) * r].tobytes() for i in range(self.bands)]
+
+    def find_duplicate(self, signature: np.ndarray) -> Optional[str]:
+        """Return the id of a kept document similar to signature, if any"""
+        seen = set()
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            for candidate in band.get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if np.mean(self.signatures[candidate] == signature) >= self.threshold:
+                    return candidate
+        return None
+
+    def add(self, record_id: str, signature: np.ndarray):
+        self.remove(record_id)
+        self.signatures[record_id] = signature
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            band.setdefault(key, []).append(record_id)
+
+    def remove(self, record_id: str):
+        signature = self.signatures.pop(record_id, None)
+        if signature is None:
+            return
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            members = band.get(key)
+            if members:
+                members.remove(record_id)
+                if not members:
+                    del band[key]
+
+    def save(self, path: Path):
+        ids = list(self.signatures)
+        matrix = np.stack([self.signatures[i] for i in ids]) if ids else np.zeros((0, self.num_perm), np.uint32)
+        tmp_path = path.with_name(path.name + '.tmp.npz')
+        np.savez(tmp_path, ids=np.array(ids, dtype=str), signatures=matrix,
+                 params=np.array([self.num_perm, self.bands, self.shingle_size]))
+        os.replace(tmp_path, path)
+
+    def load(self, path: Path) -> bool:
+        """Restore kept signatures saved with the same parameters; False if unusable"""
+        if not path.exists():
+            return False
+        data = np.load(path)
+        if data['params'].tolist() != [self.num_perm, self.bands, self.shingle_size]:
+            return False
+        for record_id, signature in zip(data['ids'].tolist(), data['signatures']):
+            self.add(record_id, signature)
+        return True
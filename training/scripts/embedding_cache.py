@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Embedding Cache for StoryForge Vector Database
+Persists sentence embeddings on disk, keyed by encoder and normalized text hash,
+so rebuilding the vector store does not recompute unchanged embeddings
+"""
+
+import os
+import re
+import json
+import heapq
+import hashlib
+import tempfile
+import threading
+import unicodedata
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text the way cache keys see it: NFC, collapsed whitespace"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+
+class EmbeddingCache:
+    """Content-addressed, size-capped embedding cache
+
+    Vectors live in a memory-mapped float16 matrix (embeddings.f16) and an
+    index file (index.json) maps each key to its row and last-use tick. When
+    the cache holds max_entries vectors, the least recently used rows are
+    evicted and reused. All methods are safe to call from several threads.
+    """
+
+    # 2: vectors are stored unit-normalized
+    INDEX_VERSION = 2
+
+    def __init__(self, cache_dir: str, encoder_name: str, encoder_revision: Optional[str], dim: int,
+                 max_entries: int = 200_000):
+        self.encoder_name = encoder_name
+        self.encoder_revision = encoder_revision or "main"
+        self.dim = dim
+        self.max_entries = max(1, max_entries)
+
+        # One subdirectory per encoder keeps matrices of different widths apart
+        encoder_tag = re.sub(r'[^A-Za-z0-9_.-]+', '_', f"{encoder_name}@{self.encoder_revision}")
+        self.cache_dir = Path(cache_dir) / encoder_tag
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.matrix_path = self.cache_dir / "embeddings.f16"
+        self.index_path = self.cache_dir / "index.json"
+
+        self.entries: Dict[str, List[int]] = {}  # key -> [row, last_used]
+        self.clock = 0
+        self.rows = 0
+        self.hits = 0
+        self.misses = 0
+        self.unsaved = 0  # Vectors added since the index was last written
+        self._lock = threading.Lock()
+        self._load_index()
+        self._free_rows = sorted(set(range(self.rows)) - {row for row, _ in self.entries.values()}, reverse=True)
+        self._matrix = self._open_matrix(self.rows) if self.rows else None
+
+    def _load_index(self):
+        if not self.index_path.exists() or not self.matrix_path.exists():
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable embedding cache index {self.index_path}: {e}")
+            return
+        expected_size = index.get('rows', 0) * self.dim * 2
+        if (index.get('version') != self.INDEX_VERSION or index.get('dim') != self.dim
+                or self.matrix_path.stat().st_size < expected_size):
+            print(f"⚠️ Ignoring incompatible embedding cache at {self.cache_dir}")
+            return
+        self.entries = index['entries']
+        self.clock = index['clock']
+        self.rows = index['rows']
+
+    def _open_matrix(self, rows: int) -> np.memmap:
+        return np.memmap(self.matrix_path, dtype=np.float16, mode='r+', shape=(rows, self.dim))
+
+    def _grow(self, needed: int):
+        new_rows = min(self.max_entries, max(needed, 2 * self.rows, 1024))
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        with open(self.matrix_path, 'ab') as f:
+            f.truncate(new_rows * self.dim * 2)
+        self._free_rows = list(range(new_rows - 1, self.rows - 1, -1)) + self._free_rows
+        self.rows = new_rows
+        self._matrix = self._open_matrix(new_rows)
+
+    def key(self, text: str) -> str:
+        payload = f"{self.encoder_name}\0{self.encoder_revision}\0{normalize_text(text)}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Return a float32 vector per text, or None where the cache misses"""
+        keys = [self.key(text) for text in texts]
+        results = []
+        with self._lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    results.append(None)
+                    self.misses += 1
+                    continue
+                self.clock += 1
+                entry[1] = self.clock
+                results.append(np.asarray(self._matrix[entry[0]], dtype=np.float32))
+                self.hits += 1
+        return results
+
+    def put_many(self, texts: Sequence[str], embeddings: np.ndarray):
+        keys = [self.key(text) for text in texts]
+        with self._lock:
+            self._put(keys, embeddings)
+
+    def _put(self, keys: List[str], embeddings: np.ndarray):
+        new_keys = [key for key in dict.fromkeys(keys) if key not in self.entries]
+        # Keep the newest max_entries vectors if a single batch overflows the cap
+        new_keys = new_keys[-self.max_entries:]
+        shortfall = len(new_keys) - len(self._free_rows)
+        if shortfall > 0 and self.rows < self.max_entries:
+            self._grow(self.rows + shortfall)
+            shortfall = len(new_keys) - len(self._free_rows)
+        if shortfall > 0:
+            # Evict in bulk and persist the index before any evicted row is
+            # overwritten, so a crash can never leave a key pointing at
+            # another text's vector
+            self._evict(max(shortfall, self.max_entries // 20), protected=set(keys))
+            self._write_index()
+
+        new_keys = set(new_keys)
+        for key, embedding in zip(keys, embeddings):
+            entry = self.entries.get(key)
+            if entry is None:
+                if key not in new_keys or not self._free_rows:
+                    continue
+                entry = self.entries[key] = [self._free_rows.pop(), 0]
+                self._matrix[entry[0]] = embedding
+                self.unsaved += 1
+            self.clock += 1
+            entry[1] = self.clock
+
+    def _evict(self, count: int, protected: set):
+        candidates = ((last_used, key) for key, (_, last_used) in self.entries.items() if key not in protected)
+        for _, key in heapq.nsmallest(count, candidates):
+            row, _ = self.entries.pop(key)
+            self._free_rows.append(row)
+
+    def save(self, min_unsaved: int = 0):
+        """Write the index, unless fewer than min_unsaved vectors were added since the last write
+
+        Rewriting the index costs time proportional to the cache size, so
+        callers on a latency-sensitive path pass a threshold.
+        """
+        with self._lock:
+            if self.unsaved >= min_unsaved:
+                self._write_index()
+
+    def _write_index(self):
+        if self._matrix is not None:
+            self._matrix.flush()
+        # A unique temporary name, so concurrent writers never replace each other's file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='index.', suffix='.json.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': self.INDEX_VERSION,
+                'encoder_name': self.encoder_name,
+                'encoder_revision': self.encoder_revision,
+                'dim': self.dim,
+                'rows': self.rows,
+                'clock': self.clock,
+                'entries': self.entries
+            }, f)
+        os.replace(tmp_path, self.index_path)
+        self.unsaved = 0
@@ -1,427 +1,820 @@
-#!/usr/bin/env python3
-"""
-Fine-tuning Script for StoryForge Custom Model
-Fine-tunes a 3.7B parameter model (Phi-3.5 Mini) for children's story generation
-"""
-
-import os
-import json
-import torch
-import logging
-from pathlib import Path
-from datetime import datetime
-from typing import Dict, List, Any, Optional
-from dataclasses import dataclass, field
-from datasets import load_from_disk
-
-import argparse
-
-
-try:
-    from transformers import (
-        AutoTokenizer, 
-        AutoModelForCausalLM,
-        TrainingArguments,
-        Trainer,
-        DataCollatorForLanguageModeling,
-        EarlyStoppingCallback
-    )
-    from datasets import Dataset
-    import wandb
-except ImportError as e:
-    print(f"Required libraries not installed: {e}")
-    print("Install with: pip install transformers datasets torch wandb accelerate peft")
-    exit(1)
-
-try:
-    from peft import (
-        LoraConfig,
-        get_peft_model,
-        TaskType,
-        PeftModel
-    )
-except ImportError:
-    print("PEFT not installed. Install with: pip install peft")
-    exit(1)
-
-@dataclass
-class ModelConfig:
-    """Configuration for model fine-tuning"""
-    model_name: str = "Qwen/Qwen2.5-0.5B-Instruct"  # 0.5B parameter model (open access)
-    max_length: int = 2048  # Qwen2.5 supports up to 32K context
-    learning_rate: float = 3e-4  # Higher learning rate for very small model
-    batch_size: int = 8  # Large batch size for 0.5B model
-    gradient_accumulation_steps: int = 2  # Small accumulation for very small model
-    num_epochs: int = 4  # More epochs for better training
-    warmup_steps: int = 100
-    save_steps: int = 500
-    eval_steps: int = 500
-    logging_steps: int = 50
-    output_dir: str = "training/models/storyforge-qwen-fine-tuned"
-    use_lora: bool = True
-    lora_r: int = 16  # Appropriate LoRA rank for smaller model
-    lora_alpha: int = 32  # Appropriate LoRA alpha for smaller model
-    lora_dropout: float = 0.1
-
-class StoryForgeTrainer:
-    """Fine-tuning trainer for StoryForge custom model"""
-    
-    def __init__(self, config: ModelConfig):
-        self.config = config
-        Path("training/logs").mkdir(parents=True, exist_ok=True)
-        self.setup_logging()
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        print(f"Using device: {self.device}")
-        
-        # Create output directories
-        Path(config.output_dir).mkdir(parents=True, exist_ok=True)
-        Path("training/logs").mkdir(parents=True, exist_ok=True)
-        
-    def setup_logging(self):
-        """Set up logging configuration"""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(f'training/logs/training_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log'),
-                logging.StreamHandler()
-            ]
-        )
-        self.logger = logging.getLogger(__name__)
-    
-    def load_model_and_tokenizer(self):
-        """Load the base model and tokenizer"""
-        self.logger.info(f"Loading model: {self.config.model_name}")
-        
-        # Load tokenizer
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            self.config.model_name,
-            trust_remote_code=True,
-            padding_side="right"
-        )
-        
-        # Add pad token if not present
-        if self.tokenizer.pad_token is None:
-            self.tokenizer.pad_token = self.tokenizer.eos_token
-        
-        # Load model
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.config.model_name,
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-            device_map="auto" if torch.cuda.is_available() else None,
-            trust_remote_code=True,
-            attn_implementation="eager",  # Use eager attention to avoid cache issues
-            use_cache=False  # Disable KV cache for training
-        )
-        
-        # Enable gradient checkpointing to save memory
-        try:
-            self.model.gradient_checkpointing_enable()
-            self.logger.info("Gradient checkpointing enabled")
-        except Exception as e:
-            self.logger.warning(f"Could not enable gradient checkpointing: {e}")
-            self.logger.info("Training will continue without gradient checkpointing")
-        
-        # Apply LoRA if enabled
-        if self.config.use_lora:
-            self.apply_lora()
-        
-        self.logger.info("Model and tokenizer loaded successfully")
-    
-    def validate_config(self):
-        """Validate training configuration"""
-        self.logger.info("Validating configuration...")
-        
-        # Check batch size and gradient accumulation
-        effective_batch_size = self.config.batch_size * self.config.gradient_accumulation_steps
-        self.logger.info(f"Effective batch size: {effective_batch_size}")
-        
-        if effective_batch_size < 8:
-            self.logger.warning("Effective batch size is small. Consider increasing batch_size or gradient_accumulation_steps")
-        
-        # Check learning rate
-        if self.config.learning_rate > 1e-3:
-            self.logger.warning("Learning rate seems high. Consider using a lower learning rate (e.g., 1e-4)")
-        
-        # Check output directory
-        if Path(self.config.output_dir).exists():
-            self.logger.warning(f"Output directory {self.config.output_dir} already exists. Will overwrite.")
-        
-        self.logger.info("Configuration validation completed")
-    
-    def apply_lora(self):
-        """Apply LoRA (Low-Rank Adaptation) for efficient fine-tuning"""
-        self.logger.info("Applying LoRA configuration...")
-        
-        lora_config = LoraConfig(
-            task_type=TaskType.CAUSAL_LM,
-            r=self.config.lora_r,
-            lora_alpha=self.config.lora_alpha,
-            lora_dropout=self.config.lora_dropout,
-            target_modules=["q_proj", "v_proj", "k_proj", "o_proj", "gate_proj", "up_proj", "down_proj"]
-        )
-        
-        self.model = get_peft_model(self.model, lora_config)
-        self.model.print_trainable_parameters()
-    
-    def load_training_data(self) -> Dataset:
-        """Load and prepare training data from vector database export"""
-        data_path = "training/processed_data.json"
-        
-        if not Path(data_path).exists():
-            self.logger.error(f"Training data not found at {data_path}")
-            self.logger.info("Please run setup_vector_db.py first to process training datasets")
-            raise FileNotFoundError(f"Training data not found: {data_path}")
-        
-        self.logger.info(f"Loading training data from {data_path}")
-        
-        with open(data_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Extract stories and prompts for training
-        training_texts = []
-        
-        # Process stories
-        if 'stories' in data['data']:
-            stories_data = data['data']['stories']
-            for doc, metadata in zip(stories_data['documents'], stories_data['metadatas']):
-                if len(doc.strip()) > 50:  # Filter out very short texts
-                    training_texts.append(self.format_training_text(doc, metadata))
-        
-        # Process prompts
-        if 'prompts' in data['data']:
-            prompts_data = data['data']['prompts']
-            for doc, metadata in zip(prompts_data['documents'], prompts_data['metadatas']):
-                if len(doc.strip()) > 20:
-                    training_texts.append(self.format_prompt_text(doc, metadata))
-        
-        self.logger.info(f"Prepared {len(training_texts)} training examples")
-        
-        # Create dataset
-        dataset = Dataset.from_dict({"text": training_texts})
-        
-        # Split into train/validation
-        train_val_split = dataset.train_test_split(test_size=0.1, seed=42)
-        
-        return train_val_split["train"], train_val_split["test"]
-    
-    def format_training_text(self, story: str, metadata: Dict) -> str:
-        """Format story text for training with appropriate prompts"""
-        age_group = metadata.get('age_group', '7-10')
-        genre = metadata.get('genre', 'adventure')
-        
-        # Create a structured prompt for the model using Llama-3.1 format
-        prompt = f"""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
-
-You are a helpful AI assistant that creates engaging, age-appropriate stories for children aged {age_group}. Your stories should be safe, educational, and entertaining.<|eot_id|><|start_header_id|>user<|end_header_id|>
-
-Create a {genre} story suitable for children aged {age_group}.<|eot_id|><|start_header_id|>assistant<|end_header_id|>
-
-{story.strip()}<|eot_id|><|end_of_text|>"""
-        
-        return prompt
-    
-    def format_prompt_text(self, prompt: str, metadata: Dict) -> str:
-        """Format prompt text for training"""
-        formatted_prompt = f"""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
-
-You are a helpful AI assistant that creates engaging, age-appropriate stories for children. Always ensure content is safe and suitable for young readers.<|eot_id|><|start_header_id|>user<|end_header_id|>
-
-{prompt.strip()}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
-
-Once upon a time, there was a magical adventure waiting to unfold...<|eot_id|><|end_of_text|>"""
-        
-        return formatted_prompt
-    
-    def tokenize_function(self, examples):
-        """Tokenize the training examples"""
-        return self.tokenizer(
-            examples["text"],
-            truncation=True,
-            padding=False,
-            max_length=self.config.max_length,
-            return_overflowing_tokens=False,
-        )
-    
-    def start_training(self, dry_run=False):
-        """Start the fine-tuning process"""
-        self.logger.info("Starting fine-tuning process...")
-        
-        # Validate configuration
-        self.validate_config()
-        
-        # Load model and tokenizer
-        self.load_model_and_tokenizer()
-        
-        # Tokenize datasets
-        """
-        self.logger.info("Tokenizing datasets...")
-        train_dataset = train_dataset.map(
-            self.tokenize_function,
-            batched=True,
-            remove_columns=train_dataset.column_names,
-            load_from_cache_file=False,
-            num_proc=1
-        )
-        
-        
-        eval_dataset = eval_dataset.map(
-            self.tokenize_function,
-            batched=True,
-            remove_columns=eval_dataset.column_names
-        )
-        
-        """
-        
-        # Check if pre-tokenized datasets exist
-        train_path = "training/tokenized_dataset/train"
-        val_path = "training/tokenized_dataset/val"
-        
-        if not Path(train_path).exists() or not Path(val_path).exists():
-            self.logger.error("Pre-tokenized datasets not found!")
-            self.logger.info("Please run the data preprocessing script first to create tokenized datasets")
-            raise FileNotFoundError("Pre-tokenized datasets not found. Run preprocessing first.")
-        
-        self.logger.info("Loading pre-tokenized datasets...")
-        train_dataset = load_from_disk(train_path)
-        eval_dataset = load_from_disk(val_path)
-        self.logger.info(f"Loaded {len(train_dataset)} training samples and {len(eval_dataset)} validation samples")
-        
-        # Data collator
-        data_collator = DataCollatorForLanguageModeling(
-            tokenizer=self.tokenizer,
-            mlm=False,
-            return_tensors="pt",
-            pad_to_multiple_of=8
-        )
-        
-        # Training arguments
-        training_args = TrainingArguments(
-            output_dir=self.config.output_dir,
-            overwrite_output_dir=True,
-            num_train_epochs=self.config.num_epochs,
-            per_device_train_batch_size=self.config.batch_size,
-            per_device_eval_batch_size=self.config.batch_size,
-            gradient_accumulation_steps=self.config.gradient_accumulation_steps,
-            learning_rate=self.config.learning_rate,
-            warmup_steps=self.config.warmup_steps,
-            logging_steps=self.config.logging_steps,
-            save_steps=self.config.save_steps,
-            eval_steps=self.config.eval_steps,
-            eval_strategy="steps",   
-            save_strategy="steps",
-            load_best_model_at_end=True,
-            metric_for_best_model="eval_loss",
-            greater_is_better=False,
-            report_to="wandb" if "WANDB_API_KEY" in os.environ else None,
-            run_name=f"storyforge-phi3-{datetime.now().strftime('%Y%m%d_%H%M%S')}",
-            dataloader_pin_memory=False,
-            fp16=False,  # Disable fp16 to avoid cache issues
-            remove_unused_columns=False,
-        )
-        
-        # Initialize trainer
-        trainer = Trainer(
-            model=self.model,
-            args=training_args,
-            train_dataset=train_dataset,
-            eval_dataset=eval_dataset,
-            tokenizer=self.tokenizer,
-            data_collator=data_collator,
-            callbacks=[EarlyStoppingCallback(early_stopping_patience=3)]
-        )
-        
-        if dry_run:
-            self.logger.info("Dry run enabled — skipping actual training.")
-            self.logger.info("Configuration, datasets, and trainer initialized successfully.")
-            return trainer  # Return trainer for inspection/testing
-        
-        # Start training
-        self.logger.info("Beginning training...")
-        trainer.train()
-        
-        # Save the final model
-        self.logger.info("Saving final model...")
-        trainer.save_model()
-        self.tokenizer.save_pretrained(self.config.output_dir)
-        
-        # Save training metrics
-        self.save_training_metrics(trainer)
-        
-        self.logger.info("Training completed successfully!")
-
-        def save_model(self, trainer):
-            """Save the final model"""
-            self.logger.info("Saving final model...")
-            trainer.save_model()
-            self.tokenizer.save_pretrained(self.config.output_dir)
-
-    def save_training_metrics(self, trainer):
-        """Save training metrics and configuration"""
-        try:
-            # Get the last log entry safely
-            log_history = trainer.state.log_history
-            if log_history:
-                final_train_loss = log_history[-1].get("train_loss", 0)
-                final_eval_loss = log_history[-1].get("eval_loss", 0)
-            else:
-                final_train_loss = 0
-                final_eval_loss = 0
-                self.logger.warning("No training logs found for metrics")
-            
-            metrics = {
-                "final_train_loss": final_train_loss,
-                "final_eval_loss": final_eval_loss,
-                "total_steps": trainer.state.global_step,
-                "config": {
-                    "model_name": self.config.model_name,
-                    "learning_rate": self.config.learning_rate,
-                    "batch_size": self.config.batch_size,
-                    "num_epochs": self.config.num_epochs,
-                    "use_lora": self.config.use_lora,
-                    "max_length": self.config.max_length
-                },
-                "training_completed": datetime.now().isoformat()
-            }
-            
-            metrics_path = Path(self.config.output_dir) / "training_metrics.json"
-            with open(metrics_path, 'w') as f:
-                json.dump(metrics, f, indent=2)
-            
-            self.logger.info(f"Training metrics saved to {metrics_path}")
-        except Exception as e:
-            self.logger.error(f"Failed to save training metrics: {e}")
-
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--dry-run", action="store_true", help="Run a short training test with minimal data and steps")
-    args = parser.parse_args()
-
-    print("StoryForge Model Fine-Tuning")
-    print("=" * 50)
-
-    config = ModelConfig()
-
-    if torch.cuda.is_available():
-        print(f"CUDA available: {torch.cuda.get_device_name()}")
-        print(f"GPU Memory: {torch.cuda.get_device_properties(0).total_memory / 1e9:.1f} GB")
-    else:
-        print("CUDA not available. Training will be slower on CPU.")
-        config.batch_size = 1
-        config.gradient_accumulation_steps = 8
-
-    trainer = StoryForgeTrainer(config)
-
-    try:
-        trainer.start_training(dry_run=args.dry_run)
-        if args.dry_run:
-            print("\nDry run finished successfully")
-        else:
-            print("\nFine-tuning completed successfully")
-            print(f"Model saved to: {config.output_dir}")
-    except Exception as e:
-        print(f"Training failed: {e}")
-        raise
-
-if __name__ == "__main__":
+#!/usr/bin/env python3
+"""
+Fine-tuning Script for StoryForge Custom Model
+Fine-tunes a 3.7B parameter model (Phi-3.5 Mini) for children's story generation
+"""
+
+import os
+import json
+import torch
+import logging
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+from dataclasses import dataclass, field
+
+import argparse
+
+from training_data import DEFAULT_EXPORT_PATH
+from preprocess_and_save import (
+    dataset_fingerprint,
+    find_tokenized_dataset,
+    load_tokenized_dataset,
+    preprocess_and_save
+)
+from packing import PackedDataCollator, PackedTokenStore, batch_padding
+from token_store import StreamingTokenStore, TokenStoreCollator
+from bucketing import LengthBucketSampler
+from training_callbacks import MemoryCallback, StepProfilerCallback, ThroughputCallback, run_first
+from cpu_performance import apply_cpu_settings, plan_cpu_settings
+from batch_size_finder import find_batch_size, memory_limit_gb
+from memory_guard import estimate_peak_memory
+from async_checkpoint import AsyncCheckpointMixin, latest_checkpoint
+
+try:
+    from transformers import (
+        AutoTokenizer, 
+        AutoModelForCausalLM,
+        TrainingArguments,
+        Trainer,
+        DataCollatorForLanguageModeling,
+        EarlyStoppingCallback
+    )
+    from datasets import Dataset
+    import wandb
+except ImportError as e:
+    print(f"Required libraries not installed: {e}")
+    print("Install with: pip install transformers datasets torch wandb accelerate peft")
+    exit(1)
+
+try:
+    from peft import (
+        LoraConfig,
+        get_peft_model,
+        TaskType,
+        PeftModel
+    )
+except ImportError:
+    print("PEFT not installed. Install with: pip install peft")
+    exit(1)
+
+@dataclass
+class ModelConfig:
+    """Configuration for model fine-tuning"""
+    model_name: str = "Qwen/Qwen2.5-0.5B-Instruct"  # 0.5B parameter model (open access)
+    model_revision: Optional[str] = None  # Branch, tag or commit of model_name (default: main)
+    max_length: int = 2048  # Qwen2.5 supports up to 32K context
+    learning_rate: float = 3e-4  # Higher learning rate for very small model
+    batch_size: int = 8  # Large batch size for 0.5B model
+    gradient_accumulation_steps: int = 2  # Small accumulation for very small model
+    num_epochs: int = 4  # More epochs for better training
+    warmup_steps: int = 100
+    save_steps: int = 500
+    eval_steps: int = 500
+    logging_steps: int = 50
+    output_dir: str = "training/models/storyforge-qwen-fine-tuned"
+    use_lora: bool = True
+    lora_r: int = 16  # Appropriate LoRA rank for smaller model
+    lora_alpha: int = 32  # Appropriate LoRA alpha for smaller model
+    lora_dropout: float = 0.1
+    lora_target_modules: List[str] = field(
+        default_factory=lambda: ["q_proj", "v_proj", "k_proj", "o_proj", "gate_proj", "up_proj", "down_proj"]
+    )
+    data_path: str = DEFAULT_EXPORT_PATH
+    rebuild_datasets: bool = True  # Re-tokenize when no dataset matches the model; False refuses instead
+    packing: bool = False  # Pack examples into max_length blocks; batch_size then counts blocks
+    length_bucketing: bool = True  # Batch examples of similar token length together (train and eval)
+    streaming: bool = False  # Feed the trainer an iterable dataset read sequentially from disk
+    shuffle_buffer_size: int = 10_000  # Examples held in memory to shuffle a streamed train split
+    cpu_performance: bool = False  # On CPU: bf16 autocast where native, SDPA attention, host-sized threads and workers
+    torch_compile: bool = False  # torch.compile the model (the first steps are slower while it compiles)
+    attn_implementation: str = "eager"
+    bf16: bool = False  # bf16 autocast; set by cpu_performance when the CPU computes bf16 natively
+    num_threads: Optional[int] = None  # Intra-op threads in CPU performance mode (default: physical cores)
+    dataloader_workers: Optional[int] = None  # Default: 0, or sized to the host in CPU performance mode
+    auto_batch_size: bool = False  # Probe micro-batch sizes before training; batch_size * accumulation is kept
+    memory_limit_gb: Optional[float] = None  # Cap for auto_batch_size and memory_check (default: 85% of RAM or GPU memory)
+    memory_check: Optional[str] = None  # "warn" or "abort" before training if the longest batch would exceed the cap
+    async_checkpoints: bool = True  # Write adapter-only checkpoints on a background thread
+    resume: bool = False  # Continue from the latest complete checkpoint in output_dir
+    profile_steps: Optional[Tuple[int, int]] = None  # (start, end) optimizer steps to break down by phase
+    profile_trace: bool = False  # Also capture a torch.profiler trace of the profiled steps
+
+def dataset_lengths(dataset) -> List[int]:
+    """Token length of every example in a token store or packed view, read from its offsets"""
+    return dataset.lengths.tolist()
+
+class BucketedTrainer(Trainer):
+    """Trainer whose train and eval dataloaders draw length-bucketed batches"""
+    
+    def _get_train_sampler(self, *args, **kwargs):
+        return LengthBucketSampler(
+            dataset_lengths(self.train_dataset),
+            self._train_batch_size,
+            shuffle=True,
+            seed=self.args.seed
+        )
+    
+    def _get_eval_sampler(self, eval_dataset):
+        return LengthBucketSampler(dataset_lengths(eval_dataset), self.args.eval_batch_size, shuffle=False)
+
+class StoryForgeTrainer:
+    """Fine-tuning trainer for StoryForge custom model"""
+    
+    def __init__(self, config: ModelConfig):
+        self.config = config
+        # Set for each data-parallel worker by launch_training.py (or torchrun)
+        self.rank = int(os.environ.get("RANK", 0))
+        self.world_size = int(os.environ.get("WORLD_SIZE", 1))
+        Path("training/logs").mkdir(parents=True, exist_ok=True)
+        self.setup_logging()
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        print(f"Using device: {self.device}")
+        
+        # Create output directories
+        Path(config.output_dir).mkdir(parents=True, exist_ok=True)
+        Path("training/logs").mkdir(parents=True, exist_ok=True)
+        
+    def setup_logging(self):
+        """Set up logging configuration"""
+        if self.rank != 0:
+            # Rank 0 writes the training log; other workers only report problems
+            logging.basicConfig(
+                level=logging.WARNING,
+                format=f'%(asctime)s - rank {self.rank} - %(levelname)s - %(message)s',
+                handlers=[logging.StreamHandler()]
+            )
+            self.logger = logging.getLogger(__name__)
+            return
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - %(levelname)s - %(message)s',
+            handlers=[
+                logging.FileHandler(f'training/logs/training_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log'),
+                logging.StreamHandler()
+            ]
+        )
+        self.logger = logging.getLogger(__name__)
+    
+    def load_model_and_tokenizer(self):
+        """Load the base model and tokenizer"""
+        self.logger.info(f"Loading model: {self.config.model_name}")
+        
+        # Load tokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(
+            self.config.model_name,
+            revision=self.config.model_revision,
+            trust_remote_code=True,
+            padding_side="right"
+        )
+        
+        # Add pad token if not present
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        
+        # Load model
+        self.model = AutoModelForCausalLM.from_pretrained(
+            self.config.model_name,
+            revision=self.config.model_revision,
+            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+            device_map="auto" if torch.cuda.is_available() else None,
+            trust_remote_code=True,
+            attn_implementation=self.config.attn_implementation,
+            use_cache=False  # Disable KV cache for training
+        )
+        
+        self.pad_token_id = self.tokenizer.pad_token_id
+        self.eos_token_id = self.tokenizer.eos_token_id
+        self.prepare_model()
+        
+        self.logger.info("Model and tokenizer loaded successfully")
+    
+    def prepare_model(self):
+        """Enable gradient checkpointing and apply LoRA to the loaded model"""
+        # Enable gradient checkpointing to save memory
+        try:
+            self.model.gradient_checkpointing_enable()
+            self.logger.info("Gradient checkpointing enabled")
+        except Exception as e:
+            self.logger.warning(f"Could not enable gradient checkpointing: {e}")
+            self.logger.info("Training will continue without gradient checkpointing")
+        
+        # Apply LoRA if enabled
+        if self.config.use_lora:
+            self.apply_lora()
+    
+    def setup_distributed(self):
+        """Join the data-parallel process group of a launch_training.py run
+
+        Each worker trains on its own shard of every batch order; DDP
+        all-reduces only the gradients of trainable (LoRA) parameters, since
+        frozen weights have none. Gradient accumulation is divided between the
+        workers when it can be, so the effective batch size matches a
+        single-process run.
+        """
+        if self.world_size == 1:
+            return
+        if self.device.type != "cpu":
+            raise ValueError("Data-parallel workers are for CPU hosts; use a single process with device_map='auto' on GPU")
+        if not torch.distributed.is_initialized():
+            torch.distributed.init_process_group(backend="gloo")
+        
+        accumulation = self.config.gradient_accumulation_steps
+        if accumulation % self.world_size == 0:
+            self.config.gradient_accumulation_steps = accumulation // self.world_size
+        else:
+            self.logger.warning(
+                f"Gradient accumulation {accumulation} does not divide between {self.world_size} workers; "
+                f"the effective batch size grows {self.world_size}x"
+            )
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else "any CPU"
+        self.logger.info(
+            f"Data-parallel training on {self.world_size} workers (gloo); rank 0 has {torch.get_num_threads()} "
+            f"threads on CPUs {cpus} and {self.config.gradient_accumulation_steps} accumulation steps"
+        )
+    
+    def broadcast_from_rank0(self, value):
+        """Rank 0's value on every data-parallel worker, which all wait for it (value as is in a single process)"""
+        if self.world_size == 1:
+            return value
+        objects = [value]
+        torch.distributed.broadcast_object_list(objects, src=0)
+        return objects[0]
+    
+    def configure_cpu(self):
+        """Apply CPU performance mode: threads, dataloader workers, bf16 autocast and SDPA attention"""
+        if not self.config.cpu_performance or self.device.type != "cpu":
+            return
+        settings = plan_cpu_settings(self.config.num_threads, self.config.dataloader_workers)
+        apply_cpu_settings(settings)
+        self.config.dataloader_workers = settings.dataloader_workers
+        self.config.bf16 = settings.bf16
+        # SDPA's fused CPU kernels beat eager attention and accept the packed 4D mask as well
+        self.config.attn_implementation = "sdpa"
+        self.logger.info(
+            f"CPU performance mode: {settings.intra_op_threads} intra-op / {settings.inter_op_threads} inter-op threads, "
+            f"{settings.dataloader_workers} dataloader workers, bf16 autocast {'on' if settings.bf16 else 'off (no native bf16)'}, "
+            f"SDPA attention{', torch.compile' if self.config.torch_compile else ''}"
+        )
+    
+    def validate_config(self):
+        """Validate training configuration"""
+        self.logger.info("Validating configuration...")
+        
+        # Check batch size and gradient accumulation
+        effective_batch_size = self.config.batch_size * self.config.gradient_accumulation_steps
+        self.logger.info(f"Effective batch size: {effective_batch_size}")
+        
+        if effective_batch_size < 8:
+            self.logger.warning("Effective batch size is small. Consider increasing batch_size or gradient_accumulation_steps")
+        
+        # Check learning rate
+        if self.config.learning_rate > 1e-3:
+            self.logger.warning("Learning rate seems high. Consider using a lower learning rate (e.g., 1e-4)")
+        
+        # Check output directory
+        if Path(self.config.output_dir).exists() and not self.config.resume:
+            self.logger.warning(f"Output directory {self.config.output_dir} already exists. Will overwrite.")
+        
+        self.logger.info("Configuration validation completed")
+    
+    def apply_lora(self):
+        """Apply LoRA (Low-Rank Adaptation) for efficient fine-tuning"""
+        self.logger.info("Applying LoRA configuration...")
+        
+        lora_config = LoraConfig(
+            task_type=TaskType.CAUSAL_LM,
+            r=self.config.lora_r,
+            lora_alpha=self.config.lora_alpha,
+            lora_dropout=self.config.lora_dropout,
+            target_modules=list(self.config.lora_target_modules)
+        )
+        
+        self.model = get_peft_model(self.model, lora_config)
+        self.model.print_trainable_parameters()
+    
+    def prepare_datasets(self):
+        """Load the tokenized datasets matching this model, rebuilding them if allowed"""
+        data_path = self.config.data_path
+        if not Path(data_path).exists():
+            self.logger.error(f"Training data not found at {data_path}")
+            self.logger.info("Please run setup_vector_db.py first to process training datasets")
+            raise FileNotFoundError(f"Training data not found: {data_path}")
+        
+        fingerprint = dataset_fingerprint(
+            self.tokenizer,
+            model_name=self.config.model_name,
+            revision=self.config.model_revision,
+            max_length=self.config.max_length,
+            data_path=data_path
+        )
+        # Rank 0 tokenizes if needed while the other workers wait, then they load its dataset.
+        # Its outcome is always shared, so a failure on rank 0 fails every worker instead of leaving them waiting
+        if self.rank == 0:
+            outcome = {'error': 'an unexpected exit'}
+            try:
+                dataset_dir = self.find_or_build_dataset(fingerprint)
+                outcome = {'dataset_dir': str(dataset_dir)}
+            except Exception as e:
+                outcome = {'error': f"{type(e).__name__}: {e}"}
+                raise
+            finally:
+                self.broadcast_from_rank0(outcome)
+        else:
+            outcome = self.broadcast_from_rank0(None)
+            if 'error' in outcome:
+                raise RuntimeError(f"Rank 0 could not prepare the tokenized datasets: {outcome['error']}")
+            dataset_dir = Path(outcome['dataset_dir'])
+        
+        self.logger.info(f"Loading pre-tokenized datasets from {dataset_dir}...")
+        self.dataset_dir = dataset_dir
+        return load_tokenized_dataset(dataset_dir)
+    
+    def find_or_build_dataset(self, fingerprint: Dict[str, Any]) -> Path:
+        """Directory of the tokenized datasets matching fingerprint, tokenizing them if allowed"""
+        dataset_dir = find_tokenized_dataset(fingerprint)
+        if dataset_dir is not None:
+            return dataset_dir
+        if not self.config.rebuild_datasets:
+            self.logger.error(f"No tokenized dataset matches fingerprint {fingerprint['fingerprint']}: {fingerprint}")
+            self.logger.info("Run preprocess_and_save.py with the same model, revision and max length first")
+            raise FileNotFoundError("Tokenized datasets do not match the model. Run preprocessing first.")
+        self.logger.info(f"No tokenized dataset matches fingerprint {fingerprint['fingerprint']}, tokenizing...")
+        return preprocess_and_save(
+            model_name=self.config.model_name,
+            revision=self.config.model_revision,
+            data_path=self.config.data_path,
+            max_length=self.config.max_length,
+            tokenizer=self.tokenizer
+        )
+    
+    def pack_datasets(self, train_dataset, eval_dataset):
+        """Pack both splits into max_length blocks and log the padding saved"""
+        eos_token_id = self.eos_token_id
+        lengths = dataset_lengths(train_dataset)
+        real, padded_before = batch_padding(lengths, self.config.batch_size)
+        
+        train_dataset = PackedTokenStore(train_dataset, self.config.max_length, eos_token_id)
+        eval_dataset = PackedTokenStore(eval_dataset, self.config.max_length, eos_token_id)
+        
+        _, padded_after = batch_padding(dataset_lengths(train_dataset), self.config.batch_size)
+        self.logger.info(
+            f"Packed {len(lengths)} training examples into {len(train_dataset)} blocks of up to {self.config.max_length} tokens"
+        )
+        self.logger.info(
+            f"Tokens computed per epoch: {padded_before:,} padded -> {padded_after:,} packed "
+            f"({real / padded_before:.1%} -> {real / padded_after:.1%} real tokens, "
+            f"{padded_before / padded_after:.2f}x less compute)"
+        )
+        
+        data_collator = PackedDataCollator(
+            pad_token_id=self.pad_token_id,
+            pad_to_multiple_of=8,
+            mask_dtype=self.model.dtype
+        )
+        return train_dataset, eval_dataset, data_collator
+    
+    def memory_limit(self) -> float:
+        """Memory in GB one worker may use: the configured cap or a share of the device's memory"""
+        limit = self.config.memory_limit_gb or memory_limit_gb(self.model.device)
+        # Workers on one host share its memory
+        return limit / int(os.environ.get("LOCAL_WORLD_SIZE", 1))
+    
+    def tune_batch_size(self, train_dataset, data_collator):
+        """Pick the fastest micro-batch size that fits in memory on the longest batch, keeping the effective batch size"""
+        effective_batch_size = self.config.batch_size * self.config.gradient_accumulation_steps
+        limit = self.memory_limit()
+        self.logger.info(
+            f"Probing micro-batch sizes for an effective batch of {effective_batch_size} "
+            f"on the longest training batch (memory limit {limit:.1f} GB)..."
+        )
+        best, _ = find_batch_size(
+            self.model,
+            train_dataset,
+            data_collator,
+            effective_batch_size,
+            limit,
+            bf16=self.config.bf16,
+            log=self.logger.info
+        )
+        
+        if best is None:
+            self.logger.warning(
+                f"Even a batch of 1 exceeds the {limit:.1f} GB memory limit; training may run out of memory. "
+                "Consider a lower max_length or --memory-limit-gb."
+            )
+        batch_size = torch.tensor(best.batch_size if best else 1)
+        if self.world_size > 1:
+            # Every worker has to step with the same batch size; the smallest one fits on all of them
+            torch.distributed.all_reduce(batch_size, op=torch.distributed.ReduceOp.MIN)
+        self.config.batch_size = int(batch_size)
+        self.config.gradient_accumulation_steps = effective_batch_size // self.config.batch_size
+        self.logger.info(
+            f"Using micro-batch size {self.config.batch_size} with "
+            f"{self.config.gradient_accumulation_steps} gradient accumulation steps"
+        )
+    
+    def check_memory(self, train_dataset, data_collator):
+        """Predict the peak memory of the longest training batch and warn or abort if it exceeds the limit
+        
+        Running out of memory on the longest batch hours into a run wastes
+        every step before it; this costs a few short training passes.
+        """
+        limit = self.memory_limit()
+        self.logger.info(
+            f"Checking memory for the {self.config.batch_size} longest training examples "
+            f"(limit {limit:.1f} GB)..."
+        )
+        estimate = estimate_peak_memory(
+            self.model,
+            train_dataset,
+            data_collator,
+            self.config.batch_size,
+            bf16=self.config.bf16,
+            log=self.logger.info
+        )
+        predicted = torch.tensor(float("inf") if estimate.out_of_memory else estimate.predicted_gb)
+        if self.world_size > 1:
+            # Every worker stops if one of them would run out
+            torch.distributed.all_reduce(predicted, op=torch.distributed.ReduceOp.MAX)
+        predicted = float(predicted)
+        
+        if predicted <= limit:
+            self.logger.info(
+                f"Predicted peak {predicted:.2f} GB at sequence length {estimate.seq_len} "
+                f"with batch size {self.config.batch_size}, within the {limit:.1f} GB limit"
+            )
+            return
+        message = (
+            f"Training on the longest batch (sequence length {estimate.seq_len}, batch size {self.config.batch_size}) "
+            f"is predicted to peak at {predicted:.2f} GB, over the {limit:.1f} GB memory limit. "
+            "Lower batch_size or max_length, use --auto-batch-size, or raise --memory-limit-gb."
+        )
+        if self.config.memory_check == "abort":
+            raise MemoryError(message)
+        self.logger.warning(message)
+    
+    def log_bucketing(self, train_dataset, eval_dataset):
+        """Log the padding ratio of random vs length-bucketed batches for both splits"""
+        for split, dataset, shuffle in (("train", train_dataset, True), ("eval", eval_dataset, False)):
+            lengths = dataset_lengths(dataset)
+            if len(lengths) == 0:
+                continue
+            sampler = LengthBucketSampler(lengths, self.config.batch_size, shuffle=shuffle)
+            real, padded_random = batch_padding(lengths, self.config.batch_size)
+            _, padded_bucketed = batch_padding(lengths, self.config.batch_size, order=sampler.order())
+            self.logger.info(
+                f"{split} padding ratio: {1 - real / padded_random:.1%} random -> "
+                f"{1 - real / padded_bucketed:.1%} length-bucketed"
+            )
+    
+    def stream_train_dataset(self, train_dataset):
+        """Wrap the memory-mapped train split in a sequential, buffer-shuffled iterable dataset
+
+        Returns the number of optimizer steps covering num_epochs, which the
+        Trainer needs because an iterable dataset has no length.
+        """
+        examples_per_step = self.config.batch_size * self.config.gradient_accumulation_steps * self.world_size
+        max_steps = -(-len(train_dataset) // examples_per_step) * self.config.num_epochs
+        
+        train_dataset = StreamingTokenStore(train_dataset, self.config.shuffle_buffer_size, seed=42)
+        self.logger.info(
+            f"Streaming training data sequentially for {max_steps} steps "
+            f"(shuffle buffer {self.config.shuffle_buffer_size})"
+        )
+        return max_steps, train_dataset
+    
+    def tokenize_function(self, examples):
+        """Tokenize the training examples"""
+        return self.tokenizer(
+            examples["text"],
+            truncation=True,
+            padding=False,
+            max_length=self.config.max_length,
+            return_overflowing_tokens=False,
+        )
+    
+    def build_trainer(self, train_dataset, eval_dataset, **training_overrides):
+        """Collate, batch and wrap the datasets per the config and build the Hugging Face Trainer
+
+        training_overrides replace TrainingArguments defaults, e.g. max_steps
+        or eval_strategy for a benchmark run.
+        """
+        # Data collator
+        if self.config.packing:
+            train_dataset, eval_dataset, data_collator = self.pack_datasets(train_dataset, eval_dataset)
+        else:
+            data_collator = TokenStoreCollator(pad_token_id=self.pad_token_id, pad_to_multiple_of=8)
+        if self.config.auto_batch_size:
+            self.tune_batch_size(train_dataset, data_collator)
+        if self.config.memory_check:
+            self.check_memory(train_dataset, data_collator)
+        if self.config.length_bucketing:
+            self.log_bucketing(train_dataset, eval_dataset)
+        
+        # An iterable dataset has no length, so the run is bounded by steps instead of epochs
+        max_steps = -1
+        if self.config.streaming:
+            max_steps, train_dataset = self.stream_train_dataset(train_dataset)
+        
+        # Training arguments
+        training_args = TrainingArguments(**{
+            "output_dir": self.config.output_dir,
+            "overwrite_output_dir": True,
+            "num_train_epochs": self.config.num_epochs,
+            "max_steps": max_steps,
+            "per_device_train_batch_size": self.config.batch_size,
+            "per_device_eval_batch_size": self.config.batch_size,
+            "gradient_accumulation_steps": self.config.gradient_accumulation_steps,
+            "learning_rate": self.config.learning_rate,
+            "warmup_steps": self.config.warmup_steps,
+            "logging_steps": self.config.logging_steps,
+            "save_steps": self.config.save_steps,
+            "eval_steps": self.config.eval_steps,
+            "eval_strategy": "steps",
+            "save_strategy": "steps",
+            "load_best_model_at_end": True,
+            "metric_for_best_model": "eval_loss",
+            "greater_is_better": False,
+            "report_to": "wandb" if "WANDB_API_KEY" in os.environ else None,
+            "run_name": f"storyforge-phi3-{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+            "dataloader_pin_memory": False,
+            "fp16": False,  # Disable fp16 to avoid cache issues
+            "bf16": self.config.bf16,
+            "torch_compile": self.config.torch_compile,
+            "dataloader_num_workers": self.config.dataloader_workers or 0,
+            "remove_unused_columns": False,
+            "ddp_backend": "gloo" if self.world_size > 1 else None,
+            "ddp_find_unused_parameters": False,  # Every LoRA parameter is used in every step
+            **training_overrides
+        })
+        
+        # Early stopping needs the best checkpoint tracked at every evaluation
+        self.throughput = ThroughputCallback()
+        self.memory = MemoryCallback()
+        callbacks = [self.throughput, self.memory]
+        if training_args.load_best_model_at_end:
+            callbacks.append(EarlyStoppingCallback(early_stopping_patience=3))
+        if self.config.profile_steps:
+            start, end = self.config.profile_steps
+            self.profiler = StepProfilerCallback(
+                Path("training/logs") / f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+                start, end,
+                trace=self.config.profile_trace,
+                log=self.logger.info
+            )
+            callbacks.append(self.profiler)
+        
+        # Initialize trainer
+        # A streamed train split is shuffled through a buffer instead; eval is still bucketed
+        trainer_class = BucketedTrainer if self.config.length_bucketing else Trainer
+        if self.config.async_checkpoints:
+            trainer_class = type(f"AsyncCheckpoint{trainer_class.__name__}", (AsyncCheckpointMixin, trainer_class), {})
+        trainer = trainer_class(
+            model=self.model,
+            args=training_args,
+            train_dataset=train_dataset,
+            eval_dataset=eval_dataset,
+            tokenizer=self.tokenizer,
+            data_collator=data_collator,
+            callbacks=callbacks
+        )
+        # Its metrics are added to each log line, which the report_to integrations read
+        run_first(trainer, self.memory)
+        # Checkpoints name the tokenizer instead of copying it; the final model directory gets a copy
+        trainer.tokenizer_reference = {"name_or_path": self.config.model_name, "revision": self.config.model_revision}
+        return trainer
+    
+    def start_training(self, dry_run=False):
+        """Start the fine-tuning process"""
+        self.logger.info("Starting fine-tuning process...")
+        
+        # Validate configuration
+        self.validate_config()
+        
+        # Load model and tokenizer
+        self.setup_distributed()
+        self.configure_cpu()
+        self.load_model_and_tokenizer()
+        
+        # Tokenize datasets
+        """
+        self.logger.info("Tokenizing datasets...")
+        train_dataset = train_dataset.map(
+            self.tokenize_function,
+            batched=True,
+            remove_columns=train_dataset.column_names,
+            load_from_cache_file=False,
+            num_proc=1
+        )
+        
+        
+        eval_dataset = eval_dataset.map(
+            self.tokenize_function,
+            batched=True,
+            remove_columns=eval_dataset.column_names
+        )
+        
+        """
+        
+        # Load pre-tokenized datasets fingerprinted for this tokenizer and max length
+        train_dataset, eval_dataset = self.prepare_datasets()
+        self.logger.info(f"Loaded {len(train_dataset)} training samples and {len(eval_dataset)} validation samples")
+        
+        trainer = self.build_trainer(train_dataset, eval_dataset)
+        
+        if dry_run:
+            self.logger.info("Dry run enabled — skipping actual training.")
+            self.logger.info("Configuration, datasets, and trainer initialized successfully.")
+            return trainer  # Return trainer for inspection/testing
+        
+        # Start training
+        checkpoint = None
+        if self.config.resume:
+            checkpoint = latest_checkpoint(self.config.output_dir)
+            if checkpoint is None:
+                self.logger.warning(f"No complete checkpoint in {self.config.output_dir}; starting from step 0")
+            else:
+                self.logger.info(f"Resuming from {checkpoint}")
+        
+        self.logger.info("Beginning training...")
+        train_result = trainer.train(resume_from_checkpoint=str(checkpoint) if checkpoint else None)
+        self.log_throughput(trainer, train_result)
+        
+        # Save the final model
+        self.logger.info("Saving final model...")
+        trainer.save_model()  # Writes from rank 0 only
+        if trainer.is_world_process_zero():
+            self.tokenizer.save_pretrained(self.config.output_dir)
+            
+            # Save training metrics
+            self.save_training_metrics(trainer)
+        
+        self.logger.info("Training completed successfully!")
+
+        def save_model(self, trainer):
+            """Save the final model"""
+            self.logger.info("Saving final model...")
+            trainer.save_model()
+            self.tokenizer.save_pretrained(self.config.output_dir)
+
+    def log_throughput(self, trainer, train_result):
+        """Log real (non-padding) training tokens per second, where step time went and peak memory"""
+        summary = self.throughput.summary(all_ranks=True)
+        self.tokens_per_second = summary.get("tokens_per_second", 0)
+        if not summary["steps"]:
+            return
+        self.logger.info(
+            f"Trained on {summary['tokens']:,} real tokens in {summary['seconds']:.0f}s: "
+            f"{self.tokens_per_second:,.1f} tokens/sec, {summary['samples_per_second']:.2f} samples/sec "
+            f"on {self.world_size} worker{'s' if self.world_size > 1 else ''} (packing {'on' if self.config.packing else 'off'})"
+        )
+        self.logger.info("Step time: " + ", ".join(
+            f"{phase} {stats['fraction']:.0%}" for phase, stats in summary["phases"].items()
+        ))
+        
+        memory = self.memory.summary()
+        if memory["steps"]:
+            self.peak_memory_mb = memory["peak_mb"]
+            self.logger.info(
+                f"Peak {'CUDA' if memory['device'] == 'cuda' else 'RSS'} memory {memory['peak_mb']:,.0f} MB "
+                f"at step {memory['peak_step']} (sequence length {memory['peak_seq_len']}); by sequence length: "
+                + ", ".join(f"<={length} {peak:,.0f} MB" for length, peak in memory["peak_mb_by_seq_len"].items())
+            )
+    
+    def save_training_metrics(self, trainer):
+        """Save training metrics and configuration"""
+        try:
+            # Get the last log entry safely
+            log_history = trainer.state.log_history
+            if log_history:
+                final_train_loss = log_history[-1].get("train_loss", 0)
+                final_eval_loss = log_history[-1].get("eval_loss", 0)
+            else:
+                final_train_loss = 0
+                final_eval_loss = 0
+                self.logger.warning("No training logs found for metrics")
+            
+            metrics = {
+                "final_train_loss": final_train_loss,
+                "final_eval_loss": final_eval_loss,
+                "total_steps": trainer.state.global_step,
+                "tokens_per_second": getattr(self, "tokens_per_second", 0),
+                "peak_memory_mb": getattr(self, "peak_memory_mb", None),
+                "config": {
+                    "model_name": self.config.model_name,
+                    "learning_rate": self.config.learning_rate,
+                    "batch_size": self.config.batch_size,
+                    "gradient_accumulation_steps": self.config.gradient_accumulation_steps,
+                    "world_size": self.world_size,
+                    "num_epochs": self.config.num_epochs,
+                    "use_lora": self.config.use_lora,
+                    "max_length": self.config.max_length,
+                    "packing": self.config.packing,
+                    "cpu_performance": self.config.cpu_performance,
+                    "bf16": self.config.bf16,
+                    "torch_compile": self.config.torch_compile
+                },
+                "training_completed": datetime.now().isoformat()
+            }
+            
+            metrics_path = Path(self.config.output_dir) / "training_metrics.json"
+            with open(metrics_path, 'w') as f:
+                json.dump(metrics, f, indent=2)
+            
+            self.logger.info(f"Training metrics saved to {metrics_path}")
+        except Exception as e:
+            self.logger.error(f"Failed to save training metrics: {e}")
+
+def profile_window(value: str) -> Tuple[int, int]:
+    """Parse START:END into the optimizer step window profiled"""
+    try:
+        start, end = (int(part) for part in value.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected START:END, got {value!r}")
+    if not 0 <= start < end:
+        raise argparse.ArgumentTypeError(f"need 0 <= START < END, got {value!r}")
+    return start, end
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="Run a short training test with minimal data and steps")
+    parser.add_argument("--no-rebuild-datasets", action="store_true",
+                        help="Fail instead of re-tokenizing when no tokenized dataset matches the model")
+    parser.add_argument("--packing", action="store_true",
+                        help="Pack examples into max_length blocks instead of padding each batch")
+    parser.add_argument("--no-length-bucketing", action="store_true",
+                        help="Draw batches in random order instead of grouping examples of similar length")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Stream the training split from its Arrow shards instead of random access")
+    parser.add_argument("--cpu-performance", action="store_true",
+                        help="Without CUDA: bf16 autocast where the CPU supports it, SDPA attention, host-sized threads")
+    parser.add_argument("--torch-compile", action="store_true", help="torch.compile the model before training")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Intra-op threads in CPU performance mode (default: physical cores)")
+    parser.add_argument("--dataloader-workers", type=int, default=None,
+                        help="Dataloader worker processes (default: 0, or sized to the host in CPU performance mode)")
+    parser.add_argument("--auto-batch-size", action="store_true",
+                        help="Probe micro-batch sizes on the longest batch and use the fastest that fits in memory")
+    parser.add_argument("--memory-limit-gb", type=float, default=None,
+                        help="Memory cap for --auto-batch-size and --memory-check (default: 85%% of RAM or GPU memory)")
+    parser.add_argument("--memory-check", choices=["warn", "abort"], default=None,
+                        help="Before training, predict the longest batch's peak memory and warn or abort above the cap")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue from the latest complete checkpoint in the output directory")
+    parser.add_argument("--sync-checkpoints", action="store_true",
+                        help="Write full Trainer checkpoints (with tokenizer files) on the training thread")
+    parser.add_argument("--profile-steps", type=profile_window, default=None, metavar="START:END",
+                        help="Time each training phase over optimizer steps START to END-1, e.g. 10:20")
+    parser.add_argument("--profile-trace", action="store_true",
+                        help="With --profile-steps, also record a torch.profiler trace and top operators")
+    args = parser.parse_args()
+    if args.profile_trace and not args.profile_steps:
+        parser.error("--profile-trace needs --profile-steps")
+
+    print("StoryForge Model Fine-Tuning")
+    print("=" * 50)
+
+    config = ModelConfig(
+        rebuild_datasets=not args.no_rebuild_datasets,
+        packing=args.packing,
+        length_bucketing=not args.no_length_bucketing,
+        streaming=args.streaming,
+        cpu_performance=args.cpu_performance,
+        torch_compile=args.torch_compile,
+        num_threads=args.threads,
+        dataloader_workers=args.dataloader_workers,
+        auto_batch_size=args.auto_batch_size,
+        memory_limit_gb=args.memory_limit_gb,
+        memory_check=args.memory_check,
+        async_checkpoints=not args.sync_checkpoints,
+        resume=args.resume,
+        profile_steps=args.profile_steps,
+        profile_trace=args.profile_trace
+    )
+
+    if torch.cuda.is_available():
+        print(f"CUDA available: {torch.cuda.get_device_name()}")
+        print(f"GPU Memory: {torch.cuda.get_device_properties(0).total_memory / 1e9:.1f} GB")
+    else:
+        print("CUDA not available. Training will be slower on CPU.")
+        config.batch_size = 1
+        config.gradient_accumulation_steps = 8
+        if not args.cpu_performance:
+            print("Pass --cpu-performance for bf16, SDPA attention and host-sized threads.")
+
+    trainer = StoryForgeTrainer(config)
+
+    try:
+        trainer.start_training(dry_run=args.dry_run)
+        if args.dry_run:
+            print("\nDry run finished successfully")
+        else:
+            print("\nFine-tuning completed successfully")
+            print(f"Model saved to: {config.output_dir}")
+    except Exception as e:
+        print(f"Training failed: {e}")
+        raise
+
+if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Data-Parallel CPU Training Launcher for StoryForge
+Runs fine_tune_model.py as several gloo workers on one machine, each pinned to its own cores
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from cpu_performance import physical_core_groups, physical_cores, split_cores
+
+# One PyTorch process stops scaling after a handful of threads
+DEFAULT_CORES_PER_WORKER = 4
+POLL_INTERVAL = 1.0
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def worker_env(rank: int, world_size: int, threads: int, port: int) -> Dict[str, str]:
+    """torch.distributed rendezvous variables plus a thread count matching the worker's cores"""
+    return {
+        **os.environ,
+        "MASTER_ADDR": "127.0.0.1",
+        "MASTER_PORT": str(port),
+        "RANK": str(rank),
+        "LOCAL_RANK": str(rank),
+        "WORLD_SIZE": str(world_size),
+        "LOCAL_WORLD_SIZE": str(world_size),
+        "OMP_NUM_THREADS": str(threads),
+        "MKL_NUM_THREADS": str(threads)
+    }
+
+
+def format_cpus(cpus: List[int]) -> str:
+    """Compact CPU list, e.g. 0-3,8-11"""
+    ranges, start = [], None
+    for i, cpu in enumerate(cpus):
+        if start is None:
+            start = cpu
+        if i + 1 == len(cpus) or cpus[i + 1] != cpu + 1:
+            ranges.append(f"{start}-{cpu}" if cpu != start else str(cpu))
+            start = None
+    return ",".join(ranges)
+
+
+def launch(script: Path, script_args: List[str], num_workers: int) -> int:
+    """Start the workers, wait for them, and stop all of them as soon as one fails"""
+    cpu_sets = split_cores(num_workers)
+    core_groups = physical_core_groups()
+    port = free_port()
+    pin = hasattr(os, "sched_setaffinity")
+    if not pin:
+        print("⚠️ CPU pinning is not supported on this platform; workers share all cores")
+
+    workers = []
+    for rank, cpus in enumerate(cpu_sets):
+        # One thread per physical core; hyperthread siblings stay in the affinity mask but idle
+        threads = sum(1 for group in core_groups if group[0] in cpus)
+        print(f"🧩 Worker {rank}: CPUs {format_cpus(cpus)}, {threads} threads")
+        workers.append(subprocess.Popen(
+            [sys.executable, str(script), *script_args],
+            env=worker_env(rank, num_workers, threads, port),
+            preexec_fn=(lambda cpus=cpus: os.sched_setaffinity(0, cpus)) if pin else None
+        ))
+
+    try:
+        while True:
+            codes = [worker.poll() for worker in workers]
+            failed = [rank for rank, code in enumerate(codes) if code not in (None, 0)]
+            if failed:
+                print(f"⚠️ Worker {failed[0]} exited with code {codes[failed[0]]}; stopping the others")
+                break
+            if all(code == 0 for code in codes):
+                return 0
+            time.sleep(POLL_INTERVAL)
+    except KeyboardInterrupt:
+        print("⚠️ Interrupted; stopping workers")
+    for worker in workers:
+        if worker.poll() is None:
+            worker.terminate()
+    for worker in workers:
+        worker.wait()
+    return next((worker.returncode for worker in workers if worker.returncode), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run StoryForge fine-tuning as data-parallel CPU workers (arguments after -- go to the script)"
+    )
+    parser.add_argument("--nproc", type=int, default=None,
+                        help=f"Worker processes (default: one per {DEFAULT_CORES_PER_WORKER} physical cores)")
+    parser.add_argument("--script", default=str(Path(__file__).with_name("fine_tune_model.py")),
+                        help="Training script every worker runs, e.g. benchmark_training.py to measure scaling")
+    parser.add_argument("script_args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    script_args = args.script_args[1:] if args.script_args[:1] == ["--"] else args.script_args
+    num_workers = args.nproc or max(1, physical_cores() // DEFAULT_CORES_PER_WORKER)
+    if num_workers > physical_cores():
+        parser.error(f"--nproc {num_workers} needs as many physical cores; {physical_cores()} are available")
+    print(f"📦 Launching {num_workers} data-parallel worker{'s' if num_workers > 1 else ''} of {args.script}")
+    sys.exit(launch(Path(args.script), script_args, num_workers))
+
+
+if __name__ == "__main__":
+    main()
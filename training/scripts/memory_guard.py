@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Startup Memory Check for StoryForge Fine-Tuning
+Predicts the peak memory of the longest training batch from short probes, before training reaches it
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import torch
+
+from batch_size_finder import longest_batch, probe_batch_size
+
+# Probe the longest batch cut to these fractions of its length; none of them comes close to the full cost
+PROBE_FRACTIONS = (0.125, 0.25, 0.5)
+MIN_PROBE_LENGTH = 16
+
+
+@dataclass
+class MemoryEstimate:
+    """Measured peaks of truncated longest batches and the peak predicted at full length"""
+    batch_size: int
+    seq_len: int
+    probes: Dict[int, float] = field(default_factory=dict)  # Probed length -> peak GB
+    predicted_gb: float = 0.0
+    out_of_memory: bool = False  # A probe already ran out of memory
+
+
+def truncate_batch(batch: Dict[str, torch.Tensor], length: int) -> Dict[str, torch.Tensor]:
+    """The first length positions of every per-token tensor in a collated batch"""
+    truncated = {}
+    for key, value in batch.items():
+        if value.dim() == 4:
+            # Packed batches carry a (batch, 1, query, key) block-diagonal attention mask
+            truncated[key] = value[:, :, :length, :length]
+        elif value.dim() == 2:
+            truncated[key] = value[:, :length]
+        else:
+            truncated[key] = value
+    return truncated
+
+
+def extrapolate(lengths: List[int], peaks: List[float], target: int) -> float:
+    """Peak memory at target length, from peaks measured at shorter lengths
+
+    Activations grow linearly with length and eager attention scores
+    quadratically, so a quadratic through the probes is extrapolated; the
+    linear fit is used instead when it predicts more, since measurement
+    noise can bend a quadratic downwards.
+    """
+    x, y = np.asarray(lengths, dtype=float), np.asarray(peaks, dtype=float)
+    predictions = [np.polyval(np.polyfit(x, y, 1), target)]
+    if len(x) >= 3:
+        predictions.append(np.polyval(np.polyfit(x, y, 2), target))
+    return float(max(max(predictions), y.max()))
+
+
+def estimate_peak_memory(model, dataset, data_collator: Callable, batch_size: int, bf16: bool = False,
+                         log: Callable[[str], Any] = print) -> MemoryEstimate:
+    """Predict the peak memory of training on the batch_size longest examples without running it
+
+    The longest batch is trained on cut to a few short lengths, and the
+    measured peaks (process RSS on CPU, allocated memory on CUDA) are
+    extrapolated to its full length. A process killed by the kernel for
+    using too much RAM cannot report anything, so the full batch is never
+    tried.
+    """
+    batch = longest_batch(dataset, data_collator, batch_size)
+    seq_len = batch["input_ids"].shape[1]
+    estimate = MemoryEstimate(batch_size=batch_size, seq_len=seq_len)
+    lengths = sorted({max(MIN_PROBE_LENGTH, min(seq_len, int(seq_len * fraction))) for fraction in PROBE_FRACTIONS})
+    for length in lengths:
+        probe = probe_batch_size(model, truncate_batch(batch, length), float("inf"), bf16=bf16, repeats=1)
+        if probe.error:
+            log(f"  length {length:>5}: {probe.error}")
+            estimate.out_of_memory = True
+            return estimate
+        estimate.probes[length] = probe.peak_memory_gb
+        log(f"  length {length:>5}: {probe.peak_memory_gb:7.2f} GB peak")
+    estimate.predicted_gb = extrapolate(list(estimate.probes), list(estimate.probes.values()), seq_len)
+    return estimate
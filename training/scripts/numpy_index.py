@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+NumPy Vector Index for StoryForge
+Chroma-free storage backend: embeddings in a memory-mapped matrix, exact top-k by matmul
+"""
+
+import os
+import json
+import shutil
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+def _atomic_write_json(path: Path, data: Any):
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _matches(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """Evaluate the subset of Chroma's where syntax used by StoryForge ($and and equality)"""
+    if not where:
+        return True
+    for key, value in where.items():
+        if key == '$and':
+            if not all(_matches(metadata, clause) for clause in value):
+                return False
+        elif key == '$or':
+            if not any(_matches(metadata, clause) for clause in value):
+                return False
+        elif isinstance(value, dict):
+            if '$eq' in value and metadata.get(key) != value['$eq']:
+                return False
+            if '$ne' in value and metadata.get(key) == value['$ne']:
+                return False
+            if '$in' in value and metadata.get(key) not in value['$in']:
+                return False
+        elif metadata.get(key) != value:
+            return False
+    return True
+
+
+class NumpyCollection:
+    """One collection: vectors.bin (row-major, unit-normalized), ids/metadatas/documents JSON
+
+    Implements the part of the Chroma collection API StoryForgeVectorDB uses
+    (upsert, add, delete, get, query, count), so the two backends are
+    interchangeable. Deleted rows are tombstoned and compacted on persist.
+    Query distances are squared L2 between unit vectors (2 - 2*cos), as in
+    Chroma's default space.
+    """
+
+    def __init__(self, name: str, path: Path, dtype: str = 'float32', read_only: bool = False):
+        self.name = name
+        self.path = path
+        self.read_only = read_only
+        self.vectors_path = path / "vectors.bin"
+        self.meta_path = path / "meta.json"
+
+        self.dim = None
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        if self.meta_path.exists():
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.dim = meta['dim']
+            self.dtype = np.dtype(meta['dtype'])
+            self.rows = meta['rows']
+
+        self._matrix = None
+        # Row-aligned lists, loaded on first use so opening a collection only maps the vectors
+        self._ids = None
+        self._metadatas = None
+        self._documents = None
+        self._index = None
+        self._masks = {}
+        self._dirty = False
+
+    # -- storage ---------------------------------------------------------
+
+    def _load_records(self):
+        if self._ids is not None:
+            return
+        ids, metadatas = [], []
+        if self.rows:
+            with open(self.path / "ids.json", 'r', encoding='utf-8') as f:
+                ids = json.load(f)
+            with open(self.path / "metadatas.json", 'r', encoding='utf-8') as f:
+                metadatas = json.load(f)
+        # _ids is assigned last: concurrent readers either load again or see every field set
+        self._metadatas = metadatas
+        self._index = {record_id: row for row, record_id in enumerate(ids) if record_id is not None}
+        self._ids = ids
+
+    def _load_documents(self):
+        self._load_records()
+        if self._documents is not None:
+            return
+        if self.rows:
+            with open(self.path / "documents.json", 'r', encoding='utf-8') as f:
+                self._documents = json.load(f)
+        else:
+            self._documents = []
+
+    def _vectors(self) -> np.ndarray:
+        if not self.rows:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        if self._matrix is None or self._matrix.shape[0] != self.rows:
+            mode = 'r' if self.read_only else 'r+'
+            self._matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode=mode, shape=(self.rows, self.dim))
+        return self._matrix
+
+    def _check_writable(self):
+        if self.read_only:
+            raise PermissionError(f"Collection {self.name} was opened read-only")
+
+    # -- writes ------------------------------------------------------------
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str], metadatas: List[Dict[str, Any]]):
+        self._check_writable()
+        if len(set(ids)) != len(ids):
+            # Chroma rejects these too (DuplicateIDError); nothing is written
+            duplicates = sorted(record_id for record_id, count in Counter(ids).items() if count > 1)
+            raise ValueError(f"Expected unique ids in one upsert, got duplicates: {', '.join(duplicates[:5])}")
+        self._load_documents()
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(f"Embedding width {embeddings.shape[1]} does not match collection width {self.dim}")
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = (embeddings / np.maximum(norms, 1e-12)).astype(self.dtype)
+
+        new_rows = []
+        for record_id, embedding, document, metadata in zip(ids, embeddings, documents, metadatas):
+            row = self._index.get(record_id)
+            if row is not None:
+                self._vectors()[row] = embedding
+                self._documents[row] = document
+                self._metadatas[row] = metadata
+                continue
+            self._index[record_id] = self.rows + len(new_rows)
+            self._ids.append(record_id)
+            self._documents.append(document)
+            self._metadatas.append(metadata)
+            new_rows.append(embedding)
+
+        self._masks.clear()
+        if new_rows:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._matrix = None
+            with open(self.vectors_path, 'ab') as f:
+                f.truncate(self.rows * self.dim * self.dtype.itemsize)
+                f.write(np.stack(new_rows).tobytes())
+            self.rows += len(new_rows)
+        self._dirty = True
+
+    add = upsert
+
+    def delete(self, ids: List[str]):
+        self._check_writable()
+        self._load_documents()
+        for record_id in ids:
+            row = self._index.pop(record_id, None)
+            if row is not None:
+                self._ids[row] = None
+                self._documents[row] = None
+                self._metadatas[row] = None
+                self._masks.clear()
+                self._dirty = True
+
+    def persist(self):
+        """Compact tombstoned rows and write ids, metadata, documents and meta.json"""
+        if not self._dirty:
+            return
+        self._load_documents()
+        alive = [row for row, record_id in enumerate(self._ids) if record_id is not None]
+        if len(alive) < self.rows:
+            vectors = np.array(self._vectors()[alive]) if alive else np.zeros((0, self.dim), self.dtype)
+            self._matrix = None
+            tmp_path = self.vectors_path.with_name(self.vectors_path.name + '.tmp')
+            vectors.tofile(tmp_path)
+            os.replace(tmp_path, self.vectors_path)
+            self._ids = [self._ids[row] for row in alive]
+            self._documents = [self._documents[row] for row in alive]
+            self._metadatas = [self._metadatas[row] for row in alive]
+            self._index = {record_id: row for row, record_id in enumerate(self._ids)}
+            self._masks.clear()
+            self.rows = len(alive)
+        elif self._matrix is not None:
+            self._matrix.flush()
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        _atomic_write_json(self.path / "ids.json", self._ids)
+        _atomic_write_json(self.path / "metadatas.json", self._metadatas)
+        _atomic_write_json(self.path / "documents.json", self._documents)
+        # Written last: rows beyond meta.json's count are ignored after a crash
+        _atomic_write_json(self.meta_path, {'dim': self.dim, 'dtype': self.dtype.name, 'rows': self.rows})
+        self._dirty = False
+
+    # -- reads -------------------------------------------------------------
+
+    def count(self) -> int:
+        self._load_records()
+        return len(self._index)
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Optional[List[str]] = None) -> Dict[str, Any]:
+        include = include if include is not None else ['documents', 'metadatas']
+        self._load_records()
+        if ids is not None:
+            rows = [self._index[record_id] for record_id in ids if record_id in self._index]
+        else:
+            rows = [row for row, record_id in enumerate(self._ids) if record_id is not None]
+        if where:
+            rows = [row for row in rows if _matches(self._metadatas[row], where)]
+        start = offset or 0
+        rows = rows[start:start + limit] if limit is not None else rows[start:]
+
+        result = {'ids': [self._ids[row] for row in rows]}
+        if 'documents' in include:
+            self._load_documents()
+            result['documents'] = [self._documents[row] for row in rows]
+        if 'metadatas' in include:
+            result['metadatas'] = [self._metadatas[row] for row in rows]
+        if 'embeddings' in include:
+            result['embeddings'] = np.asarray(self._vectors()[rows], dtype=np.float32)
+        return result
+
+    def _candidates(self, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        """Rows that are live and match where, memoized per filter until the next write"""
+        mask_key = json.dumps(where, sort_keys=True)
+        if mask_key not in self._masks:
+            self._masks[mask_key] = np.array([
+                row for row, (record_id, metadata) in enumerate(zip(self._ids, self._metadatas))
+                if record_id is not None and _matches(metadata, where)
+            ], dtype=np.int64)
+        return self._masks[mask_key]
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[Dict[str, Any]] = None,
+              include: Optional[List[str]] = None) -> Dict[str, List[list]]:
+        """Exact top-k over every live row with one matmul and argpartition"""
+        include = include if include is not None else ['documents', 'metadatas', 'distances']
+        self._load_records()
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        result = {'ids': [], 'documents': [], 'metadatas': [], 'distances': []}
+        if not self.rows:
+            for key in result:
+                result[key] = [[] for _ in queries]
+            return result
+
+        candidates = self._candidates(where)
+        k = min(n_results, len(candidates))
+
+        if k:
+            matrix = self._vectors()
+            if len(candidates) < self.rows:
+                matrix = matrix[candidates]
+            scores = queries @ np.asarray(matrix, dtype=np.float32).T
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+        else:
+            top = np.zeros((len(queries), 0), dtype=np.int64)
+            top_scores = np.zeros((len(queries), 0), dtype=np.float32)
+
+        if 'documents' in include:
+            self._load_documents()
+        for rows, row_scores in zip(top, top_scores):
+            rows = candidates[rows]
+            result['ids'].append([self._ids[row] for row in rows])
+            result['documents'].append([self._documents[row] for row in rows] if 'documents' in include else None)
+            result['metadatas'].append([self._metadatas[row] for row in rows])
+            result['distances'].append((2.0 - 2.0 * row_scores).tolist())
+        return result
+
+
+class NumpyVectorStore:
+    """Client for a directory of NumpyCollections, mirroring chromadb's client calls
+
+    Opened with read_only=True the vectors are mapped without write access,
+    so several inference processes share one page-cache copy.
+    """
+
+    def __init__(self, path: str, dtype: str = 'float32', read_only: bool = False):
+        self.path = Path(path)
+        self.dtype = dtype
+        self.read_only = read_only
+        if not read_only:
+            self.path.mkdir(parents=True, exist_ok=True)
+        self._collections: Dict[str, NumpyCollection] = {}
+
+    def get_or_create_collection(self, name: str) -> NumpyCollection:
+        if name not in self._collections:
+            self._collections[name] = NumpyCollection(name, self.path / name, self.dtype, self.read_only)
+        return self._collections[name]
+
+    def delete_collection(self, name: str):
+        if self.read_only:
+            raise PermissionError("Vector store was opened read-only")
+        self._collections.pop(name, None)
+        if not (self.path / name).exists():
+            raise ValueError(f"Collection {name} does not exist")
+        shutil.rmtree(self.path / name)
+
+    def persist(self):
+        for collection in self._collections.values():
+            collection.persist()
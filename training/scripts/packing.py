@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Sequence Packing for StoryForge Fine-Tuning
+Packs tokenized examples into max_length blocks so batches carry almost no padding
+"""
+
+import random
+from bisect import bisect_left, insort
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+# Examples considered together when filling blocks; bigger windows fill blocks slightly better
+PACKING_WINDOW = 2000
+
+
+def pack_lengths(lengths: Sequence[int], max_length: int) -> List[List[int]]:
+    """Group example indices into blocks of at most max_length tokens
+
+    Best-fit decreasing: longest examples are placed first, each into the open
+    block with the least room that still fits it. Examples are never split
+    across blocks.
+    """
+    blocks: List[List[int]] = []
+    open_blocks: List[Tuple[int, int]] = []  # (free tokens, block index), sorted
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+        length = lengths[index]
+        slot = bisect_left(open_blocks, (length, -1))
+        if slot < len(open_blocks):
+            free, block = open_blocks.pop(slot)
+        else:
+            free, block = max_length, len(blocks)
+            blocks.append([])
+        blocks[block].append(index)
+        if free - length > 0:
+            insort(open_blocks, (free - length, block))
+    return blocks
+
+
+def batch_padding(lengths: Sequence[int], batch_size: int, pad_to_multiple_of: int = 8,
+                  order: Optional[Sequence[int]] = None, seed: int = 42) -> Tuple[int, int]:
+    """(real tokens, computed tokens) for one epoch of padded-to-longest batches
+
+    Batches are taken consecutively from order, or from a random shuffle when
+    no order is given.
+    """
+    if order is None:
+        order = list(range(len(lengths)))
+        random.Random(seed).shuffle(order)
+    real = padded = 0
+    for start in range(0, len(order), batch_size):
+        batch = [lengths[i] for i in order[start:start + batch_size]]
+        longest = -(-max(batch) // pad_to_multiple_of) * pad_to_multiple_of
+        real += sum(batch)
+        padded += longest * len(batch)
+    return real, padded
+
+
+class PackedTokenStore(Dataset):
+    """Blocks of whole examples from a TokenStore, concatenated when read
+
+    Every example ends in eos_token_id (appended, or replacing its last token
+    when it is already max_length long). position_ids restart at 0 for each
+    example, which is also how PackedDataCollator finds example boundaries.
+    Only the block layout is kept in memory (two int64 arrays); tokens stay
+    in the memory-mapped store. Examples are packed window at a time, so
+    packing cost stays linear in the dataset size.
+    """
+
+    def __init__(self, store, max_length: int, eos_token_id: int, window: int = PACKING_WINDOW):
+        self.store = store
+        self.max_length = max_length
+        self.eos_token_id = eos_token_id
+
+        lengths = np.asarray(store.lengths, dtype=np.int64)
+        ends = np.asarray(store.offsets[1:], dtype=np.int64)
+        if len(store.tokens):
+            last_tokens = np.asarray(store.tokens[np.maximum(ends - 1, 0)], dtype=np.int64)
+        else:
+            last_tokens = np.full(len(lengths), -1, dtype=np.int64)
+        self.needs_eos = (lengths == 0) | (last_tokens != eos_token_id)
+        self.example_lengths = np.minimum(lengths + self.needs_eos, max_length)
+
+        order, block_offsets = [], [0]
+        for start in range(0, len(lengths), window):
+            for block in pack_lengths(self.example_lengths[start:start + window].tolist(), max_length):
+                order.extend(start + i for i in block)
+                block_offsets.append(len(order))
+        self.order = np.asarray(order, dtype=np.int64)
+        self.block_offsets = np.asarray(block_offsets, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.block_offsets) - 1
+
+    def example_ids(self, index: int) -> np.ndarray:
+        ids = self.store[index]["input_ids"]
+        if self.needs_eos[index]:
+            ids = np.append(ids[:self.max_length - 1], np.uint32(self.eos_token_id))
+        return ids
+
+    def __getitem__(self, index: int) -> Dict[str, np.ndarray]:
+        examples = self.order[self.block_offsets[index]:self.block_offsets[index + 1]]
+        pieces = [self.example_ids(i) for i in examples]
+        return {
+            "input_ids": np.concatenate(pieces),
+            "position_ids": np.concatenate([np.arange(len(ids)) for ids in pieces])
+        }
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Token count of every block"""
+        cumulative = np.concatenate([[0], np.cumsum(self.example_lengths[self.order])])
+        return cumulative[self.block_offsets[1:]] - cumulative[self.block_offsets[:-1]]
+
+
+class PackedDataCollator:
+    """Collate packed blocks for causal LM training
+
+    Builds a 4D additive attention mask that is causal within each packed
+    example and blocks attention across example boundaries, plus labels that
+    ignore padding and the first token of every example (it would otherwise
+    be predicted from the previous example's EOS).
+    """
+
+    def __init__(self, pad_token_id: int, pad_to_multiple_of: int = 8, mask_dtype: torch.dtype = torch.float32):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.mask_dtype = mask_dtype
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        longest = max(len(f["input_ids"]) for f in features)
+        length = -(-longest // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        input_ids = torch.full((len(features), length), self.pad_token_id, dtype=torch.long)
+        position_ids = torch.zeros((len(features), length), dtype=torch.long)
+        labels = torch.full((len(features), length), -100, dtype=torch.long)
+        # Padding gets its own segment id so its rows still attend to something
+        segments = torch.full((len(features), length), -1, dtype=torch.long)
+
+        for row, feature in enumerate(features):
+            ids = torch.from_numpy(np.asarray(feature["input_ids"], dtype=np.int64))
+            positions = torch.from_numpy(np.asarray(feature["position_ids"], dtype=np.int64))
+            n = len(ids)
+            input_ids[row, :n] = ids
+            position_ids[row, :n] = positions
+            labels[row, :n] = ids
+            starts = positions == 0
+            labels[row, :n][starts] = -100
+            segments[row, :n] = torch.cumsum(starts.long(), dim=0)
+
+        same_segment = segments[:, :, None] == segments[:, None, :]
+        causal = torch.ones((length, length), dtype=torch.bool).tril()
+        allowed = same_segment & causal
+        attention_mask = torch.zeros(allowed.shape, dtype=self.mask_dtype)
+        attention_mask.masked_fill_(~allowed, torch.finfo(self.mask_dtype).min)
+
+        return {
+            "input_ids": input_ids,
+            "position_ids": position_ids,
+            "attention_mask": attention_mask[:, None, :, :],
+            "labels": labels
+        }
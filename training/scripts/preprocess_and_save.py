@@ -1,79 +1,291 @@
 # preprocess_and_save.py
-from datasets import Dataset
+from datasets import Dataset, load_from_disk
+import os
 import json
+import shutil
+import hashlib
+import argparse
 from transformers import AutoTokenizer
+from collections import Counter
 from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
 import torch
 
-MODEL_NAME = "microsoft/Phi-3.5-mini-instruct"
-DATA_PATH = "training/processed_data.json"
+from training_data import DEFAULT_EXPORT_PATH, iter_exported_records
+from templates import TemplateSplicer, template_hash
+from token_store import STORE_FORMAT, TokenStore, TokenStoreWriter
+
+MODEL_NAME = "Qwen/Qwen2.5-0.5B-Instruct"
+DATA_PATH = DEFAULT_EXPORT_PATH
 OUTPUT_DIR = "training/tokenized_dataset"
+MAX_LENGTH = 2048  # Matches ModelConfig.max_length in fine_tune_model.py
+
+# Tokenized story bodies and prompts, one subdirectory per tokenizer and export
+BODY_CACHE_DIR = "bodies"
+
+# Fields kept for every body; part of the body fingerprint so caches missing one are rebuilt
+BODY_COLUMNS = ["kind", "body_ids", "age_group", "genre", "split", "collection", "source"]
+
+# Share of stories (by id hash) held out for validation
+VAL_PERCENT = 10
+# 2: examples are split by the story they come from, not by their own id
+SPLIT_VERSION = 2
+
+# Tokenized bodies are saved as Arrow shards of at most this size
+MAX_SHARD_SIZE = "500MB"
+
+# Below this many examples per process, worker start-up costs more than it saves
+MIN_EXAMPLES_PER_PROC = 1000
+
+def example_split(record: Dict[str, Any]) -> str:
+    """'train' or 'val', decided by a hash of the record's story so it is stable across runs
+
+    Consecutive chunks of a story share their overlap, so every chunk
+    follows the story (metadata story_id) it was cut from; records that
+    were never chunked are a story of their own.
+    """
+    story_id = (record.get('metadata') or {}).get('story_id') or record['id']
+    key = f"{record['collection']}/{story_id}".encode('utf-8')
+    bucket = int(hashlib.sha256(key).hexdigest()[:8], 16) % 100
+    return "val" if bucket < VAL_PERCENT else "train"
 
-def format_training_text(story: str, metadata: dict) -> str:
-    age_group = metadata.get('age_group', '7-10')
-    genre = metadata.get('genre', 'adventure')
-    return f"""<|system|>
-You are a helpful AI assistant that creates engaging, age-appropriate stories for children aged {age_group}. Your stories should be safe, educational, and entertaining.
-<|end|>
-<|user|>
-Create a {genre} story suitable for children aged {age_group}.
-<|end|>
-<|assistant|>
-{story.strip()}
-<|end|>"""
-
-def format_prompt_text(prompt: str, metadata: dict) -> str:
-    return f"""<|system|>
-You are a helpful AI assistant that creates engaging, age-appropriate stories for children. Always ensure content is safe and suitable for young readers.
-<|end|>
-<|user|>
-{prompt.strip()}
-<|end|>
-<|assistant|>
-Once upon a time, there was a magical adventure waiting to unfold...
-<|end|>"""
-
-def preprocess_and_save():
-    print("📦 Preprocessing and tokenizing training data...")
-    with open(DATA_PATH, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    training_texts = []
-
-    if 'stories' in data['data']:
-        for doc, metadata in zip(data['data']['stories']['documents'], data['data']['stories']['metadatas']):
-            if len(doc.strip()) > 50:
-                training_texts.append(format_training_text(doc, metadata))
-
-    if 'prompts' in data['data']:
-        for doc, metadata in zip(data['data']['prompts']['documents'], data['data']['prompts']['metadatas']):
-            if len(doc.strip()) > 20:
-                training_texts.append(format_prompt_text(doc, metadata))
-
-    dataset = Dataset.from_dict({"text": training_texts})
-    train_val = dataset.train_test_split(test_size=0.1, seed=42)
-
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, trust_remote_code=True)
+def iter_training_bodies(data_path: str = DATA_PATH) -> Iterator[Dict[str, str]]:
+    """Yield the untemplated body of every training example in the export, one record at a time"""
+    for record in iter_exported_records(data_path):
+        doc, metadata = record['document'], record['metadata']
+        if record['collection'] == 'stories' and len(doc.strip()) > 50:
+            kind = "story"
+        elif record['collection'] == 'prompts' and len(doc.strip()) > 20:
+            kind = "prompt"
+        else:
+            continue
+        yield {
+            "kind": kind,
+            "body": doc.strip(),
+            "age_group": metadata.get('age_group') or "",
+            "genre": metadata.get('genre') or "",
+            "split": example_split(record),
+            "collection": record['collection'],
+            # Ids start with the file's path under training-datasets/, so this is its top-level folder
+            "source": str(record['id']).split('/', 1)[0]
+        }
+
+def hash_file(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def load_tokenizer(model_name: str = MODEL_NAME, revision: Optional[str] = None):
+    tokenizer = AutoTokenizer.from_pretrained(model_name, revision=revision, trust_remote_code=True)
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
+
+def tokenizer_hash(tokenizer) -> str:
+    """Hash of the tokenizer's vocabulary and rules, independent of where it was loaded from"""
+    if tokenizer.is_fast:
+        state = json.loads(tokenizer.backend_tokenizer.to_str())
+        # Truncation and padding are per-call settings the tokenizer remembers, not part of the vocabulary
+        state.pop('truncation', None)
+        state.pop('padding', None)
+    else:
+        state = tokenizer.get_vocab()
+    payload = json.dumps(state, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _with_fingerprint(components: Dict[str, Any]) -> Dict[str, Any]:
+    payload = json.dumps(components, sort_keys=True)
+    components['fingerprint'] = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+    return components
+
+def body_fingerprint(tokenizer, model_name: str = MODEL_NAME, revision: Optional[str] = None,
+                     data_path: str = DATA_PATH) -> Dict[str, Any]:
+    """Everything the tokenized bodies depend on: the tokenizer and the export, not the template"""
+    return _with_fingerprint({
+        'tokenizer_name': model_name,
+        'tokenizer_revision': revision or "main",
+        'tokenizer_hash': tokenizer_hash(tokenizer),
+        'val_percent': VAL_PERCENT,
+        'split_version': SPLIT_VERSION,
+        'body_columns': BODY_COLUMNS,
+        'data_sha256': hash_file(data_path),
+    })
+
+def dataset_fingerprint(tokenizer, model_name: str = MODEL_NAME, revision: Optional[str] = None,
+                        max_length: int = MAX_LENGTH, data_path: str = DATA_PATH) -> Dict[str, Any]:
+    """Everything a tokenized dataset depends on, plus a short fingerprint naming it"""
+    bodies = body_fingerprint(tokenizer, model_name, revision, data_path)
+    components = {key: value for key, value in bodies.items() if key != 'fingerprint'}
+    components['template_hash'] = template_hash(tokenizer)
+    components['max_length'] = max_length
+    components['store_format'] = STORE_FORMAT
+    return _with_fingerprint(components)
+
+def _find_fingerprinted_dir(fingerprint: Dict[str, Any], parent: Path) -> Optional[Path]:
+    directory = parent / fingerprint['fingerprint']
+    marker = directory / "fingerprint.json"
+    if not marker.exists():
+        return None
+    with open(marker, 'r', encoding='utf-8') as f:
+        if json.load(f) != fingerprint:
+            return None
+    return directory
+
+def _publish(tmp_dir: Path, final_dir: Path, fingerprint: Dict[str, Any]):
+    """Mark tmp_dir complete and move it into place, so an interrupted run never looks complete"""
+    with open(tmp_dir / "fingerprint.json", 'w', encoding='utf-8') as f:
+        json.dump(fingerprint, f, indent=2)
+    shutil.rmtree(final_dir, ignore_errors=True)
+    os.replace(tmp_dir, final_dir)
+
+def _scratch_dir(final_dir: Path) -> Path:
+    tmp_dir = final_dir.with_name(final_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    return tmp_dir
+
+def find_tokenized_dataset(fingerprint: Dict[str, Any], output_dir: str = OUTPUT_DIR) -> Optional[Path]:
+    """Directory holding train/val tokenized with this fingerprint, if one is complete on disk"""
+    return _find_fingerprinted_dir(fingerprint, Path(output_dir))
+
+def _worker_count(num_proc: Optional[int], num_examples: int) -> int:
+    if num_proc is None:
+        num_proc = os.cpu_count() or 1
+    return max(1, min(num_proc, num_examples // MIN_EXAMPLES_PER_PROC))
+
+def tokenize_bodies(tokenizer, model_name: str = MODEL_NAME, revision: Optional[str] = None,
+                    data_path: str = DATA_PATH, output_dir: str = OUTPUT_DIR,
+                    num_proc: Optional[int] = None, force: bool = False) -> Path:
+    """Tokenize every story body and prompt once per tokenizer and export, unless already done
+
+    Bodies are tokenized without any template, so they can be reused for any
+    chat template, system prompt or max_length.
+    """
+    fingerprint = body_fingerprint(tokenizer, model_name, revision, data_path)
+    parent = Path(output_dir) / BODY_CACHE_DIR
+    bodies_dir = _find_fingerprinted_dir(fingerprint, parent)
+    if bodies_dir is not None and not force:
+        print(f"✅ Tokenized bodies {fingerprint['fingerprint']} are up to date: {bodies_dir}")
+        return bodies_dir
+    bodies_dir = parent / fingerprint['fingerprint']
+
+    tmp_dir = _scratch_dir(bodies_dir)
+    # Arrow files written while streaming; memory-mapped, so RAM stays flat whatever the corpus size
+    cache_dir = str(tmp_dir / "cache")
+
+    print("📦 Streaming training examples from the export...")
+    bodies = Dataset.from_generator(iter_training_bodies, gen_kwargs={"data_path": data_path}, cache_dir=cache_dir)
 
     def tokenize_function(examples):
-        return tokenizer(
-            examples["text"],
-            truncation=True,
-            padding=False,
-            max_length=1024,
-        )
+        return {"body_ids": tokenizer(examples["body"], add_special_tokens=False)["input_ids"]}
+
+    num_proc = _worker_count(num_proc, len(bodies))
+    print(f"✏️ Tokenizing {len(bodies)} story bodies and prompts with {num_proc} process(es)...")
+    previous = os.environ.get("TOKENIZERS_PARALLELISM")
+    if num_proc > 1:
+        # Worker processes tokenize in parallel themselves; the Rust thread pool would only oversubscribe
+        os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    try:
+        tokenized = bodies.map(tokenize_function, batched=True, num_proc=num_proc, remove_columns=["body"])
+    finally:
+        # The trainer process importing this module keeps the fast tokenizer's own threads
+        if num_proc > 1:
+            if previous is None:
+                os.environ.pop("TOKENIZERS_PARALLELISM", None)
+            else:
+                os.environ["TOKENIZERS_PARALLELISM"] = previous
+    tokenized.save_to_disk(str(tmp_dir / "bodies"), max_shard_size=MAX_SHARD_SIZE)
 
-    print("✏️ Tokenizing...")
-    train_tokenized = train_val["train"].map(tokenize_function, batched=True, num_proc=1, remove_columns=["text"])
-    val_tokenized = train_val["test"].map(tokenize_function, batched=True, num_proc=1, remove_columns=["text"])
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    _publish(tmp_dir, bodies_dir, fingerprint)
+    return bodies_dir
 
-    Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
-    train_tokenized.save_to_disk(f"{OUTPUT_DIR}/train")
-    val_tokenized.save_to_disk(f"{OUTPUT_DIR}/val")
+def preprocess_and_save(model_name: str = MODEL_NAME, revision: Optional[str] = None,
+                        data_path: str = DATA_PATH, output_dir: str = OUTPUT_DIR,
+                        max_length: int = MAX_LENGTH, num_proc: Optional[int] = None,
+                        tokenizer=None, force: bool = False) -> Path:
+    """Tokenize the export into token stores at output_dir/<fingerprint>/{train,val}, unless already done
 
-    print("✅ Tokenized datasets saved to disk!")
+    Only the story bodies are tokenized, and only when the tokenizer or the
+    export changed; the chat-template framing is spliced around the cached
+    body ids, so a new template or max_length builds in seconds.
+    """
+    if tokenizer is None:
+        tokenizer = load_tokenizer(model_name, revision)
+    fingerprint = dataset_fingerprint(tokenizer, model_name, revision, max_length, data_path)
+
+    dataset_dir = find_tokenized_dataset(fingerprint, output_dir)
+    if dataset_dir is not None and not force:
+        print(f"✅ Tokenized dataset {fingerprint['fingerprint']} is up to date: {dataset_dir}")
+        return dataset_dir
+    dataset_dir = Path(output_dir) / fingerprint['fingerprint']
+
+    bodies_dir = tokenize_bodies(tokenizer, model_name, revision, data_path, output_dir, num_proc, force)
+    bodies = load_from_disk(str(bodies_dir / "bodies"))
+
+    tmp_dir = _scratch_dir(dataset_dir)
+    splicer = TemplateSplicer(tokenizer)
+    print(f"🧩 Splicing chat template around {len(bodies)} tokenized bodies (max length {max_length})...")
+    # Examples whose body was cut to fit max_length, overall and per collection and source
+    truncated = {split: {"total": 0, "collection": Counter(), "source": Counter()} for split in ("train", "val")}
+    with TokenStoreWriter(tmp_dir / "train") as train, TokenStoreWriter(tmp_dir / "val") as val:
+        writers = {"train": train, "val": val}
+        for batch in bodies.iter(batch_size=10_000):
+            for kind, body_ids, age_group, genre, split, collection, source in zip(
+                *(batch[column] for column in BODY_COLUMNS)
+            ):
+                metadata = {"age_group": age_group, "genre": genre}
+                token_ids = splicer.splice(kind, body_ids, metadata, max_length)
+                prefix, suffix = splicer.frame(kind, metadata)
+                if len(token_ids) < len(prefix) + len(body_ids) + len(suffix):
+                    truncated[split]["total"] += 1
+                    truncated[split]["collection"][collection] += 1
+                    truncated[split]["source"][source] += 1
+                writers[split].add(token_ids, collection=collection, source=source)
+    stats = {
+        split: {
+            "examples": writer.num_examples,
+            "tokens": writer.num_tokens,
+            "truncated": truncated[split]["total"],
+            "truncated_by_collection": dict(truncated[split]["collection"]),
+            "truncated_by_source": dict(truncated[split]["source"])
+        }
+        for split, writer in writers.items()
+    }
+    total_truncated = sum(split["truncated"] for split in stats.values())
+    if total_truncated:
+        print(f"✂️ {total_truncated} of {len(bodies)} examples were truncated to fit max length {max_length}")
+
+    with open(tmp_dir / "stats.json", 'w', encoding='utf-8') as f:
+        json.dump(stats, f, indent=2)
+    _publish(tmp_dir, dataset_dir, fingerprint)
+
+    print(f"✅ Tokenized datasets saved to {dataset_dir}")
+    return dataset_dir
+
+def load_tokenized_dataset(dataset_dir: Path) -> Tuple[TokenStore, TokenStore]:
+    """Open the memory-mapped (train, val) token stores written by preprocess_and_save"""
+    dataset_dir = Path(dataset_dir)
+    return TokenStore(dataset_dir / "train"), TokenStore(dataset_dir / "val")
+
+def load_dataset_stats(dataset_dir: Path) -> Dict[str, Dict[str, Any]]:
+    """Example, token and truncation counts per split, recorded by preprocess_and_save"""
+    with open(Path(dataset_dir) / "stats.json", 'r', encoding='utf-8') as f:
+        return json.load(f)
 
 if __name__ == "__main__":
-    preprocess_and_save()
+    parser = argparse.ArgumentParser(description="Tokenize the exported training data")
+    parser.add_argument("--model-name", default=MODEL_NAME, help="Tokenizer to use; must match the model being fine-tuned")
+    parser.add_argument("--revision", default=None, help="Tokenizer revision (branch, tag or commit)")
+    parser.add_argument("--data-path", default=DATA_PATH, help="Export written by setup_vector_db.py")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Directory holding one subdirectory per fingerprint")
+    parser.add_argument("--max-length", type=int, default=MAX_LENGTH, help="Truncate examples to this many tokens")
+    parser.add_argument("--num-proc", type=int, default=None, help="Tokenizer processes (default: all cores)")
+    parser.add_argument("--force", action="store_true", help="Re-tokenize even if a matching dataset exists")
+    args = parser.parse_args()
+
+    preprocess_and_save(model_name=args.model_name, revision=args.revision, data_path=args.data_path,
+                        output_dir=args.output_dir, max_length=args.max_length, num_proc=args.num_proc,
+                        force=args.force)
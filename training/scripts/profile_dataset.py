@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Tokenized Dataset Profiler for StoryForge Fine-Tuning
+Reports token length distributions, truncation, padding and run-time estimates
+for a dataset written by preprocess_and_save.py, before a long training run
+"""
+
+import argparse
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from bucketing import LengthBucketSampler
+from packing import PACKING_WINDOW, batch_padding, pack_lengths
+from preprocess_and_save import OUTPUT_DIR, load_dataset_stats
+from token_store import TokenStore
+
+# Defaults mirror ModelConfig in fine_tune_model.py
+DEFAULT_BATCH_SIZE = 8
+DEFAULT_GRADIENT_ACCUMULATION_STEPS = 2
+DEFAULT_EPOCHS = 4
+PAD_TO_MULTIPLE_OF = 8
+
+HISTOGRAM_BINS = 16
+HISTOGRAM_WIDTH = 40
+
+
+def latest_dataset_dir(output_dir: str = OUTPUT_DIR) -> Path:
+    """Most recently built fingerprinted dataset under output_dir"""
+    candidates = [path.parent for path in Path(output_dir).glob("*/fingerprint.json")]
+    if not candidates:
+        raise FileNotFoundError(f"No tokenized datasets under {output_dir}. Run preprocess_and_save.py first.")
+    return max(candidates, key=lambda path: (path / "fingerprint.json").stat().st_mtime)
+
+
+def truncated_count(lengths: np.ndarray, max_length: int, dataset_max_length: int,
+                    recorded: Optional[int]) -> Optional[int]:
+    """Examples cut to fit max_length, or None where the dataset cannot tell
+
+    At the dataset's own max_length this is the count preprocess_and_save
+    recorded from the untruncated lengths (an example can fill max_length
+    exactly without being cut). Below it, stored lengths are exact up to
+    the dataset's length, so longer ones are the ones a rebuild would cut.
+    Above it, the full length of already-cut examples is unknown.
+    """
+    if max_length < dataset_max_length:
+        return int((lengths > max_length).sum())
+    if max_length == dataset_max_length:
+        return recorded
+    return None
+
+
+def length_summary(lengths: np.ndarray, truncated: Optional[int]) -> Dict[str, Any]:
+    if len(lengths) == 0:
+        return {"examples": 0, "tokens": 0}
+    p50, p90, p99 = np.percentile(lengths, [50, 90, 99])
+    return {
+        "examples": int(len(lengths)),
+        "tokens": int(lengths.sum()),
+        "mean": float(lengths.mean()),
+        "min": int(lengths.min()),
+        "p50": float(p50),
+        "p90": float(p90),
+        "p99": float(p99),
+        "max": int(lengths.max()),
+        "truncated": truncated
+    }
+
+
+def length_histogram(lengths: np.ndarray, max_length: int, bins: int = HISTOGRAM_BINS) -> List[Dict[str, int]]:
+    """Counts in equal-width bins up to max_length; the last bin also holds anything longer"""
+    edges = np.linspace(0, max_length, bins + 1).astype(int)
+    counts, _ = np.histogram(np.minimum(lengths, max_length), bins=edges)
+    return [{"from": int(lo), "to": int(hi), "count": int(count)} for lo, hi, count in zip(edges[:-1], edges[1:], counts)]
+
+
+def grouped_summaries(store: TokenStore, lengths: np.ndarray, tag: str, max_length: int, dataset_max_length: int,
+                      recorded: Optional[Dict[str, int]]) -> Dict[str, Dict[str, Any]]:
+    codes, values = store.tag(tag)
+    codes = np.asarray(codes)
+    summaries = {}
+    for code in np.unique(codes):
+        group = lengths[codes == code]
+        truncated = truncated_count(
+            group, max_length, dataset_max_length, None if recorded is None else recorded.get(values[code], 0)
+        )
+        summaries[values[code] or "unknown"] = length_summary(group, truncated)
+    return summaries
+
+
+def padding_estimates(lengths: Sequence[int], batch_size: int, max_length: int) -> Dict[str, Dict[str, Any]]:
+    """Real vs computed tokens per epoch for random, length-bucketed and packed batches"""
+    lengths = [min(length, max_length) for length in lengths]
+    # Packed examples gain an EOS separator
+    packed = [min(length + 1, max_length) for length in lengths]
+    blocks = []
+    for start in range(0, len(packed), PACKING_WINDOW):
+        window = packed[start:start + PACKING_WINDOW]
+        blocks.extend(sum(window[i] for i in block) for block in pack_lengths(window, max_length))
+
+    order = LengthBucketSampler(lengths, batch_size, shuffle=True).order()
+    modes = {
+        "random": (len(lengths), batch_padding(lengths, batch_size, PAD_TO_MULTIPLE_OF)),
+        "bucketed": (len(lengths), batch_padding(lengths, batch_size, PAD_TO_MULTIPLE_OF, order=order)),
+        "packed": (len(blocks), batch_padding(blocks, batch_size, PAD_TO_MULTIPLE_OF))
+    }
+    return {
+        mode: {
+            "batches": -(-count // batch_size),
+            "real_tokens": real,
+            "computed_tokens": computed,
+            "padding_fraction": 1 - real / computed if computed else 0.0
+        }
+        for mode, (count, (real, computed)) in modes.items()
+    }
+
+
+def run_estimates(padding: Dict[str, Dict[str, Any]], gradient_accumulation_steps: int, epochs: int,
+                  tokens_per_second: Optional[float]) -> Dict[str, Dict[str, Any]]:
+    """Optimizer steps and, given a measured computed-tokens/sec figure, wall-clock time per mode"""
+    estimates = {}
+    for mode, stats in padding.items():
+        steps_per_epoch = -(-stats["batches"] // gradient_accumulation_steps)
+        estimate = {
+            "steps_per_epoch": steps_per_epoch,
+            "total_steps": steps_per_epoch * epochs,
+            "computed_tokens": stats["computed_tokens"] * epochs
+        }
+        if tokens_per_second:
+            estimate["hours"] = estimate["computed_tokens"] / tokens_per_second / 3600
+        estimates[mode] = estimate
+    return estimates
+
+
+def profile(dataset_dir: Path, split: str, max_length: Optional[int], batch_size: int,
+            gradient_accumulation_steps: int, epochs: int, tokens_per_second: Optional[float]) -> Dict[str, Any]:
+    with open(dataset_dir / "fingerprint.json", 'r', encoding='utf-8') as f:
+        fingerprint = json.load(f)
+    dataset_max_length = fingerprint['max_length']
+    max_length = max_length or dataset_max_length
+    store = TokenStore(dataset_dir / split)
+    lengths = np.asarray(store.lengths)
+    splits = load_dataset_stats(dataset_dir)
+    # Datasets built before truncation was recorded have no counts
+    recorded = splits.get(split, {})
+
+    padding = padding_estimates(lengths.tolist(), batch_size, max_length)
+    return {
+        "dataset_dir": str(dataset_dir),
+        "split": split,
+        "fingerprint": fingerprint,
+        "splits": splits,
+        "settings": {
+            "max_length": max_length,
+            "batch_size": batch_size,
+            "gradient_accumulation_steps": gradient_accumulation_steps,
+            "epochs": epochs,
+            "tokens_per_second": tokens_per_second
+        },
+        "overall": length_summary(
+            lengths, truncated_count(lengths, max_length, dataset_max_length, recorded.get("truncated"))
+        ),
+        "histogram": length_histogram(lengths, max_length),
+        "by_collection": grouped_summaries(
+            store, lengths, "collection", max_length, dataset_max_length, recorded.get("truncated_by_collection")
+        ),
+        "by_source": grouped_summaries(
+            store, lengths, "source", max_length, dataset_max_length, recorded.get("truncated_by_source")
+        ),
+        "padding": padding,
+        "estimates": run_estimates(padding, gradient_accumulation_steps, epochs, tokens_per_second)
+    }
+
+
+def print_summary_table(title: str, rows: Dict[str, Dict[str, Any]]):
+    print(f"\n{title}")
+    print(f"  {'name':<24} {'examples':>9} {'tokens':>12} {'mean':>7} {'p50':>7} {'p90':>7} {'p99':>7} {'max':>7} {'truncated':>9}")
+    for name, s in sorted(rows.items(), key=lambda item: -item[1]["tokens"]):
+        if not s["examples"]:
+            continue
+        print(f"  {name[:24]:<24} {s['examples']:>9,} {s['tokens']:>12,} {s['mean']:>7.0f} {s['p50']:>7.0f} "
+              f"{s['p90']:>7.0f} {s['p99']:>7.0f} {s['max']:>7} "
+              f"{'n/a' if s['truncated'] is None else format(s['truncated'], ','):>9}")
+
+
+def print_report(report: Dict[str, Any]):
+    settings = report["settings"]
+    print(f"📊 {report['dataset_dir']} ({report['split']} split, tokenizer {report['fingerprint']['tokenizer_name']})")
+    print_summary_table("Token lengths", {"all": report["overall"]})
+    print_summary_table("By collection", report["by_collection"])
+    print_summary_table("By source", report["by_source"])
+
+    print(f"\nLength histogram (max_length {settings['max_length']})")
+    largest = max((b["count"] for b in report["histogram"]), default=0) or 1
+    for b in report["histogram"]:
+        bar = "█" * round(HISTOGRAM_WIDTH * b["count"] / largest)
+        print(f"  {b['from']:>6}-{b['to']:<6} {b['count']:>9,} {bar}")
+
+    print(f"\nPadding per epoch (batch size {settings['batch_size']}, padded to multiples of {PAD_TO_MULTIPLE_OF})")
+    for mode, p in report["padding"].items():
+        print(f"  {mode:<9} {p['batches']:>8,} batches {p['computed_tokens']:>14,} tokens computed "
+              f"{p['padding_fraction']:>7.1%} padding")
+
+    print(f"\nRun estimate ({settings['epochs']} epochs, gradient accumulation {settings['gradient_accumulation_steps']})")
+    for mode, e in report["estimates"].items():
+        line = f"  {mode:<9} {e['steps_per_epoch']:>8,} steps/epoch {e['total_steps']:>9,} steps"
+        if "hours" in e:
+            line += f"  ~{e['hours']:.1f} h" if e["hours"] >= 1 else f"  ~{e['hours'] * 60:.0f} min"
+        print(line)
+    if settings["tokens_per_second"] is None:
+        print("  (pass --tokens-per-second from a benchmark run to estimate wall-clock time)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile a tokenized training dataset before fine-tuning")
+    parser.add_argument("--dataset-dir", default=None,
+                        help="Fingerprinted dataset directory (default: the most recently built one)")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Where preprocess_and_save.py writes datasets")
+    parser.add_argument("--split", choices=["train", "val"], default="train")
+    parser.add_argument("--max-length", type=int, default=None,
+                        help="Length to evaluate truncation and packing at (default: the dataset's own)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--gradient-accumulation-steps", type=int, default=DEFAULT_GRADIENT_ACCUMULATION_STEPS)
+    parser.add_argument("--epochs", type=int, default=DEFAULT_EPOCHS)
+    parser.add_argument("--tokens-per-second", type=float, default=None,
+                        help="Measured computed (padded) tokens/sec, e.g. from a benchmark run")
+    parser.add_argument("--json", default=None, help="Also write the full report to this JSON file")
+    args = parser.parse_args()
+
+    dataset_dir = Path(args.dataset_dir) if args.dataset_dir else latest_dataset_dir(args.output_dir)
+    report = profile(dataset_dir, args.split, args.max_length, args.batch_size,
+                     args.gradient_accumulation_steps, args.epochs, args.tokens_per_second)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
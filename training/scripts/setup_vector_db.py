@@ -2,23 +2,43 @@
 """
 Vector Database Setup for StoryForge Custom Model Training
 Processes structured datasets, creates vector embeddings, and stores them using ChromaDB
+(or, with --backend numpy, in a memory-mapped NumPy index)
 """
 
 import os
 import json
+import atexit
+import copy
 import csv
+import io
+import gzip
+import zipfile
+import hashlib
+import multiprocessing
+import queue
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, TextIO, Tuple, Union
 from datetime import datetime
+import argparse
 
-# External dependencies
+import numpy as np
+
+from chunking import DEFAULT_TOKENIZER, TokenChunker
+from dedup import NearDuplicateIndex
+from embedding_cache import EmbeddingCache
+from numpy_index import NumpyVectorStore
+from training_data import DEFAULT_EXPORT_PATH, export_format
+
+# External dependencies (ChromaDB is only required for the chroma backend)
 try:
     import chromadb
     from chromadb.config import Settings
     from chromadb.errors import NotFoundError
 except ImportError:
-    print("ChromaDB not installed. Install with: pip install chromadb")
-    exit(1)
+    chromadb = None
+    NotFoundError = ValueError
 
 try:
     from sentence_transformers import SentenceTransformer
@@ -27,34 +47,358 @@ except ImportError:
     exit(1)
 
 
+MANIFEST_VERSION = 1
+
+# Query embeddings added to the embedding cache between index writes;
+# the rest are written by close(), which also runs at interpreter exit
+QUERY_CACHE_SAVE_EVERY = 256
+
+COLLECTION_NAMES = {
+    'stories': 'children_stories',
+    'dialogues': 'story_dialogues',
+    'characters': 'character_descriptions',
+    'prompts': 'story_prompts',
+    'metadata': 'training_metadata'
+}
+
+# (collection key, record id, document, metadata)
+Record = Tuple[str, str, str, Dict[str, Any]]
+
+
+def _hash_file(file_path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _hash_record(content: str, metadata: Dict[str, Any]) -> str:
+    payload = json.dumps([content, metadata], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _read_records(file_path: Path, rel_path: str) -> Optional[Iterator[Record]]:
+    # Ids are derived from the full path relative to the datasets root,
+    # extension included, so no two files (foo.csv, foo.json, foo.csv.gz,
+    # or the same stem in another folder) ever share an id
+    name = file_path.name.lower()
+    if name.endswith(".zip"):
+        return _process_zip_file(file_path, rel_path)
+
+    compressed = name.endswith(".gz")
+    inner_path = rel_path[:-len(".gz")] if compressed else rel_path
+    parser = _PARSERS.get(Path(inner_path).suffix.lower())
+    if parser is None:
+        return None
+    if compressed:
+        return _read_stream(lambda: gzip.open(file_path, 'rt', encoding='utf-8', newline=''), parser, rel_path)
+    return _read_stream(lambda: open(file_path, 'r', encoding='utf-8', newline=''), parser, rel_path)
+
+
+def _read_stream(opener, parser, id_prefix: str) -> Iterator[Record]:
+    with opener() as f:
+        yield from parser(f, id_prefix)
+
+
+def _process_zip_file(file_path: Path, id_prefix: str) -> Iterator[Record]:
+    """Stream supported members straight out of a zip archive without extracting it"""
+    with zipfile.ZipFile(file_path) as archive:
+        for member in archive.infolist():
+            member_name = member.filename
+            if member.is_dir() or member_name.startswith('__MACOSX/') or Path(member_name).name.startswith('.'):
+                continue
+            parser = _PARSERS.get(Path(member_name).suffix.lower())
+            if parser is None:
+                print(f"⚠️ Skipping unsupported archive member: {file_path}:{member_name}")
+                continue
+            member_prefix = f"{id_prefix}/{member_name}"
+            with archive.open(member) as raw:
+                yield from parser(io.TextIOWrapper(raw, encoding='utf-8', newline=''), member_prefix)
+
+
+def _process_json_file(f: TextIO, id_prefix: str) -> Iterator[Record]:
+    # JSON documents are parsed whole; CSV and text are read incrementally
+    data = json.load(f)
+
+    if isinstance(data, list):
+        items = ((item, f"{id_prefix}_{i}") for i, item in enumerate(data))
+    elif isinstance(data, dict):
+        items = [(data, id_prefix)]
+    else:
+        items = []
+    for item, item_id in items:
+        record = _add_to_collection(item, item_id)
+        if record:
+            yield record
+
+
+def _process_csv_file(f: TextIO, id_prefix: str) -> Iterator[Record]:
+    reader = csv.DictReader(f)
+    if [name.strip().lower() for name in reader.fieldnames or []] == ['section', 'text']:
+        yield from _process_section_story(reader, id_prefix)
+        return
+    for i, row in enumerate(reader):
+        record = _add_to_collection(row, f"{id_prefix}_{i}")
+        if record:
+            yield record
+
+
+def _process_section_story(rows: Iterable[Dict[str, str]], id_prefix: str) -> Iterator[Record]:
+    """Reassemble a section,text CSV into one story and re-split it into token-sized chunks"""
+    sections = []
+    for i, row in enumerate(rows):
+        text = (row.get('text') or '').strip()
+        if text:
+            section = (row.get('section') or '').strip()
+            sections.append((int(section) if section.isdigit() else i, i, text))
+    story = '\n\n'.join(text for _, _, text in sorted(sections))
+
+    chunks = _chunker.chunk(story)
+    for i, (chunk, token_count) in enumerate(chunks):
+        collection_key, chunk_id, content, metadata = _add_to_collection({'text': chunk}, f"{id_prefix}_chunk_{i}")
+        metadata.update({
+            'story_id': id_prefix,
+            'chunk_index': i,
+            'chunk_count': len(chunks),
+            'token_count': token_count
+        })
+        yield collection_key, chunk_id, content, metadata
+
+
+def _process_text_file(f: TextIO, id_prefix: str) -> Iterator[Record]:
+    for i, (chunk, token_count) in enumerate(_chunker.chunk_stream(f)):
+        record = _add_text_chunk(chunk, f"{id_prefix}_chunk_{i}")
+        record[3].update({'story_id': id_prefix, 'chunk_index': i, 'token_count': token_count})
+        yield record
+
+
+# Shared by the parse functions; set per process by _configure_chunker
+_chunker: Optional[TokenChunker] = None
+
+
+def _configure_chunker(config: Tuple[str, int, int]):
+    global _chunker
+    if _chunker is None or (_chunker.tokenizer_name, _chunker.chunk_tokens, _chunker.overlap_tokens) != config:
+        _chunker = TokenChunker(*config)
+
+
+_PARSERS = {
+    ".json": _process_json_file,
+    ".csv": _process_csv_file,
+    ".txt": _process_text_file
+}
+
+
+def _add_to_collection(item: Dict[str, Any], item_id: str) -> Optional[Record]:
+    content = item.get('story') or item.get('text') or item.get('content') or str(item)
+    content = content.strip()
+    if not content:
+        return None
+
+    if 'story' in item or 'text' in item:
+        collection_key = 'stories'
+        metadata = {
+            'type': 'story',
+            'length': len(content),
+            'genre': item.get('genre', 'unknown'),
+            'age_group': item.get('age_group', 'unknown'),
+            'source_id': item_id
+        }
+    elif 'character' in item or 'name' in item:
+        collection_key = 'characters'
+        metadata = {'type': 'character', 'source_id': item_id}
+    elif 'prompt' in item:
+        collection_key = 'prompts'
+        metadata = {'type': 'prompt', 'source_id': item_id}
+    else:
+        collection_key = 'stories'
+        metadata = {'type': 'general', 'source_id': item_id}
+
+    return collection_key, item_id, content, metadata
+
+
+def _add_text_chunk(chunk: str, chunk_id: str) -> Record:
+    metadata = {'type': 'text_chunk', 'length': len(chunk), 'source_id': chunk_id}
+    return 'stories', chunk_id, chunk, metadata
+
+
+def _parse_file(file_path: str, rel_path: str, known_hash: Optional[str], chunk_size: int) -> Iterator[tuple]:
+    """Hash, read and normalize one file, yielding ingest messages
+
+    Messages are ('records', rel_path, [Record, ...]) chunks followed by a
+    final ('done', rel_path, sha256), or a single 'unchanged', 'unsupported'
+    or 'error' message.
+    """
+    try:
+        file_hash = _hash_file(Path(file_path))
+        if file_hash == known_hash:
+            yield ('unchanged', rel_path, file_hash)
+            return
+
+        records = _read_records(Path(file_path), rel_path)
+        if records is None:
+            yield ('unsupported', rel_path, None)
+            return
+
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                yield ('records', rel_path, chunk)
+                chunk = []
+        if chunk:
+            yield ('records', rel_path, chunk)
+        yield ('done', rel_path, file_hash)
+    except Exception as e:
+        yield ('error', rel_path, str(e))
+
+
+def _parse_worker(task_queue, result_queue, chunk_size: int, chunk_config: Tuple[str, int, int]):
+    """Process-pool worker: parse files from task_queue into the bounded result_queue"""
+    _configure_chunker(chunk_config)
+    for task in iter(task_queue.get, None):
+        for message in _parse_file(*task, chunk_size):
+            result_queue.put(message)
+    result_queue.put(('exit', None, None))
+
+
+class LRUCache:
+    """Thread-safe bounded mapping that drops the least recently used entry"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
 class StoryForgeVectorDB:
-    def __init__(self, db_path: str = "training/vector-db"):
+    def __init__(self, db_path: str = "training/vector-db", batch_size: int = 64, rebuild: bool = False,
+                 workers: int = 0, encoder_name: str = 'all-MiniLM-L6-v2', encoder_revision: Optional[str] = None,
+                 cache_dir: Optional[str] = "training/embedding-cache", cache_size: int = 200_000,
+                 query_cache_size: int = 1024, backend: str = "chroma", read_only: bool = False,
+                 dedup_threshold: Optional[float] = 0.8, tokenizer_name: str = DEFAULT_TOKENIZER,
+                 chunk_tokens: int = 1024, chunk_overlap: int = 128):
+        if backend not in ("chroma", "numpy"):
+            raise ValueError(f"Unknown vector store backend: {backend}")
+        self.backend = backend
         self.db_path = Path(db_path)
+        self.batch_size = max(1, batch_size)
+        self.workers = workers
+        # Stories are chunked in target-model tokens so chunks fit the fine-tuning max_length
+        self.chunk_config = (tokenizer_name, chunk_tokens, chunk_overlap)
+        # Parsed chunks (of batch_size records) allowed in flight between parse workers and the writer
+        self.queue_size = max(2, 4 * workers)
         self.db_path.mkdir(parents=True, exist_ok=True)
 
-        self.client = chromadb.PersistentClient(
-            path=str(self.db_path),
-            settings=Settings(anonymized_telemetry=False)
-        )
-
-        self.encoder = SentenceTransformer('all-MiniLM-L6-v2')
-
-        self.collections = {
-            'stories': self._get_or_create_collection('children_stories'),
-            'dialogues': self._get_or_create_collection('story_dialogues'),
-            'characters': self._get_or_create_collection('character_descriptions'),
-            'prompts': self._get_or_create_collection('story_prompts'),
-            'metadata': self._get_or_create_collection('training_metadata')
-        }
+        if backend == "numpy":
+            # Kept in its own folder, with its own manifest, so both backends can coexist
+            store_path = self.db_path / "numpy-index"
+            self.client = NumpyVectorStore(str(store_path), read_only=read_only)
+        else:
+            if chromadb is None:
+                print("ChromaDB not installed. Install with: pip install chromadb (or use --backend numpy)")
+                exit(1)
+            store_path = self.db_path
+            self.client = chromadb.PersistentClient(
+                path=str(self.db_path),
+                settings=Settings(anonymized_telemetry=False)
+            )
+        self.manifest_path = store_path / "ingest_manifest.json"
+        self.dedup_path = store_path / "minhash_index.npz"
+
+        if rebuild:
+            self._drop_collections()
+
+        # Near-duplicates of already stored documents are dropped before embedding
+        self.dedup = None
+        if dedup_threshold:
+            self.dedup = NearDuplicateIndex(threshold=dedup_threshold)
+            self.dedup.load(self.dedup_path)
+
+        self.encoder = SentenceTransformer(encoder_name, revision=encoder_revision)
+
+        # Embeddings survive vector store rebuilds; None disables the cache
+        self.embedding_cache = None
+        if cache_dir:
+            self.embedding_cache = EmbeddingCache(
+                cache_dir, encoder_name, encoder_revision,
+                self.encoder.get_sentence_embedding_dimension(), max_entries=cache_size
+            )
+            atexit.register(self.close)
+
+        self.collections = {key: self._get_or_create_collection(name) for key, name in COLLECTION_NAMES.items()}
+
+        # Records waiting to be embedded, buffered per target collection so
+        # each flush is one encoder forward pass and one bulk write
+        self._pending = {name: {'ids': [], 'documents': [], 'metadatas': []} for name in self.collections}
+        # Ids to delete, kept in order; queueing the id again cancels its delete
+        self._pending_deletes = {name: {} for name in self.collections}
+
+        # Memoized query embeddings and search results; results are dropped on every write
+        self._query_embeddings = LRUCache(query_cache_size)
+        self._query_results = LRUCache(query_cache_size)
 
         print(f"✅ Vector DB initialized at {self.db_path}")
 
     def _get_or_create_collection(self, name: str):
+        if self.backend == "numpy":
+            return self.client.get_or_create_collection(name)
         try:
             return self.client.get_collection(name)
         except NotFoundError:
             return self.client.create_collection(name)
 
+    def _drop_collections(self):
+        for name in COLLECTION_NAMES.values():
+            try:
+                self.client.delete_collection(name)
+            except (NotFoundError, ValueError):
+                pass
+        for path in (self.manifest_path, self.dedup_path):
+            if path.exists():
+                path.unlink()
+        print("🗑️ Dropped existing collections and ingest manifest")
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        if self.manifest_path.exists():
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest
+            print(f"⚠️ Ignoring ingest manifest with unknown version: {self.manifest_path}")
+        elif any(col.count() for col in self.collections.values()):
+            print("⚠️ No ingest manifest found for a non-empty vector DB; records from earlier runs "
+                  "will not be tracked. Run with --rebuild to start clean.")
+        return {'version': MANIFEST_VERSION, 'files': {}}
+
+    def _save_manifest(self, manifest: Dict[str, Any]):
+        manifest['updated_at'] = datetime.now().isoformat()
+        tmp_path = self.manifest_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
     def process_training_datasets(self, datasets_path: str = "../../training-datasets"):
         datasets_path = Path(datasets_path)
 
@@ -64,96 +408,364 @@ class StoryForgeVectorDB:
 
         print(f"Processing files in {datasets_path}")
 
-        for file_path in datasets_path.rglob("*"):
+        manifest = self._load_manifest()
+        files = manifest['files']
+        _configure_chunker(self.chunk_config)
+        # A different chunking changes every chunked record, so nothing counts as unchanged
+        rechunk = manifest.get('chunking') != list(self.chunk_config)
+        if rechunk and files:
+            print("Chunking settings changed; re-reading every file")
+        manifest['chunking'] = list(self.chunk_config)
+        # 'changed' collects ids of kept records deleted or re-embedded with new content
+        stats = {'unchanged': 0, 'updated': set(), 'removed': 0, 'upserted': 0, 'deleted': 0,
+                 'duplicates': {}, 'clusters': set(), 'changed': set()}
+        seen = set()
+        tasks = []
+        file_stats = {}
+
+        # Size and mtime are checked up front; only candidates reach the parse workers
+        for file_path in sorted(datasets_path.rglob("*")):
             if file_path.is_file() and not file_path.name.startswith("."):
-                self._process_file(file_path)
+                rel_path = file_path.relative_to(datasets_path).as_posix()
+                seen.add(rel_path)
+                entry = files.get(rel_path)
+                stat = file_path.stat()
+                if rechunk:
+                    entry = None
+                elif entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                    stats['unchanged'] += 1
+                    continue
+                file_stats[rel_path] = stat
+                tasks.append((str(file_path), rel_path, entry['sha256'] if entry else None))
+
+        # Sources that disappeared take their records with them
+        for rel_path in sorted(set(files) - seen):
+            for record_id, (collection_key, _) in files.pop(rel_path)['records'].items():
+                self._delete_record(collection_key, record_id)
+                stats['changed'].add(record_id)
+                stats['deleted'] += 1
+            stats['removed'] += 1
+            print(f"🗑️ Removed records of deleted file: {rel_path}")
+
+        # Files are parsed in rounds: a round that deletes or rewrites a kept
+        # record re-reads the files holding its dropped near-duplicates
+        tasks += self._requeue_duplicates(files, datasets_path, {task[1] for task in tasks}, file_stats, stats)
+        while tasks:
+            self._ingest_files(tasks, files, datasets_path, file_stats, stats)
+            tasks = self._requeue_duplicates(files, datasets_path, set(), file_stats, stats)
+
+        self.flush()
+        self._save_manifest(manifest)
+        if self.dedup:
+            self.dedup.save(self.dedup_path)
+            dropped = stats['duplicates']
+            if dropped:
+                per_source = ', '.join(f"{source}: {count}" for source, count in sorted(dropped.items()))
+                print(f"🧹 Dropped {sum(dropped.values())} near-duplicates of {len(stats['clusters'])} "
+                      f"kept documents ({per_source})")
+        if self.embedding_cache:
+            self.embedding_cache.save()
+            print(f"Embedding cache: {self.embedding_cache.hits} hits, {self.embedding_cache.misses} misses")
+        print(f"All datasets processed: {len(stats['updated'])} files updated, {stats['unchanged']} unchanged, "
+              f"{stats['removed']} removed; {stats['upserted']} records upserted, {stats['deleted']} deleted.")
+
+    def _requeue_duplicates(self, files: Dict[str, Any], datasets_path: Path, queued: set,
+                            file_stats: Dict[str, os.stat_result], stats: Dict[str, Any]) -> List[tuple]:
+        """Tasks re-reading files whose dropped near-duplicates point at a changed kept record"""
+        changed, stats['changed'] = stats['changed'], set()
+        tasks = []
+        for rel_path, entry in files.items():
+            if rel_path in queued or not changed.intersection(entry.get('duplicates', {}).values()):
+                continue
+            if rel_path not in file_stats:
+                # Counted as unchanged by the size/mtime check
+                file_stats[rel_path] = (datasets_path / rel_path).stat()
+                stats['unchanged'] -= 1
+            tasks.append((str(datasets_path / rel_path), rel_path, None))
+        return tasks
+
+    def _ingest_files(self, tasks: List[tuple], files: Dict[str, Any], datasets_path: Path,
+                      file_stats: Dict[str, os.stat_result], stats: Dict[str, Any]):
+        in_progress = {}
+        for kind, rel_path, payload in self._parse_files(tasks):
+            entry = files.get(rel_path)
+            if kind == 'records':
+                progress = in_progress.setdefault(rel_path, {'records': {}, 'duplicates': {}})
+                self._ingest_records(rel_path, payload, entry, progress, stats)
+            elif kind == 'done':
+                stat = file_stats[rel_path]
+                progress = in_progress.pop(rel_path, {'records': {}, 'duplicates': {}})
+                new_records = progress['records']
+                old_records = entry['records'] if entry else {}
+                for record_id in set(old_records) - set(new_records):
+                    if record_id not in progress['duplicates']:
+                        self._delete_record(old_records[record_id][0], record_id)
+                        stats['changed'].add(record_id)
+                        stats['deleted'] += 1
+                files[rel_path] = {
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                    'sha256': payload,
+                    'records': new_records,
+                    'duplicates': progress['duplicates']
+                }
+                stats['updated'].add(rel_path)
+            elif kind == 'unchanged':
+                # Touched but not modified
+                entry['mtime_ns'] = file_stats[rel_path].st_mtime_ns
+                stats['unchanged'] += 1
+            elif kind == 'unsupported':
+                print(f"⚠️ Skipping unsupported file: {datasets_path / rel_path}")
+            elif kind == 'error':
+                in_progress.pop(rel_path, None)
+                print(f"❌ Error processing {datasets_path / rel_path}: {payload}")
+
+    def _parse_files(self, tasks: List[tuple]) -> Iterator[tuple]:
+        """Yield parse messages for tasks, using a worker pool when workers > 0
+
+        Workers feed the single embedding/writer stage in this process
+        through a bounded queue, so parsing overlaps with encoding while the
+        number of parsed-but-unwritten records stays capped.
+        """
+        if self.workers <= 0 or len(tasks) <= 1:
+            for task in tasks:
+                yield from _parse_file(*task, self.batch_size)
+            return
 
-        print("All datasets processed.")
+        ctx = multiprocessing.get_context()
+        task_queue = ctx.Queue()
+        result_queue = ctx.Queue(maxsize=self.queue_size)
+        num_workers = min(self.workers, len(tasks))
+        for task in tasks:
+            task_queue.put(task)
+        for _ in range(num_workers):
+            task_queue.put(None)
+
+        workers = [
+            ctx.Process(
+                target=_parse_worker,
+                args=(task_queue, result_queue, self.batch_size, self.chunk_config),
+                daemon=True
+            )
+            for _ in range(num_workers)
+        ]
+        for worker in workers:
+            worker.start()
 
-    def _process_file(self, file_path: Path):
-        ext = file_path.suffix.lower()
         try:
-            if ext == ".json":
-                self._process_json_file(file_path)
-            elif ext == ".csv":
-                self._process_csv_file(file_path)
-            elif ext == ".txt":
-                self._process_text_file(file_path)
-            else:
-                print(f"⚠️ Skipping unsupported file: {file_path}")
-        except Exception as e:
-            print(f"❌ Error processing {file_path}: {e}")
-
-    def _process_json_file(self, file_path: Path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        if isinstance(data, list):
-            for i, item in enumerate(data):
-                self._add_to_collection(item, f"{file_path.stem}_{i}")
-        elif isinstance(data, dict):
-            self._add_to_collection(data, file_path.stem)
-
-    def _process_csv_file(self, file_path: Path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for i, row in enumerate(reader):
-                self._add_to_collection(row, f"{file_path.stem}_{i}")
-
-    def _process_text_file(self, file_path: Path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        chunks = self._split_text(content)
-        for i, chunk in enumerate(chunks):
-            self._add_text_chunk(chunk, f"{file_path.stem}_chunk_{i}")
-
-    def _split_text(self, text: str, chunk_size: int = 1000) -> List[str]:
-        words = text.split()
-        return [' '.join(words[i:i+chunk_size]) for i in range(0, len(words), chunk_size)]
-
-    def _add_to_collection(self, item: Dict[str, Any], item_id: str):
-        content = item.get('story') or item.get('text') or item.get('content') or str(item)
-        content = content.strip()
-        if not content:
+            running = num_workers
+            while running:
+                try:
+                    message = result_queue.get(timeout=1.0)
+                except queue.Empty:
+                    if not any(worker.is_alive() for worker in workers):
+                        raise RuntimeError("Parse workers exited unexpectedly")
+                    continue
+                if message[0] == 'exit':
+                    running -= 1
+                else:
+                    yield message
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+
+    def _ingest_records(self, rel_path: str, records: List[Record], entry: Optional[Dict[str, Any]],
+                        progress: Dict[str, dict], stats: Dict[str, Any]):
+        old_records = entry['records'] if entry else {}
+        new_records = progress['records']
+        for collection_key, record_id, content, metadata in records:
+            record_hash = _hash_record(content, metadata)
+            previous = old_records.get(record_id)
+            if previous == [collection_key, record_hash]:
+                new_records[record_id] = previous
+                continue
+            if previous:
+                # Its dropped near-duplicates must be checked against the new content
+                stats['changed'].add(record_id)
+
+            if self.dedup:
+                self.dedup.remove(record_id)
+                signature = self.dedup.signature(content)
+                representative = self.dedup.find_duplicate(signature)
+                if representative:
+                    if previous:
+                        self._delete_record(previous[0], record_id)
+                    # Counted per top-level dataset folder
+                    source = rel_path.split('/', 1)[0]
+                    stats['duplicates'][source] = stats['duplicates'].get(source, 0) + 1
+                    stats['clusters'].add(representative)
+                    progress['duplicates'][record_id] = representative
+                    continue
+
+            new_records[record_id] = [collection_key, record_hash]
+            if previous and previous[0] != collection_key:
+                self._delete_record(previous[0], record_id)
+            if self.dedup:
+                self.dedup.add(record_id, signature)
+            self._queue_record(collection_key, record_id, content, metadata)
+            stats['upserted'] += 1
+
+    def _queue_record(self, collection_key: str, record_id: str, content: str, metadata: Dict[str, Any]):
+        self._pending_deletes[collection_key].pop(record_id, None)
+        pending = self._pending[collection_key]
+        pending['ids'].append(record_id)
+        pending['documents'].append(content)
+        pending['metadatas'].append(metadata)
+        if len(pending['ids']) >= self.batch_size:
+            self._flush_collection(collection_key)
+
+    def _flush_collection(self, collection_key: str):
+        pending = self._pending[collection_key]
+        if not pending['ids']:
             return
-
-        if 'story' in item or 'text' in item:
-            collection = self.collections['stories']
-            metadata = {
-                'type': 'story',
-                'length': len(content),
-                'genre': item.get('genre', 'unknown'),
-                'age_group': item.get('age_group', 'unknown'),
-                'source_id': item_id
-            }
-        elif 'character' in item or 'name' in item:
-            collection = self.collections['characters']
-            metadata = {'type': 'character', 'source_id': item_id}
-        elif 'prompt' in item:
-            collection = self.collections['prompts']
-            metadata = {'type': 'prompt', 'source_id': item_id}
-        else:
-            collection = self.collections['stories']
-            metadata = {'type': 'general', 'source_id': item_id}
-
-        embedding = self.encoder.encode([content])[0].tolist()
-        collection.add(
-            embeddings=[embedding],
-            documents=[content],
-            metadatas=[metadata],
-            ids=[item_id]
-        )
-        print(f"Added {item_id} to {collection.name}")
-
-    def _add_text_chunk(self, chunk: str, chunk_id: str):
-        embedding = self.encoder.encode([chunk])[0].tolist()
-        metadata = {'type': 'text_chunk', 'length': len(chunk), 'source_id': chunk_id}
-        self.collections['stories'].add(
-            embeddings=[embedding],
-            documents=[chunk],
-            metadatas=[metadata],
-            ids=[chunk_id]
+        self._pending[collection_key] = {'ids': [], 'documents': [], 'metadatas': []}
+
+        embeddings = self._encode(pending['documents'])
+        self._query_results.clear()
+        collection = self.collections[collection_key]
+        collection.upsert(
+            embeddings=embeddings.tolist(),
+            documents=pending['documents'],
+            metadatas=pending['metadatas'],
+            ids=pending['ids']
         )
+        print(f"Upserted {len(pending['ids'])} records into {collection.name}")
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Embed texts as unit vectors, encoding only those missing from the embedding cache
+
+        Search scores assume unit vectors on both sides, whatever the encoder.
+        """
+        if not self.embedding_cache:
+            return self.encoder.encode(
+                texts,
+                batch_size=self.batch_size,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+
+        cached = self.embedding_cache.get_many(texts)
+        missing = [i for i, embedding in enumerate(cached) if embedding is None]
+        if missing:
+            computed = self.encoder.encode(
+                [texts[i] for i in missing],
+                batch_size=self.batch_size,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+            self.embedding_cache.put_many([texts[i] for i in missing], computed)
+            for i, embedding in zip(missing, computed):
+                cached[i] = embedding
+        return np.stack(cached).astype(np.float32)
+
+    def _delete_record(self, collection_key: str, record_id: str):
+        self._pending_deletes[collection_key][record_id] = None
+        if self.dedup:
+            self.dedup.remove(record_id)
+
+    def flush(self):
+        """Embed and write every buffered record and apply buffered deletes"""
+        for collection_key in self._pending:
+            self._flush_collection(collection_key)
+        for collection_key, record_ids in self._pending_deletes.items():
+            if record_ids:
+                self.collections[collection_key].delete(ids=list(record_ids))
+                self._pending_deletes[collection_key] = {}
+                self._query_results.clear()
+        if self.backend == "numpy":
+            self.client.persist()
+
+    def search(self, query: str, k: int = 5, age_group: Optional[str] = None, genre: Optional[str] = None,
+               collection: Optional[Union[str, List[str]]] = None) -> List[Dict[str, Any]]:
+        """Return the top-k records for one query; see search_many"""
+        return self.search_many([query], k=k, age_group=age_group, genre=genre, collection=collection)[0]
+
+    def search_many(self, queries: List[str], k: int = 5, age_group: Optional[str] = None,
+                    genre: Optional[str] = None,
+                    collection: Optional[Union[str, List[str]]] = None) -> List[List[Dict[str, Any]]]:
+        """Search a batch of queries, optionally filtered by metadata
+
+        Uncached queries are embedded in a single encoder pass and sent to
+        each target collection in one query call. Each result is a dict with
+        id, collection, document, metadata and score (cosine similarity),
+        best first. Safe to call from several threads while nothing is
+        being ingested.
+        """
+        if isinstance(collection, str):
+            collection = [collection]
+        collection_keys = tuple(collection or self.collections)
+        unknown = [key for key in collection_keys if key not in self.collections]
+        if unknown:
+            raise ValueError(f"Unknown collection(s): {unknown}")
+
+        filters = [{'age_group': age_group}] if age_group else []
+        if genre:
+            filters.append({'genre': genre})
+        where = filters[0] if len(filters) == 1 else {'$and': filters} if filters else None
+
+        results = [None] * len(queries)
+        pending = []
+        for i, query in enumerate(queries):
+            cached = self._query_results.get((query, k, age_group, genre, collection_keys))
+            if cached is not None:
+                # Callers own their results; the cached copy is never handed out
+                results[i] = copy.deepcopy(cached)
+            else:
+                pending.append(i)
+        if not pending:
+            return results
+
+        pending_queries = [queries[i] for i in pending]
+        embeddings = self._embed_queries(pending_queries)
+        hits = [[] for _ in pending]
+        for key in collection_keys:
+            col = self.collections[key]
+            size = col.count()
+            if not size:
+                continue
+            response = col.query(
+                query_embeddings=embeddings.tolist(),
+                n_results=min(k, size),
+                where=where,
+                include=['documents', 'metadatas', 'distances']
+            )
+            for j in range(len(pending)):
+                for record_id, document, metadata, distance in zip(
+                    response['ids'][j], response['documents'][j], response['metadatas'][j], response['distances'][j]
+                ):
+                    # Chroma's default space is squared L2, which is 2 - 2*cos for unit vectors
+                    hits[j].append({
+                        'id': record_id,
+                        'collection': key,
+                        'document': document,
+                        'metadata': metadata,
+                        'score': 1.0 - distance / 2.0
+                    })
+
+        for j, i in enumerate(pending):
+            results[i] = sorted(hits[j], key=lambda hit: hit['score'], reverse=True)[:k]
+            self._query_results.put((queries[i], k, age_group, genre, collection_keys), copy.deepcopy(results[i]))
+        return results
+
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        # Recent queries are memoized in memory; the rest go through the persistent embedding cache
+        embeddings = [self._query_embeddings.get(query) for query in queries]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            computed = self._encode([queries[i] for i in missing])
+            for i, embedding in zip(missing, computed):
+                embeddings[i] = embedding
+                self._query_embeddings.put(queries[i], embedding)
+            if self.embedding_cache:
+                self.embedding_cache.save(min_unsaved=QUERY_CACHE_SAVE_EVERY)
+        return np.stack(embeddings).astype(np.float32)
+
+    def close(self):
+        """Write query embeddings still missing from the embedding cache index"""
+        if self.embedding_cache:
+            self.embedding_cache.save(min_unsaved=1)
 
     def get_collection_stats(self):
         stats = {}
@@ -164,39 +776,120 @@ class StoryForgeVectorDB:
                 stats[name] = f"Error: {e}"
         return stats
 
-    def export_training_data(self, output_path: str = "training/processed_data.json"):
-        output = {
-            'metadata': {
-                'created_at': datetime.now().isoformat(),
-                'collections': self.get_collection_stats()
-            },
-            'data': {}
-        }
-        for name, col in self.collections.items():
+    def _iter_collection_pages(self, col, page_size: int) -> Iterator[Dict[str, Any]]:
+        offset = 0
+        while True:
+            page = col.get(limit=page_size, offset=offset, include=['documents', 'metadatas'])
+            if not page['ids']:
+                return
+            yield page
+            offset += len(page['ids'])
+
+    def export_training_data(self, output_path: str = DEFAULT_EXPORT_PATH, page_size: int = 1000):
+        """Stream every collection to newline-delimited JSON or an Arrow IPC stream
+
+        Collections are paged with limit/offset and each page is written as
+        soon as it is read, so memory stays flat regardless of corpus size.
+        The format follows the file suffix (.jsonl or .arrow); export details
+        go to a <output>.meta.json sidecar.
+        """
+        fmt = export_format(output_path)
+        if fmt == "json":
+            raise ValueError("The single-document JSON export is no longer written; use a .jsonl or .arrow path")
+        if fmt == "arrow":
             try:
-                col_data = col.get()
-                output['data'][name] = {
-                    'documents': col_data['documents'],
-                    'metadatas': col_data['metadatas'],
-                    'ids': col_data['ids']
-                }
-            except Exception as e:
-                print(f"Could not export {name}: {e}")
-
-        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(output, f, indent=2, ensure_ascii=False)
-        print(f"Exported training data to {output_path}")
+                import pyarrow as pa
+            except ImportError:
+                print("pyarrow not installed. Install with: pip install pyarrow")
+                raise
+            schema = pa.schema([
+                ('collection', pa.string()),
+                ('id', pa.string()),
+                ('document', pa.string()),
+                ('metadata', pa.string())
+            ])
+
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        # Written under a temporary name so readers never see a partial export
+        tmp_path = output_path.with_name(output_path.name + '.tmp')
+        counts = {}
+
+        with open(tmp_path, 'wb') as f:
+            writer = pa.ipc.new_stream(f, schema) if fmt == "arrow" else None
+            for name, col in self.collections.items():
+                counts[name] = 0
+                try:
+                    for page in self._iter_collection_pages(col, page_size):
+                        metadatas = [metadata or {} for metadata in page['metadatas']]
+                        if writer:
+                            writer.write_batch(pa.record_batch([
+                                [name] * len(page['ids']),
+                                page['ids'],
+                                page['documents'],
+                                [json.dumps(metadata, ensure_ascii=False) for metadata in metadatas]
+                            ], schema=schema))
+                        else:
+                            lines = [
+                                json.dumps({'collection': name, 'id': record_id, 'document': document,
+                                            'metadata': metadata}, ensure_ascii=False) + '\n'
+                                for record_id, document, metadata in zip(page['ids'], page['documents'], metadatas)
+                            ]
+                            f.write(''.join(lines).encode('utf-8'))
+                        counts[name] += len(page['ids'])
+                except Exception as e:
+                    print(f"Could not export {name}: {e}")
+            if writer:
+                writer.close()
+
+        os.replace(tmp_path, output_path)
+        with open(output_path.with_name(output_path.name + '.meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'created_at': datetime.now().isoformat(),
+                'format': fmt,
+                'collections': counts
+            }, f, indent=2)
+        print(f"Exported {sum(counts.values())} records to {output_path}")
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=64, help="Records embedded and written per bulk flush")
+    parser.add_argument("--rebuild", action="store_true", help="Drop all collections and the ingest manifest before processing")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Parse worker processes (0 parses serially in the main process)")
+    parser.add_argument("--export-path", default=DEFAULT_EXPORT_PATH,
+                        help="Export destination; the suffix selects the format (.jsonl or .arrow)")
+    parser.add_argument("--embedding-cache", default="training/embedding-cache",
+                        help="Embedding cache directory (pass an empty string to disable)")
+    parser.add_argument("--cache-size", type=int, default=200_000, help="Maximum embeddings kept in the cache")
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default="chroma",
+                        help="Vector storage: ChromaDB or a memory-mapped NumPy index with exact search")
+    parser.add_argument("--tokenizer", default=DEFAULT_TOKENIZER, help="Target model tokenizer used to size chunks")
+    parser.add_argument("--chunk-tokens", type=int, default=1024, help="Maximum tokens per story chunk")
+    parser.add_argument("--chunk-overlap", type=int, default=128, help="Tokens shared by consecutive chunks")
+    parser.add_argument("--dedup-threshold", type=float, default=0.8,
+                        help="Estimated Jaccard similarity at which a document counts as a near-duplicate (0 disables)")
+    args = parser.parse_args()
+
     print("Setting up StoryForge Vector Database...")
-    db = StoryForgeVectorDB()
+    db = StoryForgeVectorDB(
+        batch_size=args.batch_size,
+        rebuild=args.rebuild,
+        workers=args.workers,
+        cache_dir=args.embedding_cache or None,
+        cache_size=args.cache_size,
+        backend=args.backend,
+        dedup_threshold=args.dedup_threshold,
+        tokenizer_name=args.tokenizer,
+        chunk_tokens=args.chunk_tokens,
+        chunk_overlap=args.chunk_overlap
+    )
     db.process_training_datasets()
     print("\nCollection Stats:")
     for name, count in db.get_collection_stats().items():
         print(f"  - {name}: {count} items")
-    db.export_training_data()
+    db.export_training_data(args.export_path)
     print("\nVector database setup complete.")
 
 
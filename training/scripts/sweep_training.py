@@ -0,0 +1,563 @@
+#!/usr/bin/env python3
+"""
+Hyperparameter Sweep for StoryForge Fine-Tuning
+Runs grid or random search trials over ModelConfig fields as concurrent pinned processes within a
+core and memory budget, stops losing trials early, and reports the Pareto front of eval loss,
+training throughput and inference latency
+"""
+
+import argparse
+import dataclasses
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import typing
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+import yaml
+from transformers import TrainerCallback
+
+from batch_size_finder import memory_limit_gb
+from cpu_performance import physical_core_groups
+from fine_tune_model import ModelConfig, StoryForgeTrainer
+from launch_training import format_cpus
+
+SWEEP_DIR = "training/logs/sweeps"
+POLL_INTERVAL = 2.0
+
+# Set by the sweep for every trial; sweeping them would break the scheduling or the comparison
+RESERVED_FIELDS = {"output_dir", "resume", "num_threads", "memory_limit_gb", "memory_check", "rebuild_datasets",
+                   "profile_steps", "profile_trace", "auto_batch_size"}
+
+DEFAULT_TRIAL = {
+    "max_steps": 60,
+    "eval_steps": 20,
+    "logging_steps": 10,
+    "memory_check": "abort",
+    "latency_prompt_tokens": 64,
+    "latency_new_tokens": 32,
+    "seed": 42
+}
+DEFAULT_EARLY_TERMINATION = {
+    "min_trials": 3,  # Reports needed at an evaluation step before any trial is stopped there
+    "keep_fraction": 0.5  # Trials whose eval loss ranks outside this best fraction are stopped
+}
+DEFAULT_BUDGET = {
+    "cores_per_trial": 2,
+    "memory_gb_per_trial": 4.0
+}
+# Synthetic trials (offline, tiny model) draw this many training examples
+SYNTHETIC_EXAMPLES = 256
+
+
+@dataclass
+class Trial:
+    """One configuration of the sweep and what became of it"""
+    trial_id: int
+    overrides: Dict[str, Any]
+    directory: Path
+    status: str = "pending"  # pending, running, stopped, failed or done
+    cores: List[List[int]] = field(default_factory=list)  # Physical cores (logical CPUs each) while running
+    evals: Dict[int, float] = field(default_factory=dict)  # Step -> eval loss
+    result: Optional[Dict[str, Any]] = None
+    stopped_at: Optional[int] = None  # Evaluation step at which early termination stopped the trial
+    process: Optional[subprocess.Popen] = None
+    _progress_offset: int = 0
+
+    @property
+    def name(self) -> str:
+        return f"trial-{self.trial_id:03d}"
+
+    @property
+    def cpus(self) -> List[int]:
+        return sorted(cpu for core in self.cores for cpu in core)
+
+    def record(self) -> Dict[str, Any]:
+        return {
+            "trial": self.name,
+            "status": self.status,
+            "overrides": self.overrides,
+            "evals": {str(step): loss for step, loss in sorted(self.evals.items())},
+            "stopped_at": self.stopped_at,
+            "result": self.result
+        }
+
+
+def config_types() -> Dict[str, Any]:
+    """ModelConfig field name -> annotated type"""
+    hints = typing.get_type_hints(ModelConfig)
+    return {f.name: hints[f.name] for f in dataclasses.fields(ModelConfig)}
+
+
+def coerce(name: str, value: Any, annotation: Any) -> Any:
+    """A spec value converted to the ModelConfig field's type (YAML reads 3e-4 as a string, for one)"""
+    if typing.get_origin(annotation) is typing.Union:
+        if value is None:
+            return None
+        annotation = next(arg for arg in typing.get_args(annotation) if arg is not type(None))
+    origin = typing.get_origin(annotation) or annotation
+    if origin is bool:
+        if not isinstance(value, bool):
+            raise ValueError(f"{name}: expected true or false, got {value!r}")
+        return value
+    if origin in (int, float, str):
+        return origin(value)
+    if origin in (list, tuple):
+        if not isinstance(value, (list, tuple)):
+            raise ValueError(f"{name}: expected a list, got {value!r}")
+        return list(value)
+    return value
+
+
+def load_spec(path) -> Dict[str, Any]:
+    """Read a sweep spec and check every swept or fixed field against ModelConfig"""
+    with open(path, 'r', encoding='utf-8') as f:
+        spec = yaml.safe_load(f) or {}
+    spec["method"] = spec.get("method", "grid")
+    if spec["method"] not in ("grid", "random"):
+        raise ValueError(f"method must be grid or random, not {spec['method']!r}")
+    spec["trial"] = {**DEFAULT_TRIAL, **(spec.get("trial") or {})}
+    spec["early_termination"] = {**DEFAULT_EARLY_TERMINATION, **(spec.get("early_termination") or {})}
+    spec["budget"] = {**DEFAULT_BUDGET, **(spec.get("budget") or {})}
+    spec["base"] = spec.get("base") or {}
+    spec["parameters"] = spec.get("parameters") or {}
+    if not spec["parameters"]:
+        raise ValueError("The spec sweeps no parameters")
+
+    types = config_types()
+    for name in list(spec["base"]) + list(spec["parameters"]):
+        if name not in types:
+            raise ValueError(f"{name} is not a ModelConfig field")
+        if name in RESERVED_FIELDS:
+            raise ValueError(f"{name} is set by the sweep for every trial and cannot be swept")
+    spec["base"] = {name: coerce(name, value, types[name]) for name, value in spec["base"].items()}
+    for name, values in spec["parameters"].items():
+        if isinstance(values, dict):
+            if spec["method"] == "grid":
+                raise ValueError(f"{name}: a grid sweep needs a list of values, not a range")
+            if "min" not in values or "max" not in values:
+                raise ValueError(f"{name}: a range needs min and max")
+        elif not isinstance(values, list) or not values:
+            raise ValueError(f"{name}: expected a non-empty list of values or a min/max range")
+    return spec
+
+
+def sample_range(name: str, bounds: Dict[str, Any], annotation: Any, rng: random.Random) -> Any:
+    """A value drawn from a {min, max, log} range, log-uniformly if log is set"""
+    low, high = float(bounds["min"]), float(bounds["max"])
+    if bounds.get("log"):
+        value = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+    else:
+        value = rng.uniform(low, high)
+    return coerce(name, round(value) if annotation is int else value, annotation)
+
+
+def expand_trials(spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Override sets of every trial: the full grid, or spec['trials'] random draws"""
+    types = config_types()
+    names = list(spec["parameters"])
+    if spec["method"] == "grid":
+        grids = [[coerce(name, value, types[name]) for value in spec["parameters"][name]] for name in names]
+        return [dict(zip(names, values)) for values in itertools.product(*grids)]
+
+    rng = random.Random(spec["trial"]["seed"])
+    trials = []
+    for _ in range(int(spec.get("trials", 8))):
+        overrides = {}
+        for name in names:
+            values = spec["parameters"][name]
+            if isinstance(values, dict):
+                overrides[name] = sample_range(name, values, types[name], rng)
+            else:
+                overrides[name] = coerce(name, rng.choice(values), types[name])
+        trials.append(overrides)
+    return trials
+
+
+def dominates(a: Dict[str, float], b: Dict[str, float]) -> bool:
+    """a is no worse than b on eval loss, throughput and latency, and better on at least one"""
+    no_worse = (a["eval_loss"] <= b["eval_loss"] and a["tokens_per_second"] >= b["tokens_per_second"]
+                and a["latency_ms_per_token"] <= b["latency_ms_per_token"])
+    better = (a["eval_loss"] < b["eval_loss"] or a["tokens_per_second"] > b["tokens_per_second"]
+              or a["latency_ms_per_token"] < b["latency_ms_per_token"])
+    return no_worse and better
+
+
+def pareto_front(trials: List[Trial]) -> List[Trial]:
+    """Completed trials no other completed trial dominates"""
+    done = [trial for trial in trials if trial.status == "done" and trial.result]
+    return [trial for trial in done if not any(dominates(other.result, trial.result) for other in done if other is not trial)]
+
+
+class SweepProgressCallback(TrainerCallback):
+    """Append every evaluation's loss to a JSON lines file the scheduler polls"""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+        if metrics and "eval_loss" in metrics and state.is_world_process_zero:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"step": state.global_step, "eval_loss": metrics["eval_loss"]}) + "\n")
+
+
+def inference_latency(model, dataset, pad_token_id: int, prompt_tokens: int, new_tokens: int,
+                      repeats: int = 3) -> float:
+    """Median milliseconds per generated token, greedy with the KV cache, for a prompt from dataset
+
+    The adapters are left unmerged, as the checkpoints are served, so the
+    LoRA rank and target modules show up in the latency.
+    """
+    lengths = np.asarray(dataset.lengths)
+    index = int(np.argmax(lengths >= prompt_tokens)) if (lengths >= prompt_tokens).any() else int(np.argmax(lengths))
+    prompt = torch.as_tensor(np.asarray(dataset[index]["input_ids"][:prompt_tokens], dtype=np.int64))[None]
+    prompt = prompt.to(model.device)
+    model.eval()
+    times = []
+    with torch.no_grad():
+        for repeat in range(repeats + 1):
+            start = time.perf_counter()
+            model.generate(
+                input_ids=prompt,
+                attention_mask=torch.ones_like(prompt),
+                max_new_tokens=new_tokens,
+                min_new_tokens=new_tokens,
+                do_sample=False,
+                use_cache=True,
+                pad_token_id=pad_token_id
+            )
+            if repeat:  # The first call is warmup
+                times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1000 / new_tokens
+
+
+def run_trial(trial_file: Path):
+    """Train one trial (in its own process), then measure eval loss, throughput and latency"""
+    with open(trial_file, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    directory = trial_file.parent
+    settings = spec["trial"]
+    torch.set_num_threads(spec["threads"])
+    config = ModelConfig(**{
+        **spec["config"],
+        "output_dir": str(directory / "output"),
+        "num_threads": spec["threads"],
+        "memory_limit_gb": spec["memory_gb"],
+        "memory_check": settings["memory_check"],
+        "rebuild_datasets": False,
+        # A full-length warmup would keep a short trial from ever reaching its learning rate
+        "warmup_steps": min(spec["config"].get("warmup_steps", ModelConfig.warmup_steps), settings["max_steps"] // 10)
+    })
+
+    if spec["synthetic"]:
+        from benchmark_training import BenchmarkTrainer, write_synthetic_split
+        trainer = BenchmarkTrainer(config)
+        trainer.configure_cpu()
+        trainer.load_model_and_tokenizer()
+        rng = np.random.default_rng(settings["seed"])
+        train_dataset = write_synthetic_split(directory / "data" / "train", SYNTHETIC_EXAMPLES, config.max_length,
+                                              trainer.vocab_size, rng)
+        eval_dataset = write_synthetic_split(directory / "data" / "val", SYNTHETIC_EXAMPLES // 8, config.max_length,
+                                             trainer.vocab_size, rng)
+    else:
+        trainer = StoryForgeTrainer(config)
+        trainer.configure_cpu()
+        trainer.load_model_and_tokenizer()
+        train_dataset, eval_dataset = trainer.prepare_datasets()
+
+    hf_trainer = trainer.build_trainer(
+        train_dataset,
+        eval_dataset,
+        max_steps=settings["max_steps"],
+        eval_strategy="steps",
+        eval_steps=settings["eval_steps"],
+        save_strategy="no",
+        load_best_model_at_end=False,
+        logging_steps=settings["logging_steps"],
+        report_to="none",
+        seed=settings["seed"]
+    )
+    hf_trainer.add_callback(SweepProgressCallback(directory / "progress.jsonl"))
+    hf_trainer.train()
+    if settings["max_steps"] % settings["eval_steps"]:
+        hf_trainer.evaluate()
+    eval_loss = next(entry["eval_loss"] for entry in reversed(hf_trainer.state.log_history) if "eval_loss" in entry)
+
+    throughput = trainer.throughput.summary()
+    memory = trainer.memory.summary()
+    result = {
+        "eval_loss": eval_loss,
+        "tokens_per_second": throughput.get("tokens_per_second", 0.0),
+        "latency_ms_per_token": inference_latency(
+            trainer.model, eval_dataset, trainer.pad_token_id,
+            settings["latency_prompt_tokens"], settings["latency_new_tokens"]
+        ),
+        "peak_memory_mb": memory.get("peak_mb"),
+        "steps": hf_trainer.state.global_step
+    }
+    with open(directory / "result.json", 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+
+
+def prepare_sweep_datasets(spec: Dict[str, Any], trials: List[Dict[str, Any]]):
+    """Tokenize every (model, max_length) the trials need once, before they start
+
+    Concurrent trials would otherwise tokenize the same dataset at the same
+    time into the same scratch directory.
+    """
+    from preprocess_and_save import dataset_fingerprint, find_tokenized_dataset, load_tokenizer, preprocess_and_save
+    needed = set()
+    for overrides in trials:
+        config = ModelConfig(**{**spec["base"], **overrides})
+        needed.add((config.model_name, config.model_revision, config.max_length, config.data_path))
+    for model_name, revision, max_length, data_path in sorted(needed, key=str):
+        tokenizer = load_tokenizer(model_name, revision)
+        fingerprint = dataset_fingerprint(tokenizer, model_name=model_name, revision=revision,
+                                          max_length=max_length, data_path=data_path)
+        if find_tokenized_dataset(fingerprint) is None:
+            print(f"📦 Tokenizing {data_path} for {model_name} at max_length {max_length}")
+            preprocess_and_save(model_name=model_name, revision=revision, data_path=data_path,
+                                max_length=max_length, tokenizer=tokenizer)
+
+
+class SweepScheduler:
+    """Run trials as subprocesses within a core and memory budget and stop the ones falling behind
+
+    Each running trial is pinned to its own whole physical cores and holds
+    memory_gb_per_trial of the memory budget; a trial starts as soon as
+    both are free. At every evaluation step a trial's eval loss is ranked
+    against the other trials' losses at the same step, and once min_trials
+    have reported there, a trial outside the best keep_fraction is
+    terminated (a median stopping rule at keep_fraction 0.5). Trials that
+    started first are never judged against trials that have not reported
+    yet, so the sweep order matters little.
+    """
+
+    def __init__(self, spec: Dict[str, Any], trials: List[Trial], synthetic: bool = False):
+        self.spec = spec
+        self.trials = trials
+        self.synthetic = synthetic
+        budget = spec["budget"]
+        groups = physical_core_groups()
+        self.cores_per_trial = int(budget["cores_per_trial"])
+        self.memory_per_trial = float(budget["memory_gb_per_trial"])
+        total_cores = min(int(budget.get("cores") or len(groups)), len(groups))
+        self.free_cores = groups[:total_cores]
+        self.free_memory = float(budget.get("memory_gb") or memory_limit_gb(torch.device("cpu")))
+        self.max_concurrent = min(total_cores // self.cores_per_trial, int(self.free_memory // self.memory_per_trial))
+        if self.max_concurrent < 1:
+            raise ValueError(
+                f"A trial needs {self.cores_per_trial} cores and {self.memory_per_trial:.1f} GB; the budget is "
+                f"{total_cores} cores and {self.free_memory:.1f} GB"
+            )
+
+    def start(self, trial: Trial):
+        trial.cores = [self.free_cores.pop(0) for _ in range(self.cores_per_trial)]
+        self.free_memory -= self.memory_per_trial
+        trial.directory.mkdir(parents=True, exist_ok=True)
+        trial_file = trial.directory / "trial.json"
+        with open(trial_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                "config": {**self.spec["base"], **trial.overrides},
+                "trial": self.spec["trial"],
+                "threads": self.cores_per_trial,
+                "memory_gb": self.memory_per_trial,
+                "synthetic": self.synthetic
+            }, f, indent=2)
+
+        env = {key: value for key, value in os.environ.items()
+               if key not in ("RANK", "LOCAL_RANK", "WORLD_SIZE", "LOCAL_WORLD_SIZE", "MASTER_ADDR", "MASTER_PORT")}
+        env.update(OMP_NUM_THREADS=str(self.cores_per_trial), MKL_NUM_THREADS=str(self.cores_per_trial))
+        pin = hasattr(os, "sched_setaffinity")
+        with open(trial.directory / "trial.log", 'w', encoding='utf-8') as log:
+            trial.process = subprocess.Popen(
+                [sys.executable, str(Path(__file__).resolve()), "--trial", str(trial_file)],
+                env=env,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                preexec_fn=(lambda cpus=trial.cpus: os.sched_setaffinity(0, cpus)) if pin else None
+            )
+        trial.status = "running"
+        print(f"🧩 {trial.name} on CPUs {format_cpus(trial.cpus)}: {format_overrides(trial.overrides)}")
+
+    def release(self, trial: Trial):
+        self.free_cores = sorted(self.free_cores + trial.cores)
+        trial.cores = []
+        self.free_memory += self.memory_per_trial
+
+    def read_progress(self, trial: Trial) -> List[int]:
+        """Steps of evaluations the trial reported since the last poll"""
+        path = trial.directory / "progress.jsonl"
+        if not path.exists():
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            f.seek(trial._progress_offset)
+            lines = f.readlines()
+            # A line still being written is read on the next poll
+            if lines and not lines[-1].endswith("\n"):
+                lines.pop()
+            trial._progress_offset += sum(len(line.encode("utf-8")) for line in lines)
+        steps = []
+        for line in lines:
+            report = json.loads(line)
+            trial.evals[report["step"]] = report["eval_loss"]
+            steps.append(report["step"])
+        return steps
+
+    def should_stop(self, trial: Trial, step: int) -> bool:
+        if step >= self.spec["trial"]["max_steps"]:
+            return False
+        rules = self.spec["early_termination"]
+        losses = [other.evals[step] for other in self.trials if step in other.evals]
+        if len(losses) < rules["min_trials"]:
+            return False
+        keep = max(1, int(np.ceil(len(losses) * rules["keep_fraction"])))
+        return trial.evals[step] > sorted(losses)[keep - 1]
+
+    def finish(self, trial: Trial, code: int):
+        self.release(trial)
+        result_path = trial.directory / "result.json"
+        if code == 0 and result_path.exists():
+            with open(result_path, 'r', encoding='utf-8') as f:
+                trial.result = json.load(f)
+            trial.status = "done"
+            print(f"✅ {trial.name}: eval loss {trial.result['eval_loss']:.4f}, "
+                  f"{trial.result['tokens_per_second']:,.0f} tokens/sec, {trial.result['latency_ms_per_token']:.1f} ms/token")
+        else:
+            trial.status = "failed"
+            print(f"⚠️ {trial.name} exited with code {code}; see {trial.directory / 'trial.log'}")
+
+    def poll(self):
+        for trial in self.trials:
+            if trial.status != "running":
+                continue
+            for step in self.read_progress(trial):
+                if self.should_stop(trial, step):
+                    trial.process.terminate()
+                    trial.process.wait()
+                    trial.status = "stopped"
+                    trial.stopped_at = step
+                    self.release(trial)
+                    print(f"✂️ {trial.name} stopped at step {step}: eval loss {trial.evals[step]:.4f} "
+                          "is behind the other trials")
+                    break
+            if trial.status == "running" and trial.process.poll() is not None:
+                self.read_progress(trial)
+                self.finish(trial, trial.process.returncode)
+
+    def run(self):
+        print(f"📦 {len(self.trials)} trials, up to {self.max_concurrent} at a time "
+              f"({self.cores_per_trial} cores and {self.memory_per_trial:.1f} GB each)")
+        pending = list(self.trials)
+        try:
+            while pending or any(trial.status == "running" for trial in self.trials):
+                running = sum(1 for trial in self.trials if trial.status == "running")
+                while (pending and running < self.max_concurrent and len(self.free_cores) >= self.cores_per_trial
+                       and self.free_memory >= self.memory_per_trial):
+                    self.start(pending.pop(0))
+                    running += 1
+                time.sleep(POLL_INTERVAL)
+                self.poll()
+        except KeyboardInterrupt:
+            print("⚠️ Interrupted; stopping running trials")
+            for trial in self.trials:
+                if trial.status == "running":
+                    trial.process.terminate()
+                    trial.process.wait()
+                    trial.status = "stopped"
+
+
+def format_overrides(overrides: Dict[str, Any]) -> str:
+    parts = []
+    for name, value in overrides.items():
+        if isinstance(value, float):
+            value = f"{value:.3g}"
+        elif isinstance(value, list):
+            value = ",".join(str(item) for item in value)
+        parts.append(f"{name}={value}")
+    return " ".join(parts)
+
+
+def write_report(trials: List[Trial], output_dir: Path, spec: Dict[str, Any]) -> str:
+    """Write report.json and report.txt (a table with the Pareto front marked) and return the table"""
+    front = pareto_front(trials)
+    done = sorted((trial for trial in trials if trial.status == "done"), key=lambda trial: trial.result["eval_loss"])
+    lines = [
+        "Pareto front: lowest eval loss, highest training tokens/sec, lowest inference ms/token (* = on the front)",
+        f"  {'':1} {'trial':<10} {'eval loss':>9} {'tokens/s':>10} {'ms/token':>9} {'peak MB':>9}  config"
+    ]
+    for trial in done:
+        result = trial.result
+        lines.append(
+            f"  {'*' if trial in front else '':1} {trial.name:<10} {result['eval_loss']:>9.4f} "
+            f"{result['tokens_per_second']:>10,.0f} {result['latency_ms_per_token']:>9.1f} "
+            f"{result['peak_memory_mb'] or 0:>9,.0f}  {format_overrides(trial.overrides)}"
+        )
+    for trial in trials:
+        if trial.status != "done":
+            step = trial.stopped_at or max(trial.evals, default=None)
+            last = f" at step {step}, eval loss {trial.evals[step]:.4f}" if step is not None else ""
+            lines.append(f"    {trial.name:<10} {trial.status}{last}  {format_overrides(trial.overrides)}")
+    table = "\n".join(lines)
+
+    with open(output_dir / "report.json", 'w', encoding='utf-8') as f:
+        json.dump({
+            "created": datetime.now().isoformat(),
+            "spec": spec,
+            "pareto_front": [trial.name for trial in front],
+            "trials": [trial.record() for trial in trials]
+        }, f, indent=2)
+    with open(output_dir / "report.txt", 'w', encoding='utf-8') as f:
+        f.write(table + "\n")
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep StoryForge fine-tuning hyperparameters within a CPU and memory budget")
+    parser.add_argument("spec", nargs="?", help="Sweep spec YAML (see training/config/sweep.yaml)")
+    parser.add_argument("--name", default=None, help=f"Sweep name; results go to {SWEEP_DIR}/<name>")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="Train a tiny random model on synthetic data, to try a spec or the scheduler offline")
+    parser.add_argument("--list", action="store_true", help="Print the trials the spec expands to and exit")
+    parser.add_argument("--trial", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.trial:
+        run_trial(Path(args.trial))
+        return
+    if not args.spec:
+        parser.error("a sweep spec is required")
+
+    try:
+        spec = load_spec(args.spec)
+    except ValueError as e:
+        parser.error(f"{args.spec}: {e}")
+    overrides = expand_trials(spec)
+    if args.list:
+        for trial_id, trial in enumerate(overrides):
+            print(f"trial-{trial_id:03d}: {format_overrides(trial)}")
+        return
+
+    name = args.name or f"sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    output_dir = Path(SWEEP_DIR) / name
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if not args.synthetic:
+        prepare_sweep_datasets(spec, overrides)
+    trials = [Trial(trial_id, trial, output_dir / f"trial-{trial_id:03d}") for trial_id, trial in enumerate(overrides)]
+    SweepScheduler(spec, trials, synthetic=args.synthetic).run()
+
+    print("\n📊 " + write_report(trials, output_dir, spec))
+    print(f"\n✅ Report written to {output_dir / 'report.txt'}")
+
+
+if __name__ == "__main__":
+    main()
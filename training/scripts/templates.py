@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Chat Templates for StoryForge Training Examples
+Renders stories and prompts with the model's own chat template, and splices
+separately tokenized template framing around pre-tokenized story bodies
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, List, Tuple
+
+STORY_SYSTEM_PROMPT = (
+    "You are a helpful AI assistant that creates engaging, age-appropriate stories for children aged "
+    "{age_group}. Your stories should be safe, educational, and entertaining."
+)
+STORY_USER_PROMPT = "Create a {genre} story suitable for children aged {age_group}."
+PROMPT_SYSTEM_PROMPT = (
+    "You are a helpful AI assistant that creates engaging, age-appropriate stories for children. "
+    "Always ensure content is safe and suitable for young readers."
+)
+PROMPT_REPLY = "Once upon a time, there was a magical adventure waiting to unfold..."
+
+DEFAULT_AGE_GROUP = "7-10"
+DEFAULT_GENRE = "adventure"
+
+# Stands in for the body while rendering, so the template can be cut around it
+_BODY_PLACEHOLDER = "\x00STORYFORGE_BODY\x00"
+
+
+def example_messages(kind: str, body: str, metadata: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Chat messages for a 'story' (body is the assistant reply) or 'prompt' (body is the user turn)"""
+    age_group = metadata.get('age_group') or DEFAULT_AGE_GROUP
+    genre = metadata.get('genre') or DEFAULT_GENRE
+    if kind == "story":
+        return [
+            {"role": "system", "content": STORY_SYSTEM_PROMPT.format(age_group=age_group)},
+            {"role": "user", "content": STORY_USER_PROMPT.format(genre=genre, age_group=age_group)},
+            {"role": "assistant", "content": body}
+        ]
+    if kind == "prompt":
+        return [
+            {"role": "system", "content": PROMPT_SYSTEM_PROMPT},
+            {"role": "user", "content": body},
+            {"role": "assistant", "content": PROMPT_REPLY}
+        ]
+    raise ValueError(f"Unknown example kind: {kind}")
+
+
+def format_example(tokenizer, kind: str, body: str, metadata: Dict[str, Any]) -> str:
+    """Render one training example as text with the tokenizer's chat template"""
+    if not tokenizer.chat_template:
+        raise ValueError(f"Tokenizer {tokenizer.name_or_path} has no chat template")
+    text = tokenizer.apply_chat_template(example_messages(kind, body.strip(), metadata), tokenize=False)
+    # End on the end-of-turn token rather than the newline the template adds after it
+    return text.rstrip()
+
+
+def template_hash(tokenizer) -> str:
+    """Hash of everything that shapes the framing around bodies: chat template and prompts"""
+    payload = json.dumps([
+        tokenizer.chat_template,
+        STORY_SYSTEM_PROMPT,
+        STORY_USER_PROMPT,
+        PROMPT_SYSTEM_PROMPT,
+        PROMPT_REPLY,
+        DEFAULT_AGE_GROUP,
+        DEFAULT_GENRE
+    ], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class TemplateSplicer:
+    """Build token ids for training examples from pre-tokenized bodies
+
+    The template text before and after the body is tokenized once per
+    distinct framing (a handful of age group / genre combinations) and
+    concatenated around the cached body ids, so changing a prompt or the
+    chat template never re-tokenizes the corpus. Bodies are truncated so
+    the closing framing always fits in max_length.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self._frames: Dict[Tuple[str, ...], Tuple[List[int], List[int]]] = {}
+
+    def frame(self, kind: str, metadata: Dict[str, Any]) -> Tuple[List[int], List[int]]:
+        """(prefix ids, suffix ids) surrounding the body for this kind of example"""
+        messages = example_messages(kind, _BODY_PLACEHOLDER, metadata)
+        key = tuple(message["content"] for message in messages)
+        if key not in self._frames:
+            rendered = format_example(self.tokenizer, kind, _BODY_PLACEHOLDER, metadata)
+            prefix, suffix = rendered.split(_BODY_PLACEHOLDER)
+            self._frames[key] = (
+                self.tokenizer(prefix, add_special_tokens=False)["input_ids"],
+                self.tokenizer(suffix, add_special_tokens=False)["input_ids"]
+            )
+        return self._frames[key]
+
+    def splice(self, kind: str, body_ids: List[int], metadata: Dict[str, Any], max_length: int) -> List[int]:
+        prefix, suffix = self.frame(kind, metadata)
+        room = max(0, max_length - len(prefix) - len(suffix))
+        return prefix + list(body_ids[:room]) + suffix
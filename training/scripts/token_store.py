@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Compact Tokenized Dataset Storage for StoryForge Fine-Tuning
+Flat uint32 token arrays with an offsets index, memory-mapped for zero-copy reads
+"""
+
+import json
+import random
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, IterableDataset
+
+# Part of every dataset fingerprint, so a change of layout never loads stale files
+STORE_FORMAT = "tokens-uint32-v1"
+
+TOKENS_FILE = "tokens.bin"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "meta.json"
+TAGS_FILE = "tags.json"
+
+
+class TokenStoreWriter:
+    """Append token sequences to a store directory: tokens.bin, offsets.npy and meta.json
+
+    Tokens are written through as they arrive; only the offsets (8 bytes per
+    example) and tag codes (2 bytes per example and tag) are held in memory
+    until close(). Tags are small categorical labels such as the source
+    dataset, stored as tag-<name>.npy codes plus their values in tags.json.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._tokens = open(self.path / TOKENS_FILE, 'wb')
+        self._offsets = array('q', [0])
+        self._tag_values: Dict[str, Dict[str, int]] = {}
+        self._tag_codes: Dict[str, array] = {}
+
+    def add(self, token_ids: Sequence[int], **tags: str):
+        ids = np.asarray(token_ids, dtype=np.uint32)
+        self._tokens.write(ids.tobytes())
+        self._offsets.append(self._offsets[-1] + len(ids))
+        for name in tags:
+            if name not in self._tag_codes:
+                # Examples added before this tag first appeared get the empty value
+                self._tag_values[name] = {"": 0}
+                self._tag_codes[name] = array('H', [0] * (self.num_examples - 1))
+        for name, codes in self._tag_codes.items():
+            # So does an example added without a tag others have
+            values = self._tag_values[name]
+            codes.append(values.setdefault(tags.get(name, ""), len(values)))
+
+    @property
+    def num_examples(self) -> int:
+        return len(self._offsets) - 1
+
+    @property
+    def num_tokens(self) -> int:
+        return self._offsets[-1]
+
+    def close(self):
+        self._tokens.close()
+        np.save(self.path / OFFSETS_FILE, np.frombuffer(self._offsets, dtype=np.int64))
+        for name, codes in self._tag_codes.items():
+            np.save(self.path / f"tag-{name}.npy", np.frombuffer(codes, dtype=np.uint16))
+        with open(self.path / TAGS_FILE, 'w', encoding='utf-8') as f:
+            json.dump({name: list(values) for name, values in self._tag_values.items()}, f, indent=2)
+        with open(self.path / META_FILE, 'w', encoding='utf-8') as f:
+            json.dump({
+                "format": STORE_FORMAT,
+                "num_examples": self.num_examples,
+                "num_tokens": self.num_tokens
+            }, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TokenStore(Dataset):
+    """Read-only, memory-mapped view of a store written by TokenStoreWriter
+
+    Items are {'input_ids': uint32 view into the mapping}; nothing is copied
+    until a collator pads a batch. Every process opening the same store shares
+    one page-cache copy of it.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / META_FILE, 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != STORE_FORMAT:
+            raise ValueError(f"{self.path} is not a {STORE_FORMAT} token store")
+        self.offsets = np.load(self.path / OFFSETS_FILE, mmap_mode='r')
+        if self.meta["num_tokens"]:
+            self.tokens = np.memmap(self.path / TOKENS_FILE, dtype=np.uint32, mode='r')
+        else:
+            self.tokens = np.zeros(0, dtype=np.uint32)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> Dict[str, np.ndarray]:
+        return {"input_ids": self.tokens[self.offsets[index]:self.offsets[index + 1]]}
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Token count of every example"""
+        return np.diff(self.offsets)
+
+    @property
+    def num_tokens(self) -> int:
+        return int(self.meta["num_tokens"])
+
+    def tag(self, name: str) -> Tuple[np.ndarray, List[str]]:
+        """(per-example codes, values) of a tag; examples without it have code 0, value ''"""
+        tags_path = self.path / TAGS_FILE
+        values = []
+        if tags_path.exists():
+            with open(tags_path, 'r', encoding='utf-8') as f:
+                values = json.load(f).get(name, [])
+        if not values:
+            return np.zeros(len(self), dtype=np.uint16), [""]
+        return np.load(self.path / f"tag-{name}.npy", mmap_mode='r'), values
+
+
+class StreamingTokenStore(IterableDataset):
+    """Iterate a TokenStore (or a packed view of one) front to back through a shuffle buffer
+
+    Reads are sequential, so a store much larger than RAM streams through
+    the page cache without random seeks; the buffer reshuffles every epoch.
+    """
+
+    def __init__(self, store: Dataset, shuffle_buffer_size: int = 10_000, seed: int = 42):
+        self.store = store
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[Dict[str, np.ndarray]]:
+        rng = random.Random(self.seed + self.epoch)
+        buffer: List[Dict[str, np.ndarray]] = []
+        worker = torch.utils.data.get_worker_info()
+        start, step = (worker.id, worker.num_workers) if worker else (0, 1)
+        for index in range(start, len(self.store), step):
+            buffer.append(self.store[index])
+            if len(buffer) >= self.shuffle_buffer_size:
+                pick = rng.randrange(len(buffer))
+                buffer[pick], buffer[-1] = buffer[-1], buffer[pick]
+                yield buffer.pop()
+        rng.shuffle(buffer)
+        yield from buffer
+
+
+class TokenStoreCollator:
+    """Pad a batch of token arrays for causal LM training
+
+    Tokens are copied once, straight from the memory-mapped views into the
+    batch tensor. Labels ignore padding by position rather than by token id,
+    so EOS is still learned when it doubles as the pad token.
+    """
+
+    def __init__(self, pad_token_id: int, pad_to_multiple_of: int = 8):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        longest = max(len(f["input_ids"]) for f in features)
+        length = -(-longest // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        input_ids = np.full((len(features), length), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(features), length), dtype=np.int64)
+        for row, feature in enumerate(features):
+            n = len(feature["input_ids"])
+            input_ids[row, :n] = feature["input_ids"]
+            attention_mask[row, :n] = 1
+
+        input_ids = torch.from_numpy(input_ids)
+        attention_mask = torch.from_numpy(attention_mask)
+        labels = input_ids.masked_fill(attention_mask == 0, -100)
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+"""
+Training Callbacks for StoryForge Fine-Tuning
+Measures throughput, per-step timings and phase profiles from inside the Hugging Face Trainer loop
+"""
+
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from transformers import TrainerCallback
+
+# Where the time of one optimizer step goes, in loop order
+STEP_PHASES = ["dataloader", "forward_backward", "optimizer", "other"]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB (None where the OS does not report it)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb() -> Optional[float]:
+    """Resident set size of this process right now in MB (falls back to the peak off Linux)"""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return peak_rss_mb()
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class ThroughputCallback(TrainerCallback):
+    """Time every optimizer step by phase and count the tokens it trained on
+
+    Each step is split into dataloader wait (from the end of the previous
+    step to the start of this one, with evaluation and checkpointing left
+    out), forward and backward over all accumulated micro-batches, the
+    optimizer step, and everything else (scheduler, logging, callbacks).
+    Tokens and samples are counted from the batches the model is called
+    with while training: real tokens are labelled ones, computed tokens
+    include padding, and samples are examples rather than packed rows, so
+    packed and padded runs compare fairly. The first skip_steps steps are
+    recorded but left out of the summary as warmup.
+    """
+
+    def __init__(self, skip_steps: int = 0):
+        self.skip_steps = skip_steps
+        self.steps: List[Dict[str, float]] = []
+        self._hook = None
+        self._reset_step()
+        self._last_end = None
+
+    def _reset_step(self):
+        self._begin = self._pre_optimizer = self._post_optimizer = None
+        self._tokens = self._computed_tokens = self._samples = 0
+
+    def _count_batch(self, module, args, kwargs):
+        if not module.training:
+            return
+        input_ids = kwargs.get("input_ids", args[0] if args else None)
+        if input_ids is None:
+            return
+        labels = kwargs.get("labels")
+        self._computed_tokens += input_ids.numel()
+        self._tokens += int((labels != -100).sum()) if labels is not None else input_ids.numel()
+        position_ids = kwargs.get("position_ids")
+        # A packed row holds several examples, each with exactly one token at position 1
+        self._samples += int((position_ids == 1).sum()) if position_ids is not None else input_ids.shape[0]
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        self._hook = model.register_forward_pre_hook(self._count_batch, with_kwargs=True)
+        self._last_end = time.perf_counter()
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self._begin = time.perf_counter()
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self._pre_optimizer = time.perf_counter()
+
+    def on_optimizer_step(self, args, state, control, **kwargs):
+        self._post_optimizer = time.perf_counter()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        end = time.perf_counter()
+        begin = self._begin or self._last_end
+        pre_optimizer = self._pre_optimizer or end
+        post_optimizer = self._post_optimizer or pre_optimizer
+        self.steps.append({
+            "step": state.global_step,
+            "seconds": end - self._last_end,
+            "dataloader": begin - self._last_end,
+            "forward_backward": pre_optimizer - begin,
+            "optimizer": post_optimizer - pre_optimizer,
+            "other": end - post_optimizer,
+            "tokens": self._tokens,
+            "computed_tokens": self._computed_tokens,
+            "samples": self._samples
+        })
+        self._last_end = end
+        self._reset_step()
+
+    def _skip_pause(self, *args, **kwargs):
+        # Evaluation and checkpointing run after on_step_end; keep them out of the next step's dataloader wait
+        self._last_end = time.perf_counter()
+
+    on_evaluate = _skip_pause
+    on_save = _skip_pause
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self._hook is not None:
+            self._hook.remove()
+            self._hook = None
+
+    def summary(self, all_ranks: bool = False) -> Dict[str, Any]:
+        """Throughput and step timings over the steps after warmup
+
+        With all_ranks in a data-parallel run (every worker must call it),
+        tokens and samples are summed over the workers and the time is the
+        slowest worker's; step timings and memory stay this worker's own.
+        """
+        steps = self.steps[self.skip_steps:] or self.steps
+        if not steps:
+            return {"steps": 0, "peak_rss_mb": peak_rss_mb()}
+        seconds = np.array([step["seconds"] for step in steps])
+        total = float(seconds.sum())
+        tokens = sum(step["tokens"] for step in steps)
+        computed_tokens = sum(step["computed_tokens"] for step in steps)
+        samples = sum(step["samples"] for step in steps)
+        world_size = 1
+        if all_ranks and dist.is_available() and dist.is_initialized():
+            world_size = dist.get_world_size()
+            counts = torch.tensor([tokens, computed_tokens, samples], dtype=torch.float64)
+            longest = torch.tensor([total], dtype=torch.float64)
+            dist.all_reduce(counts, op=dist.ReduceOp.SUM)
+            dist.all_reduce(longest, op=dist.ReduceOp.MAX)
+            tokens, computed_tokens, samples = (int(count) for count in counts.tolist())
+            total = float(longest)
+        phases = {}
+        for phase in STEP_PHASES:
+            phase_seconds = float(sum(step[phase] for step in steps))
+            phases[phase] = {
+                "seconds": phase_seconds,
+                "mean_ms": 1000 * phase_seconds / len(steps),
+                "fraction": phase_seconds / total if total else 0.0
+            }
+        p50, p90 = np.percentile(seconds, [50, 90])
+        return {
+            "steps": len(steps),
+            "world_size": world_size,
+            "warmup_steps": len(self.steps) - len(steps),
+            "seconds": total,
+            "tokens": tokens,
+            "computed_tokens": computed_tokens,
+            "samples": samples,
+            "tokens_per_second": tokens / total if total else 0.0,
+            "computed_tokens_per_second": computed_tokens / total if total else 0.0,
+            "samples_per_second": samples / total if total else 0.0,
+            "padding_fraction": 1 - tokens / computed_tokens if computed_tokens else 0.0,
+            "step_time_ms": {
+                "mean": 1000 * float(seconds.mean()),
+                "p50": 1000 * float(p50),
+                "p90": 1000 * float(p90),
+                "max": 1000 * float(seconds.max())
+            },
+            "phases": phases,
+            "dataloader_wait_seconds": phases["dataloader"]["seconds"],
+            "peak_rss_mb": peak_rss_mb()
+        }
+
+
+# Phases of StepProfilerCallback, in loop order
+PROFILE_PHASES = ["dataloader", "forward", "backward", "recompute", "optimizer", "evaluation", "checkpoint", "other"]
+PROFILE_OP_ROWS = 30
+
+
+def checkpointed_layers(model) -> List[torch.nn.Module]:
+    """Layers whose activations gradient checkpointing recomputes during backward"""
+    try:
+        from transformers.modeling_layers import GradientCheckpointingLayer
+    except ImportError:
+        return []
+    return [
+        module for module in model.modules()
+        if isinstance(module, GradientCheckpointingLayer) and module.gradient_checkpointing
+    ]
+
+
+class StepProfilerCallback(TrainerCallback):
+    """Break training wall time down by phase over a window of optimizer steps
+
+    Steps start_step to end_step - 1 (counted from 0) are timed: dataloader
+    wait, forward, backward, gradient checkpointing recomputation (layers
+    running their forward again during backward), optimizer step,
+    evaluation, checkpointing and everything else. Forward and
+    recomputation are timed with module hooks that exist only inside the
+    window, and CUDA is synchronized at every measurement there, so the
+    rest of the run is not slowed down. With trace=True a torch.profiler
+    trace of the window is captured as well. The phase table (plus the
+    top operators) goes to summary.txt and phases.json in output_dir, the
+    trace to trace.json for chrome://tracing or Perfetto.
+    """
+
+    def __init__(self, output_dir, start_step: int = 10, end_step: int = 20, trace: bool = False,
+                 log: Callable[[str], Any] = print):
+        self.output_dir = Path(output_dir)
+        self.start_step = start_step
+        self.end_step = end_step
+        self.trace = trace
+        self.log = log
+        self.totals = dict.fromkeys(PROFILE_PHASES, 0.0)
+        self.steps = 0
+        self.done = False
+        self._active = False
+        self._hooks = []
+        self._profiler = None
+        self._model = None
+        self._cuda = False
+        self._in_forward = False
+        self._last_end = None
+
+    def _now(self) -> float:
+        if self._cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _forward_begin(self, module, args):
+        if module.training:
+            self._in_forward = True
+            self._forward_start = self._now()
+
+    def _forward_end(self, module, args, output):
+        if module.training and self._in_forward:
+            self._step_forward += self._now() - self._forward_start
+            self._in_forward = False
+
+    def _layer_begin(self, module, args):
+        # Outside the model's own forward a checkpointed layer only runs to recompute activations
+        if module.training and not self._in_forward:
+            self._recompute_start = self._now()
+
+    def _layer_end(self, module, args, output):
+        if module.training and not self._in_forward and self._recompute_start is not None:
+            self._step_recompute += self._now() - self._recompute_start
+            self._recompute_start = None
+
+    def _start_window(self):
+        self._active = True
+        self._hooks = [
+            self._model.register_forward_pre_hook(self._forward_begin),
+            self._model.register_forward_hook(self._forward_end)
+        ]
+        for layer in checkpointed_layers(self._model):
+            self._hooks.append(layer.register_forward_pre_hook(self._layer_begin))
+            self._hooks.append(layer.register_forward_hook(self._layer_end))
+        if self.trace:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self._cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._profiler = torch.profiler.profile(activities=activities, record_shapes=True)
+            self._profiler.start()
+
+    def _finish_window(self, state):
+        self._active = False
+        self.done = True
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+        if self._profiler is not None:
+            self._profiler.stop()
+        if state.is_world_process_zero:
+            self.write_report()
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        self._model = model
+        self._cuda = any(parameter.is_cuda for parameter in model.parameters())
+        self._last_end = time.perf_counter()
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        if self._active and state.global_step >= self.end_step:
+            self._finish_window(state)
+        if not self._active and not self.done and self.start_step <= state.global_step < self.end_step:
+            self._start_window()
+        if not self._active:
+            return
+        self._begin = self._now()
+        self.totals["dataloader"] += self._begin - self._last_end
+        self._pre_optimizer = self._post_optimizer = None
+        self._step_forward = self._step_recompute = 0.0
+        self._recompute_start = None
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        if self._active:
+            self._pre_optimizer = self._now()
+
+    def on_optimizer_step(self, args, state, control, **kwargs):
+        if self._active:
+            self._post_optimizer = self._now()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        end = self._now() if self._active else time.perf_counter()
+        if self._active:
+            pre_optimizer = self._pre_optimizer or end
+            post_optimizer = self._post_optimizer or pre_optimizer
+            compute = pre_optimizer - self._begin
+            self.totals["forward"] += self._step_forward
+            self.totals["recompute"] += self._step_recompute
+            self.totals["backward"] += max(0.0, compute - self._step_forward - self._step_recompute)
+            self.totals["optimizer"] += post_optimizer - pre_optimizer
+            self.totals["other"] += end - post_optimizer
+            self.steps += 1
+        self._last_end = end
+
+    def _after_step(self, phase: str):
+        # Evaluation and checkpointing run between on_step_end and these events
+        now = self._now() if self._active else time.perf_counter()
+        if self._active:
+            self.totals[phase] += now - self._last_end
+        self._last_end = now
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        self._after_step("evaluation")
+
+    def on_save(self, args, state, control, **kwargs):
+        self._after_step("checkpoint")
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self._active:
+            self._finish_window(state)
+
+    def summary(self) -> Dict[str, Any]:
+        total = sum(self.totals.values())
+        return {
+            "window": [self.start_step, self.end_step],
+            "steps": self.steps,
+            "seconds": total,
+            "phases": {
+                phase: {
+                    "seconds": seconds,
+                    "mean_ms": 1000 * seconds / self.steps if self.steps else 0.0,
+                    "fraction": seconds / total if total else 0.0
+                }
+                for phase, seconds in self.totals.items()
+            }
+        }
+
+    def write_report(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        summary = self.summary()
+        with open(self.output_dir / "phases.json", 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+
+        lines = [
+            f"Steps {self.start_step}-{self.end_step - 1}: {summary['steps']} steps profiled in {summary['seconds']:.1f}s",
+            f"  {'phase':<12} {'total s':>9} {'ms/step':>9} {'share':>7}"
+        ]
+        for phase, stats in summary["phases"].items():
+            lines.append(f"  {phase:<12} {stats['seconds']:>9.2f} {stats['mean_ms']:>9.1f} {stats['fraction']:>7.1%}")
+        table = "\n".join(lines)
+        self.log(f"📊 Step profile\n{table}")
+
+        report = table
+        if self._profiler is not None:
+            sort_by = "self_cuda_time_total" if self._cuda else "self_cpu_time_total"
+            report += "\n\nTop operators\n" + self._profiler.key_averages().table(sort_by=sort_by, row_limit=PROFILE_OP_ROWS)
+            self._profiler.export_chrome_trace(str(self.output_dir / "trace.json"))
+        with open(self.output_dir / "summary.txt", 'w', encoding='utf-8') as f:
+            f.write(report + "\n")
+        self.log(f"✅ Profile written to {self.output_dir}")
+
+
+def run_first(trainer, callback: TrainerCallback):
+    """Move callback ahead of every other callback of trainer, including the report_to integrations
+
+    The Trainer puts the callbacks it is given after its default ones, so
+    logs a callback adds to in on_log would otherwise never reach W&B,
+    TensorBoard and the other trackers.
+    """
+    callbacks = trainer.callback_handler.callbacks
+    callbacks.remove(callback)
+    callbacks.insert(0, callback)
+
+
+class MemoryCallback(TrainerCallback):
+    """Record the peak memory of every optimizer step against the sequence length it trained on
+
+    Process RSS is sampled after every training forward pass (when the
+    activations are held) and at the end of the step; on CUDA the
+    allocator's per-step peak and its reserved memory are read instead of
+    sampled. Each training log line gains the largest step peak and
+    sequence length since the previous one, and summary() gives the peak
+    reached at each sequence length seen, so a run that creeps towards its
+    memory limit shows where it will hit it. The metrics are added in
+    on_log, so the callback has to run before the report_to integrations
+    (see run_first).
+    """
+
+    # Sequence lengths are grouped to this granularity in the summary
+    LENGTH_BUCKET = 64
+
+    def __init__(self):
+        self.steps: List[Dict[str, float]] = []
+        self._hooks = []
+        self._cuda = None
+        self._step_peak = 0.0
+        self._step_length = 0
+        self._step_rows = 0
+        self._logged = 0
+
+    def _sample(self):
+        self._step_peak = max(self._step_peak, current_rss_mb() or 0.0)
+
+    def _count_batch(self, module, args, kwargs):
+        if not module.training:
+            return
+        input_ids = kwargs.get("input_ids", args[0] if args else None)
+        if isinstance(input_ids, torch.Tensor) and input_ids.dim() == 2:
+            self._step_length = max(self._step_length, input_ids.shape[1])
+            self._step_rows = max(self._step_rows, input_ids.shape[0])
+
+    def _after_forward(self, module, args, output):
+        if module.training and self._cuda is None:
+            self._sample()
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        device = next(model.parameters()).device
+        self._cuda = device if device.type == "cuda" else None
+        self._hooks = [
+            model.register_forward_pre_hook(self._count_batch, with_kwargs=True),
+            model.register_forward_hook(self._after_forward)
+        ]
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self._step_peak = 0.0
+        self._step_length = self._step_rows = 0
+        if self._cuda is not None:
+            torch.cuda.reset_peak_memory_stats(self._cuda)
+
+    def on_step_end(self, args, state, control, **kwargs):
+        step = {"step": state.global_step, "seq_len": self._step_length, "batch_rows": self._step_rows}
+        if self._cuda is not None:
+            step["peak_mb"] = torch.cuda.max_memory_allocated(self._cuda) / (1024 * 1024)
+            step["reserved_mb"] = torch.cuda.memory_reserved(self._cuda) / (1024 * 1024)
+        else:
+            self._sample()
+            step["peak_mb"] = self._step_peak
+        self.steps.append(step)
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        # Only training log lines; evaluation and the final summary have no loss
+        if logs is None or "loss" not in logs or len(self.steps) == self._logged:
+            return
+        recent = self.steps[self._logged:]
+        self._logged = len(self.steps)
+        memory = {
+            "memory_peak_mb": round(max(step["peak_mb"] for step in recent), 1),
+            "seq_len": max(step["seq_len"] for step in recent)
+        }
+        if self._cuda is not None:
+            memory["memory_reserved_mb"] = round(recent[-1]["reserved_mb"], 1)
+        logs.update(memory)
+        # The Trainer stored a copy of logs in the history before calling back
+        if state.log_history and state.log_history[-1].get("step") == state.global_step:
+            state.log_history[-1].update(memory)
+
+    def on_train_end(self, args, state, control, **kwargs):
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+
+    def summary(self) -> Dict[str, Any]:
+        if not self.steps:
+            return {"steps": 0}
+        by_length: Dict[int, float] = {}
+        for step in self.steps:
+            bucket = -(-step["seq_len"] // self.LENGTH_BUCKET) * self.LENGTH_BUCKET
+            by_length[bucket] = max(by_length.get(bucket, 0.0), step["peak_mb"])
+        peak = max(self.steps, key=lambda step: step["peak_mb"])
+        return {
+            "steps": len(self.steps),
+            "device": "cuda" if self._cuda is not None else "cpu",
+            "peak_mb": peak["peak_mb"],
+            "peak_step": peak["step"],
+            "peak_seq_len": peak["seq_len"],
+            "peak_mb_by_seq_len": dict(sorted(by_length.items()))
+        }
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Training Data Reader for StoryForge Custom Model Training
+Streams records exported by setup_vector_db.py (JSONL, Arrow or the legacy JSON dump)
+"""
+
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+DEFAULT_EXPORT_PATH = "training/processed_data.jsonl"
+
+
+def export_format(path: str) -> str:
+    """Infer the export format from a file name"""
+    suffix = Path(path).suffix.lower()
+    if suffix == ".jsonl":
+        return "jsonl"
+    if suffix == ".arrow":
+        return "arrow"
+    if suffix == ".json":
+        return "json"
+    raise ValueError(f"Unsupported export format: {path} (expected .jsonl, .arrow or .json)")
+
+
+def iter_exported_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield {'collection', 'id', 'document', 'metadata'} records one at a time
+
+    JSONL and Arrow exports are read incrementally, so memory stays flat no
+    matter how large the export is. The legacy JSON dump has to be loaded
+    whole and is only supported for older exports.
+    """
+    fmt = export_format(path)
+
+    if fmt == "jsonl":
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    elif fmt == "arrow":
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("pyarrow is required to read Arrow exports. Install with: pip install pyarrow")
+
+        with pa.OSFile(str(path), 'rb') as source:
+            reader = pa.ipc.open_stream(source)
+            for batch in reader:
+                columns = batch.to_pydict()
+                for collection, record_id, document, metadata in zip(
+                    columns['collection'], columns['id'], columns['document'], columns['metadata']
+                ):
+                    yield {
+                        'collection': collection,
+                        'id': record_id,
+                        'document': document,
+                        'metadata': json.loads(metadata)
+                    }
+
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for collection, col_data in data['data'].items():
+            for record_id, document, metadata in zip(col_data['ids'], col_data['documents'], col_data['metadatas']):
+                yield {
+                    'collection': collection,
+                    'id': record_id,
+                    'document': document,
+                    'metadata': metadata or {}
+                }
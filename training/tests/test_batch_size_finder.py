@@ -0,0 +1,41 @@
+import pytest
+import torch
+
+import batch_size_finder
+from batch_size_finder import BatchProbe, candidate_batch_sizes, find_batch_size, predict_peak_gb
+
+
+def test_candidate_batch_sizes_divide_the_effective_batch():
+    assert candidate_batch_sizes(12) == [1, 2, 3, 4, 6, 12]
+    assert candidate_batch_sizes(64, max_batch_size=16) == [1, 2, 4, 8, 16]
+
+
+def test_predict_peak_is_linear_in_batch_size():
+    probes = [BatchProbe(batch_size=1, peak_memory_gb=3.0), BatchProbe(batch_size=2, peak_memory_gb=4.0)]
+    assert predict_peak_gb(2.0, probes, 8) == pytest.approx(10.0)
+    # Never below a peak already measured
+    assert predict_peak_gb(2.0, [BatchProbe(batch_size=4, peak_memory_gb=6.0)], 1) == pytest.approx(6.0)
+
+
+def test_sizes_predicted_over_the_limit_are_never_run(monkeypatch):
+    class Model:
+        device = torch.device("cpu")
+
+    probed = []
+
+    def fake_probe(model, batch, memory_limit, bf16=False):
+        size = len(batch["input_ids"])
+        probed.append(size)
+        peak = 1.0 + 1.0 * size
+        return BatchProbe(batch_size=size, seconds=1.0, samples_per_second=size, peak_memory_gb=peak,
+                          fits=peak <= memory_limit)
+
+    monkeypatch.setattr(batch_size_finder, "current_memory_gb", lambda device: 1.0)
+    monkeypatch.setattr(batch_size_finder, "probe_batch_size", fake_probe)
+    monkeypatch.setattr(batch_size_finder, "longest_batch",
+                        lambda dataset, collator, size: {"input_ids": torch.zeros(size, 4, dtype=torch.long)})
+
+    best, probes = find_batch_size(Model(), None, None, 16, memory_limit=6.0, log=lambda message: None)
+    # 1, 2 and 4 need 2, 3 and 5 GB; 8 would need 9 GB and is skipped without running
+    assert probed == [1, 2, 4]
+    assert best.batch_size == 4
@@ -0,0 +1,36 @@
+from bucketing import LengthBucketSampler
+
+LENGTHS = [(i * 37) % 101 + 1 for i in range(200)]
+
+
+def test_order_depends_only_on_set_epoch():
+    sampler = LengthBucketSampler(LENGTHS, batch_size=4)
+    first = list(sampler)
+    # Iterating again (e.g. to probe lengths) does not advance the shuffle
+    assert list(sampler) == first
+    sampler.set_epoch(1)
+    second = list(sampler)
+    assert second != first
+    assert list(LengthBucketSampler(LENGTHS, batch_size=4)) == first
+    sampler.set_epoch(0)
+    assert list(sampler) == first
+
+
+def test_every_index_once_with_the_longest_batch_first():
+    sampler = LengthBucketSampler(LENGTHS, batch_size=4, bucket_batches=5)
+    order = list(sampler)
+    assert sorted(order) == list(range(len(LENGTHS)))
+    assert max(LENGTHS[i] for i in order[:4]) == max(LENGTHS)
+
+
+def test_batches_within_a_bucket_have_similar_lengths():
+    sampler = LengthBucketSampler(LENGTHS, batch_size=4, bucket_batches=50)
+    order = list(sampler)
+    batches = [[LENGTHS[i] for i in order[start:start + 4]] for start in range(0, len(order), 4)]
+    padded = sum(4 * max(batch) for batch in batches)
+    assert padded < 1.1 * sum(LENGTHS)
+
+
+def test_evaluation_order_is_sorted_longest_first():
+    order = list(LengthBucketSampler(LENGTHS, batch_size=4, shuffle=False))
+    assert [LENGTHS[i] for i in order] == sorted(LENGTHS, reverse=True)
@@ -0,0 +1,28 @@
+import io
+
+import pytest
+
+from chunking import TokenChunker
+
+TEXT = " ".join(f"word{i}" for i in range(100))
+
+
+def test_chunks_overlap_and_cover_the_text():
+    chunker = TokenChunker(tokenizer_name="", chunk_tokens=30, overlap_tokens=10)
+    chunks = chunker.chunk(TEXT)
+    assert [count for _, count in chunks] == [30, 30, 30, 30, 20]
+    assert chunks[0][0].split()[-10:] == chunks[1][0].split()[:10]
+    assert chunks[-1][0].endswith("word99")
+
+
+def test_streaming_matches_chunking_the_whole_text():
+    chunker = TokenChunker(tokenizer_name="", chunk_tokens=30, overlap_tokens=10)
+    words = TEXT.split()
+    lines = io.StringIO("\n".join(" ".join(words[i:i + 5]) for i in range(0, len(words), 5)))
+    streamed = list(chunker.chunk_stream(lines, buffer_chars=120))
+    assert [chunk.split() for chunk, _ in streamed] == [chunk.split() for chunk, _ in chunker.chunk(TEXT)]
+
+
+def test_overlap_must_be_smaller_than_the_chunk():
+    with pytest.raises(ValueError):
+        TokenChunker(tokenizer_name="", chunk_tokens=10, overlap_tokens=10)
@@ -0,0 +1,34 @@
+from dedup import NearDuplicateIndex
+
+STORY = ("Once upon a time a small fox lived at the edge of a quiet forest and every morning she walked "
+         "down to the river to watch the herons fish among the reeds while the sun rose over the hills")
+OTHER_STORY = ("The lighthouse keeper counted the ships that passed each night and wrote their names in a "
+               "blue notebook that he kept beside the lamp until the winter storms came")
+
+
+def test_near_duplicates_are_found_and_different_texts_are_not():
+    index = NearDuplicateIndex()
+    index.add("fox", index.signature(STORY))
+    assert index.find_duplicate(index.signature(STORY.upper())) == "fox"
+    assert index.find_duplicate(index.signature(STORY + " and then she went home")) == "fox"
+    assert index.find_duplicate(index.signature(OTHER_STORY)) is None
+
+
+def test_removed_documents_are_no_longer_matched():
+    index = NearDuplicateIndex()
+    index.add("fox", index.signature(STORY))
+    index.remove("fox")
+    assert index.find_duplicate(index.signature(STORY)) is None
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = NearDuplicateIndex()
+    index.add("fox", index.signature(STORY))
+    index.add("keeper", index.signature(OTHER_STORY))
+    index.save(tmp_path / "minhash.npz")
+
+    loaded = NearDuplicateIndex()
+    assert loaded.load(tmp_path / "minhash.npz")
+    assert loaded.find_duplicate(loaded.signature(OTHER_STORY)) == "keeper"
+    # Signatures made with other parameters are not comparable
+    assert not NearDuplicateIndex(num_perm=64, bands=8).load(tmp_path / "minhash.npz")
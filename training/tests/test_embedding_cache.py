@@ -0,0 +1,71 @@
+import threading
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+DIM = 8
+
+
+def vectors(count, seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((count, DIM)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def test_round_trip_survives_reopening(tmp_path):
+    texts = [f"story number {i}" for i in range(10)]
+    embeddings = vectors(len(texts))
+    cache = EmbeddingCache(str(tmp_path), "encoder", None, DIM)
+    cache.put_many(texts, embeddings)
+    cache.save()
+
+    reopened = EmbeddingCache(str(tmp_path), "encoder", None, DIM)
+    cached = reopened.get_many(texts + ["never stored"])
+    assert cached[-1] is None
+    np.testing.assert_allclose(np.stack(cached[:-1]), embeddings, atol=1e-3)
+    # Keys see normalized text
+    assert reopened.get_many(["  story   number 3 "])[0] is not None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "encoder", None, DIM, max_entries=4)
+    cache.put_many(["a", "b", "c", "d"], vectors(4))
+    cache.get_many(["a"])
+    cache.put_many(["e"], vectors(1, seed=1))
+    assert cache.get_many(["b"]) == [None]
+    assert all(embedding is not None for embedding in cache.get_many(["a", "e"]))
+
+
+def test_save_threshold_skips_the_index_write(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "encoder", None, DIM)
+    cache.put_many(["a", "b"], vectors(2))
+    cache.save(min_unsaved=3)
+    assert not cache.index_path.exists()
+    cache.save(min_unsaved=2)
+    assert cache.index_path.exists() and cache.unsaved == 0
+
+
+def test_concurrent_use(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "encoder", None, DIM, max_entries=64)
+    errors = []
+
+    def work(worker):
+        try:
+            for step in range(50):
+                texts = [f"worker {worker} text {step} {i}" for i in range(4)]
+                cache.get_many(texts)
+                cache.put_many(texts, vectors(4, seed=step))
+                cache.save(min_unsaved=8)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    cache.save()
+    assert len(EmbeddingCache(str(tmp_path), "encoder", None, DIM, max_entries=64).entries) == 64
+    assert not list(cache.cache_dir.glob("*.tmp"))
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from numpy_index import NumpyVectorStore
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+@pytest.fixture
+def collection(tmp_path):
+    collection = NumpyVectorStore(str(tmp_path)).get_or_create_collection("stories")
+    collection.upsert(
+        ids=["fox", "owl", "whale"],
+        embeddings=[unit(1, 0, 0), unit(0, 1, 0), unit(0, 0, 1)],
+        documents=["a fox", "an owl", "a whale"],
+        metadatas=[{"age_group": "3-5"}, {"age_group": "7-10"}, {"age_group": "3-5"}]
+    )
+    return collection
+
+
+def test_query_returns_exact_top_k_with_chroma_distances(collection):
+    result = collection.query(query_embeddings=[unit(1, 0.2, 0)], n_results=2)
+    assert result["ids"] == [["fox", "owl"]]
+    assert result["documents"] == [["a fox", "an owl"]]
+    cosine = float(unit(1, 0.2, 0) @ unit(1, 0, 0))
+    assert result["distances"][0][0] == pytest.approx(2 - 2 * cosine, abs=1e-5)
+
+
+def test_query_filters_on_metadata(collection):
+    result = collection.query(query_embeddings=[unit(0, 1, 0)], n_results=3, where={"age_group": "3-5"})
+    assert sorted(result["ids"][0]) == ["fox", "whale"]
+
+
+def test_upsert_replaces_existing_ids(collection):
+    collection.upsert(ids=["owl"], embeddings=[unit(1, 0, 0)], documents=["a snowy owl"], metadatas=[{}])
+    assert collection.count() == 3
+    assert collection.get(ids=["owl"])["documents"] == ["a snowy owl"]
+
+
+def test_upsert_rejects_duplicate_ids_without_writing(collection):
+    with pytest.raises(ValueError, match="duplicates: bear"):
+        collection.upsert(ids=["bear", "bear"], embeddings=[unit(1, 1, 0), unit(0, 1, 1)],
+                          documents=["a bear", "another bear"], metadatas=[{}, {}])
+    assert collection.count() == 3
+    assert collection.get(ids=["bear"])["ids"] == []
+
+
+def test_deletes_are_compacted_on_persist_and_reopen(tmp_path, collection):
+    collection.delete(ids=["owl"])
+    collection.persist()
+
+    reopened = NumpyVectorStore(str(tmp_path), read_only=True).get_or_create_collection("stories")
+    assert reopened.count() == 2
+    assert reopened.rows == 2
+    assert reopened.query(query_embeddings=[unit(0, 1, 0)], n_results=1)["ids"][0][0] in {"fox", "whale"}
+    with pytest.raises(PermissionError):
+        reopened.delete(ids=["fox"])
@@ -0,0 +1,70 @@
+import numpy as np
+import torch
+from transformers import Qwen2Config, Qwen2ForCausalLM
+
+from packing import PackedDataCollator, PackedTokenStore, pack_lengths
+from token_store import TokenStore, TokenStoreWriter
+
+EOS = 99
+PAD = 0
+
+
+def make_store(path, examples):
+    with TokenStoreWriter(path) as writer:
+        for ids in examples:
+            writer.add(ids)
+    return TokenStore(path)
+
+
+def test_pack_lengths_places_every_example_once_within_max_length():
+    lengths = [7, 3, 5, 2, 8, 1, 4]
+    blocks = pack_lengths(lengths, max_length=8)
+    assert sorted(index for block in blocks for index in block) == list(range(len(lengths)))
+    assert all(sum(lengths[index] for index in block) <= 8 for block in blocks)
+    assert len(blocks) == 4
+
+
+def test_packed_blocks_end_examples_in_eos_and_restart_positions(tmp_path):
+    store = make_store(tmp_path / "train", [[1, 2, 3], [4, 5, EOS], [6, 7, 8, 9, 10, 11]])
+    packed = PackedTokenStore(store, max_length=6, eos_token_id=EOS)
+
+    blocks = [packed[i] for i in range(len(packed))]
+    assert sorted(len(block["input_ids"]) for block in blocks) == [3, 4, 6]
+    assert packed.lengths.tolist() == [len(block["input_ids"]) for block in blocks]
+    for block in blocks:
+        starts = np.flatnonzero(block["position_ids"] == 0)
+        ends = np.append(starts[1:], len(block["input_ids"])) - 1
+        assert (block["input_ids"][ends] == EOS).all()
+    # An example already max_length long keeps its length; its last token becomes EOS
+    longest = max(blocks, key=lambda block: len(block["input_ids"]))
+    assert longest["input_ids"].tolist() == [6, 7, 8, 9, 10, EOS]
+
+
+def test_collator_masks_attention_across_examples():
+    feature = {"input_ids": np.array([11, 12, EOS, 21, 22, EOS]), "position_ids": np.array([0, 1, 2, 0, 1, 2])}
+    batch = PackedDataCollator(PAD, pad_to_multiple_of=8)([feature])
+
+    allowed = batch["attention_mask"][0, 0] == 0
+    segments = [0, 0, 0, 1, 1, 1]
+    for query in range(6):
+        for key in range(6):
+            assert allowed[query, key] == (key <= query and segments[key] == segments[query])
+    assert batch["labels"][0].tolist() == [-100, 12, EOS, -100, 22, EOS, -100, -100]
+    assert batch["position_ids"][0, :6].tolist() == [0, 1, 2, 0, 1, 2]
+    # Padding rows still attend to something, so softmax stays finite
+    assert allowed[6:].any(dim=1).all()
+
+
+def test_packed_forward_matches_separate_examples():
+    torch.manual_seed(0)
+    model = Qwen2ForCausalLM(Qwen2Config(vocab_size=128, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                                         num_attention_heads=4, num_key_value_heads=2, attn_implementation="eager"))
+    model.eval()
+    first, second = [5, 6, 7, EOS], [8, 9, EOS]
+    feature = {"input_ids": np.array(first + second), "position_ids": np.array([0, 1, 2, 3, 0, 1, 2])}
+    batch = PackedDataCollator(PAD, pad_to_multiple_of=1)([feature])
+    with torch.no_grad():
+        packed = model(input_ids=batch["input_ids"], position_ids=batch["position_ids"],
+                       attention_mask=batch["attention_mask"]).logits[0]
+        alone = [model(input_ids=torch.tensor([ids])).logits[0] for ids in (first, second)]
+    torch.testing.assert_close(packed, torch.cat(alone), atol=1e-4, rtol=1e-4)
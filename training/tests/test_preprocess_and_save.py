@@ -0,0 +1,17 @@
+from preprocess_and_save import VAL_PERCENT, example_split
+
+
+def chunk(story_id, index):
+    return {"collection": "stories", "id": f"{story_id}_chunk_{index}", "metadata": {"story_id": story_id}}
+
+
+def test_chunks_of_one_story_share_a_split():
+    for story in range(200):
+        splits = {example_split(chunk(f"books/story{story}.txt", index)) for index in range(8)}
+        assert len(splits) == 1
+
+
+def test_about_val_percent_of_stories_are_held_out():
+    records = [{"collection": "stories", "id": f"tales/{i}.csv_0", "metadata": {}} for i in range(5000)]
+    held_out = sum(example_split(record) == "val" for record in records) / len(records)
+    assert abs(held_out - VAL_PERCENT / 100) < 0.02
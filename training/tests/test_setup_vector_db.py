@@ -0,0 +1,177 @@
+import csv
+import json
+import re
+import threading
+import zlib
+
+import numpy as np
+import pytest
+
+pytest.importorskip("sentence_transformers")
+import setup_vector_db  # noqa: E402
+
+DIM = 32
+
+STORY = ("Once upon a time a small fox lived at the edge of a quiet forest and every morning "
+         "she walked down to the river to watch the herons fish among the reeds")
+OTHER_STORY = ("The lighthouse keeper counted the ships that passed each night and wrote their "
+               "names in a blue notebook that he kept beside the lamp")
+
+
+class HashingEncoder:
+    """Stands in for SentenceTransformer: hashed bag of words, so no model is downloaded"""
+
+    def __init__(self, name, revision=None):
+        pass
+
+    def get_sentence_embedding_dimension(self):
+        return DIM
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=False, show_progress_bar=False):
+        embeddings = np.zeros((len(texts), DIM), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r'\w+', text.lower()):
+                embeddings[row, zlib.crc32(word.encode('utf-8')) % DIM] += 1.0
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
+
+
+@pytest.fixture
+def make_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(setup_vector_db, "SentenceTransformer", HashingEncoder)
+
+    def make(**options):
+        settings = dict(db_path=str(tmp_path / "db"), backend="numpy", workers=0, batch_size=4,
+                        cache_dir=str(tmp_path / "cache"), tokenizer_name="", chunk_tokens=64, chunk_overlap=8)
+        settings.update(options)
+        return setup_vector_db.StoryForgeVectorDB(**settings)
+
+    return make
+
+
+def write_stories(path, stories):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['story'])
+        writer.writerows([story] for story in stories)
+
+
+def stored_documents(db):
+    return sorted(db.collections['stories'].get(include=['documents'])['documents'])
+
+
+def stored_ids(db):
+    return sorted(db.collections['stories'].get(include=[])['ids'])
+
+
+def test_unchanged_files_are_not_read_again(tmp_path, make_db, capsys):
+    datasets = tmp_path / "datasets"
+    write_stories(datasets / "a" / "one.csv", [STORY])
+    write_stories(datasets / "b" / "two.csv", [OTHER_STORY])
+    make_db().process_training_datasets(str(datasets))
+    capsys.readouterr()
+
+    make_db().process_training_datasets(str(datasets))
+    assert "0 files updated, 2 unchanged, 0 removed; 0 records upserted, 0 deleted" in capsys.readouterr().out
+
+
+def test_edited_and_deleted_files_update_only_their_records(tmp_path, make_db, capsys):
+    datasets = tmp_path / "datasets"
+    write_stories(datasets / "a" / "one.csv", [STORY, "A row that is removed again later"])
+    write_stories(datasets / "b" / "two.csv", [OTHER_STORY])
+    write_stories(datasets / "c" / "three.csv", ["A file nobody touches"])
+    make_db().process_training_datasets(str(datasets))
+    capsys.readouterr()
+
+    write_stories(datasets / "a" / "one.csv", [STORY])
+    (datasets / "b" / "two.csv").unlink()
+    make_db().process_training_datasets(str(datasets))
+
+    assert "1 files updated, 1 unchanged, 1 removed; 0 records upserted, 2 deleted" in capsys.readouterr().out
+    db = make_db(read_only=True)
+    assert stored_ids(db) == ["a/one.csv_0", "c/three.csv_0"]
+    assert stored_documents(db) == sorted([STORY, "A file nobody touches"])
+
+
+def test_ids_keep_the_file_extension(tmp_path, make_db):
+    datasets = tmp_path / "datasets"
+    write_stories(datasets / "tales" / "fox.csv", [STORY])
+    (datasets / "tales" / "fox.json").write_text(json.dumps([{"story": OTHER_STORY}]), encoding='utf-8')
+    make_db().process_training_datasets(str(datasets))
+
+    assert stored_ids(make_db(read_only=True)) == ["tales/fox.csv_0", "tales/fox.json_0"]
+
+
+@pytest.mark.parametrize("edited", [[OTHER_STORY], []], ids=["rewritten", "removed"])
+def test_dropped_duplicate_returns_when_kept_copy_changes(tmp_path, make_db, edited):
+    datasets = tmp_path / "datasets"
+    write_stories(datasets / "a" / "one.csv", [STORY, "A second story that stays as it is in the first file"])
+    write_stories(datasets / "b" / "two.csv", [STORY])
+    make_db().process_training_datasets(str(datasets))
+    assert stored_documents(make_db(read_only=True)).count(STORY) == 1
+
+    # The kept copy lives in a/one.csv; the file stays, only its row changes
+    write_stories(datasets / "a" / "one.csv", edited + ["A second story that stays as it is in the first file"])
+    make_db().process_training_datasets(str(datasets))
+
+    documents = stored_documents(make_db(read_only=True))
+    assert documents.count(STORY) == 1
+    assert sorted(documents) == sorted(edited + [STORY, "A second story that stays as it is in the first file"])
+
+
+def test_query_embeddings_are_cached_without_rewriting_the_index(tmp_path, make_db):
+    datasets = tmp_path / "datasets"
+    write_stories(datasets / "a" / "one.csv", [STORY, OTHER_STORY])
+    make_db().process_training_datasets(str(datasets))
+
+    db = make_db(read_only=True)
+    index_mtime = db.embedding_cache.index_path.stat().st_mtime_ns
+    assert db.search("a fox by the river", k=1)[0]['document'] == STORY
+    assert db.embedding_cache.index_path.stat().st_mtime_ns == index_mtime
+    db.close()
+
+    cache = make_db(read_only=True).embedding_cache
+    assert cache.get_many(["a fox by the river"])[0] is not None
+
+
+def test_cached_results_are_not_shared_between_callers(tmp_path, make_db):
+    datasets = tmp_path / "datasets"
+    write_stories(datasets / "a" / "one.csv", [STORY, OTHER_STORY])
+    make_db().process_training_datasets(str(datasets))
+
+    db = make_db(read_only=True)
+    first = db.search("the lighthouse keeper", k=2)
+    first[0]['metadata']['genre'] = 'changed'
+    first.clear()
+    second = db.search("the lighthouse keeper", k=2)
+    assert [hit['document'] for hit in second] == [OTHER_STORY, STORY]
+    assert second[0]['metadata']['genre'] == 'unknown'
+
+
+def test_concurrent_searches(tmp_path, make_db):
+    datasets = tmp_path / "datasets"
+    write_stories(datasets / "a" / "one.csv", [STORY, OTHER_STORY])
+    make_db().process_training_datasets(str(datasets))
+
+    db = make_db(read_only=True, query_cache_size=8)
+    queries = [f"{'a small fox by the river' if i % 2 else 'the lighthouse keeper counted ships'} {i}"
+               for i in range(64)]
+    expected = [STORY if i % 2 else OTHER_STORY for i in range(64)]
+    errors = []
+
+    def work(offset):
+        try:
+            for step in range(len(queries)):
+                i = (offset + step) % len(queries)
+                assert db.search(queries[i], k=1)[0]['document'] == expected[i]
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(8 * worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
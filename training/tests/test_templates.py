@@ -0,0 +1,42 @@
+from pathlib import Path
+
+import pytest
+from transformers import AutoTokenizer
+
+from templates import TemplateSplicer, format_example
+
+# The fine-tuned model directory in the repo carries the Qwen tokenizer and chat template
+TOKENIZER_PATH = Path(__file__).resolve().parent.parent / "models" / "storyforge-qwen-fine-tuned-merged"
+
+EXAMPLES = [
+    ("story", "Once upon a time, a small fox lived by the river.\n\nShe loved the herons.", {}),
+    ("story", "“Hello!” said the owl. 🦉 The moon was bright tonight…", {"age_group": "3-5", "genre": "bedtime"}),
+    ("prompt", "Write a story about a brave little lighthouse.", {"age_group": "7-10"}),
+]
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    if not TOKENIZER_PATH.exists():
+        pytest.skip(f"No tokenizer at {TOKENIZER_PATH}")
+    return AutoTokenizer.from_pretrained(str(TOKENIZER_PATH))
+
+
+@pytest.mark.parametrize("kind, body, metadata", EXAMPLES)
+def test_splicing_matches_tokenizing_the_rendered_example(tokenizer, kind, body, metadata):
+    body_ids = tokenizer(body, add_special_tokens=False)["input_ids"]
+    spliced = TemplateSplicer(tokenizer).splice(kind, body_ids, metadata, max_length=4096)
+    expected = tokenizer(format_example(tokenizer, kind, body, metadata), add_special_tokens=False)["input_ids"]
+    assert spliced == expected
+
+
+def test_truncation_cuts_the_body_and_keeps_the_framing(tokenizer):
+    kind, body, metadata = EXAMPLES[0]
+    splicer = TemplateSplicer(tokenizer)
+    prefix, suffix = splicer.frame(kind, metadata)
+    body_ids = tokenizer(body * 20, add_special_tokens=False)["input_ids"]
+    max_length = len(prefix) + len(suffix) + 10
+
+    spliced = splicer.splice(kind, body_ids, metadata, max_length)
+    assert len(spliced) == max_length
+    assert spliced == prefix + body_ids[:10] + suffix
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from token_store import StreamingTokenStore, TokenStore, TokenStoreCollator, TokenStoreWriter
+
+EXAMPLES = [[1, 2, 3], [4], [], [2 ** 32 - 1, 7]]
+
+
+def write_store(path):
+    with TokenStoreWriter(path) as writer:
+        writer.add(EXAMPLES[0], source="tales")
+        writer.add(EXAMPLES[1])
+        writer.add(EXAMPLES[2], source="books")
+        writer.add(EXAMPLES[3], source="tales")
+    return TokenStore(path)
+
+
+def test_round_trip(tmp_path):
+    store = write_store(tmp_path / "train")
+    assert len(store) == 4
+    assert [store[i]["input_ids"].tolist() for i in range(len(store))] == EXAMPLES
+    assert store.lengths.tolist() == [3, 1, 0, 2]
+    assert store.num_tokens == 6
+    codes, values = store.tag("source")
+    assert [values[code] for code in codes] == ["tales", "", "books", "tales"]
+    assert store.tag("collection") == (pytest.approx(np.zeros(4)), [""])
+
+
+def test_stores_of_another_format_are_refused(tmp_path):
+    write_store(tmp_path / "train")
+    (tmp_path / "train" / "meta.json").write_text('{"format": "tokens-uint16-v0"}', encoding='utf-8')
+    with pytest.raises(ValueError):
+        TokenStore(tmp_path / "train")
+
+
+def test_streaming_yields_every_example_once_per_epoch(tmp_path):
+    store = write_store(tmp_path / "train")
+    stream = StreamingTokenStore(store, shuffle_buffer_size=2)
+    first = [item["input_ids"].tolist() for item in stream]
+    assert sorted(first) == sorted(EXAMPLES)
+    assert [item["input_ids"].tolist() for item in stream] == first
+    stream.set_epoch(1)
+    assert sorted(item["input_ids"].tolist() for item in stream) == sorted(EXAMPLES)
+
+
+def test_collator_pads_and_masks_by_position(tmp_path):
+    store = write_store(tmp_path / "train")
+    # The pad id doubles as a real token of the first example
+    batch = TokenStoreCollator(pad_token_id=3, pad_to_multiple_of=4)([store[0], store[1]])
+    assert batch["input_ids"].tolist() == [[1, 2, 3, 3], [4, 3, 3, 3]]
+    assert batch["attention_mask"].tolist() == [[1, 1, 1, 0], [1, 0, 0, 0]]
+    assert batch["labels"].tolist() == [[1, 2, 3, -100], [4, -100, -100, -100]]
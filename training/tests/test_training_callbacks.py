@@ -0,0 +1,32 @@
+import torch
+from transformers import Qwen2Config, Qwen2ForCausalLM, Trainer, TrainerCallback, TrainingArguments
+
+from training_callbacks import MemoryCallback, run_first
+
+
+class Reporter(TrainerCallback):
+    """Reads logs in on_log like the report_to integrations do"""
+
+    def __init__(self):
+        self.logs = []
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        self.logs.append(dict(logs))
+
+
+def test_memory_metrics_reach_callbacks_that_run_before_it(tmp_path):
+    torch.manual_seed(0)
+    model = Qwen2ForCausalLM(Qwen2Config(vocab_size=64, hidden_size=16, intermediate_size=32, num_hidden_layers=1,
+                                         num_attention_heads=2, num_key_value_heads=1, use_cache=False))
+    examples = [{"input_ids": torch.arange(8) + i, "labels": torch.arange(8) + i} for i in range(8)]
+    args = TrainingArguments(output_dir=str(tmp_path), max_steps=2, per_device_train_batch_size=2, logging_steps=1,
+                             save_strategy="no", report_to=[], use_cpu=True, disable_tqdm=True)
+    reporter, memory = Reporter(), MemoryCallback()
+    trainer = Trainer(model=model, args=args, train_dataset=examples, callbacks=[reporter, memory])
+    run_first(trainer, memory)
+    trainer.train()
+
+    training_logs = [logs for logs in reporter.logs if "loss" in logs]
+    assert len(training_logs) == 2
+    assert all(logs["memory_peak_mb"] > 0 and logs["seq_len"] == 8 for logs in training_logs)
+    assert memory.summary()["steps"] == 2